@@ -1,4 +1,4 @@
-from flask import Flask, send_from_directory, session, redirect, url_for, request, render_template
+from flask import Flask, send_from_directory, session, redirect, url_for, request, render_template, jsonify
 from flask_login import login_required
 from routes.main_routes import main_bp
 from routes.api_routes import api_bp
@@ -6,6 +6,10 @@ from routes.admin_routes import admin_bp
 from routes.teacher_routes import teacher_bp
 from utils.database import init_db
 from utils.quiz_handler import convert_to_numeric_id
+from utils.firebase_service import flush_request_progress, get_firestore, use_memory_backend
+from utils.firestore_metrics import report_request
+from utils.warmup import start_warmup, mark_ready, warmup_status
+from utils.session_store import make_session_interface
 import os
 from firebase_admin import credentials, initialize_app, firestore
 from dotenv import load_dotenv
@@ -21,11 +25,20 @@ class QuizApp:
     def __init__(self):
         self.app = Flask(__name__)
         self.app.secret_key = os.getenv('FLASK_SECRET_KEY', 'dev-secret-key')
+        self._configure_sessions()
         self.init_firebase()
         self._register_blueprints()
         self._register_before_request()
+        self._register_after_request()
+        self._register_teardown_request()
         self._register_static_routes()
+        self._register_health_routes()
         self.register_error_handlers()
+        self.warm_up()
+
+    def _configure_sessions(self):
+        """Keep session data server-side, or in a compact cookie (SESSION_BACKEND)"""
+        self.app.session_interface = make_session_interface()
 
     def _register_blueprints(self):
         """Register all blueprints"""
@@ -67,6 +80,19 @@ class QuizApp:
             except Exception as e:
                 print(f"Error in enforce_pre_quiz: {e}")
 
+    def _register_after_request(self):
+        """Register after_request handlers"""
+        @self.app.after_request
+        def report_firestore_usage(response):
+            # Flush buffered progress first so those writes are included in the counts
+            flush_request_progress()
+            return report_request(response)
+
+    def _register_teardown_request(self):
+        """Register teardown_request handlers"""
+        # Write progress updates buffered during the request in one Firestore update
+        self.app.teardown_request(flush_request_progress)
+
     def _register_static_routes(self):
         """Register static file routes"""
         @self.app.route('/manifest.json')
@@ -77,6 +103,20 @@ class QuizApp:
         def service_worker():
             return send_from_directory('static', 'sw.js')
 
+    def _register_health_routes(self):
+        """Register the load balancer readiness check"""
+        @self.app.route('/ready')
+        def ready():
+            status = warmup_status()
+            return jsonify(status), 200 if status['ready'] else 503
+
+    def warm_up(self):
+        """Preload quizzes and lesson content in the background (WARMUP_ON_START=0 disables)"""
+        if os.getenv('WARMUP_ON_START', '1').strip().lower() in ('0', 'false', 'no'):
+            mark_ready()
+            return
+        start_warmup()
+
     def register_error_handlers(self):
         """Register error handlers for the app"""
         @self.app.errorhandler(404)
@@ -89,6 +129,10 @@ class QuizApp:
 
     def init_firebase(self):
         """Initialize Firebase application"""
+        if use_memory_backend():
+            # Offline/benchmark mode: in-process Firestore stand-in, no credentials needed
+            self.db = get_firestore()
+            return
         try:
             # Check if Firebase is already initialized
             self.db = firestore.client()
@@ -1,4 +1,9 @@
-from flask import Blueprint, render_template, request, redirect, url_for
+from flask import Blueprint, render_template, request, redirect, url_for, jsonify, current_app
+from utils.firebase_service import user_doc_cache_stats
+from utils.quiz_handler import invalidate_quiz_cache, quiz_cache_stats
+from utils.lesson_content import invalidate_lesson_info, lesson_cache_stats
+from utils.content_snapshot import snapshot_info
+from routes.teacher_routes import teacher_required
 import sqlite3
 
 admin_bp = Blueprint('admin', __name__)
@@ -20,6 +25,7 @@ def lesson_info_admin():
             VALUES (?, ?, ?, ?, ?, ?)
         ''', (module_name, organ_name, title, description, key_points, icon_class))
         conn.commit()
+        invalidate_lesson_info()
     
     cursor.execute('SELECT * FROM lesson_info ORDER BY id DESC')
     lessons = cursor.fetchall()
@@ -33,6 +39,7 @@ def lesson_info_delete(lesson_id):
     cursor.execute('DELETE FROM lesson_info WHERE id = ?', (lesson_id,))
     conn.commit()
     conn.close()
+    invalidate_lesson_info()
     return redirect(url_for('admin.lesson_info_admin'))
 
 @admin_bp.route('/lesson_info/edit/<int:lesson_id>', methods=['POST'])
@@ -52,4 +59,22 @@ def lesson_info_edit(lesson_id):
     ''', (module_name, organ_name, title, description, key_points, icon_class, lesson_id))
     conn.commit()
     conn.close()
-    return redirect(url_for('admin.lesson_info_admin'))
\ No newline at end of file
+    invalidate_lesson_info()
+    return redirect(url_for('admin.lesson_info_admin'))
+
+@admin_bp.route('/cache/stats')
+@teacher_required
+def cache_stats():
+    """Expose process-local cache counters for tuning sizes and TTLs."""
+    session_store = getattr(current_app.session_interface, 'store', None)
+    return jsonify({'user_docs': user_doc_cache_stats(), 'quizzes': quiz_cache_stats(),
+                    'lessons': lesson_cache_stats(), 'content_snapshot': snapshot_info(),
+                    'sessions': session_store.stats() if session_store else None})
+
+@admin_bp.route('/cache/quizzes/invalidate', methods=['POST'])
+@teacher_required
+def invalidate_quizzes():
+    """Drop cached quizzes after editing quiz content: {module_id?, quiz_type?}, empty for all."""
+    data = request.get_json(silent=True) or {}
+    invalidate_quiz_cache(data.get('module_id'), data.get('quiz_type'))
+    return jsonify({'success': True, 'quizzes': quiz_cache_stats()})
@@ -1,11 +1,12 @@
-from flask import Blueprint, jsonify, request, session, current_app, redirect, url_for
+from flask import Blueprint, jsonify, request, session, current_app, redirect, url_for, Response, stream_with_context
 from datetime import datetime
 from utils.database import get_db
-from utils.firebase_service import get_firestore
+from utils.firebase_service import get_firestore, forget_user_doc, get_user_record, reserve_teacher_code, find_teacher_by_code
+from utils.class_summary import refresh_student_summary
+from utils.progress import MODULE_IDS, StudentProgress, canonical_fields, parse_progress, user_progress_map
 from firebase_admin import storage, firestore
 from werkzeug.utils import secure_filename
 import os
-import sqlite3
 import requests
 import random
 import string
@@ -65,6 +66,7 @@ def student_profile():
             }
             
             user_ref.update(updates)
+            forget_user_doc(session['uid'])
             return jsonify({'success': True, 'message': 'Profile updated successfully'})
             
         except Exception as e:
@@ -205,6 +207,7 @@ def student_achievements():
             }
 
             user_ref.update(update_data)
+            forget_user_doc(session['uid'])
             return jsonify({'success': True, 'message': 'Profile updated successfully'})
             
         except Exception as e:
@@ -224,22 +227,22 @@ def connect_student_teacher():
             return jsonify({'error': 'Please provide a teacher code'}), 400
 
         db = get_firestore()
-        # Find teacher by code
-        teachers = db.collection('users').where('teacher_code', '==', code).where('role', '==', 'teacher').limit(1).get()
+        # Find teacher by code (one teacher_codes/{code} get)
+        teacher_id, teacher_data = find_teacher_by_code(code)
         
-        if not teachers:
+        if not teacher_id:
             return jsonify({'error': 'Invalid teacher code'}), 404
 
-        teacher = teachers[0]
-        teacher_data = teacher.to_dict()
-
         # Update student's teacher_id
+        student = get_user_record(session['uid']) or {}
         student_ref = db.collection('users').document(session['uid'])
         student_ref.update({
-            'teacher_id': teacher.id,
+            'teacher_id': teacher_id,
             'teacher_name': teacher_data.get('email'),  # or name if available
             'connected_at': firestore.SERVER_TIMESTAMP
         })
+        forget_user_doc(session['uid'])
+        refresh_student_summary(session['uid'], dict(student, teacher_id=teacher_id), student.get('teacher_id'))
 
         return jsonify({
             'success': True,
@@ -252,14 +255,8 @@ def connect_student_teacher():
         return jsonify({'error': 'Failed to connect to teacher'}), 500
 
 def generate_teacher_code():
-    """Generate a unique 6-character teacher code"""
-    while True:
-        code = ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
-        # Check if code exists
-        db = get_firestore()
-        existing = db.collection('users').where('teacher_code', '==', code).get()
-        if not existing:
-            return code
+    """Generate a candidate 6-character teacher code (reserved via reserve_teacher_code)"""
+    return ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
 
 @api_bp.route('/lesson_info/<module_name>/<organ_name>')
 def lesson_info_api(module_name, organ_name):
@@ -267,29 +264,12 @@ def lesson_info_api(module_name, organ_name):
         if not os.path.exists('lesson_info.db'):
             return jsonify({"error": "Database not found"}), 500
         
-        conn = sqlite3.connect('lesson_info.db')
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT title, description, key_points, icon_class FROM lesson_info
-            WHERE LOWER(module_name) = LOWER(?) AND LOWER(organ_name) = LOWER(?)
-        ''', (module_name, organ_name))
-        row = cursor.fetchone()
-        
-        conn.close()
-        
-        if not row:
+        from utils.lesson_content import get_lesson_info
+        info = get_lesson_info(module_name, organ_name)
+        if not info:
             return jsonify({"error": "No info found"}), 404
         
-        title, description, key_points, icon_class = row
-        key_points_list = [point.strip() for point in key_points.split('\n') if point.strip()] if key_points else []
-        
-        return jsonify({
-            "title": title,
-            "description": description,
-            "key_points": key_points_list,
-            "icon_class": icon_class or "fa-info-circle"
-        })
+        return jsonify(info)
             
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -349,31 +329,13 @@ def api_progress():
         server_progress = {}
         if uid:
             try:
-                from utils.firebase_service import get_user_progress, award_badge, map_module_to_badge
-                server_progress = get_user_progress(uid) or {}
-                # normalize keys to strings
-                if isinstance(server_progress, dict):
-                    server_progress = {str(k): v for k, v in server_progress.items()}
+                from utils.firebase_service import get_user_progress, badge_engine
+                progress = get_user_progress(uid)
+                server_progress = progress.to_dict()
                 # cache the normalized progress in session for quick access
                 session['user_progress'] = server_progress
-                # Award badges for any modules that are completed but not yet awarded
-                try:
-                    for mid, entry in (server_progress.items() if isinstance(server_progress, dict) else []):
-                        if not isinstance(entry, dict):
-                            continue
-                        pre_ok = bool(entry.get('pre_quiz_completed') or entry.get('preQuizCompleted'))
-                        post_ok = bool(entry.get('post_quiz_completed') or entry.get('postQuizCompleted'))
-                        percent = entry.get('percent') or entry.get('progress')
-                        try:
-                            pct = float(percent)
-                        except Exception:
-                            pct = 0.0
-                        if (pre_ok and post_ok) or pct >= 100.0:
-                            badge_name = map_module_to_badge(str(mid))
-                            if badge_name:
-                                award_badge(uid, badge_name, reason=f"Completed module {mid} 100%")
-                except Exception:
-                    pass
+                # Award badges for any modules that are completed but not yet awarded (one write at most)
+                badge_engine.award_missing(uid, progress)
                 current_app.logger.info('api_progress: returned Firestore progress for uid=%s keys=%s', uid, list(server_progress.keys())[:20])
                 return jsonify(server_progress), 200
             except Exception as e:
@@ -404,15 +366,15 @@ def api_login():
         # Lookup user data, progress and role by uid if available, else by email
         try:
             from utils.firebase_service import get_user_progress, get_user_data, get_user_record
-            user_progress = {}
+            progress = StudentProgress()
             user_doc = None
             if uid:
-                user_progress = get_user_progress(uid) or {}
+                progress = get_user_progress(uid)
                 user_doc = get_user_record(uid)
             else:
                 # fallback: lookup by email
                 user_doc = get_user_data(email)
-                user_progress = (user_doc.get('progress') if user_doc else {}) or {}
+                progress = parse_progress(user_progress_map(user_doc))
             
             # Get user role from Firestore document, default to 'student'
             user_role = 'student'
@@ -430,47 +392,16 @@ def api_login():
                     pass
         except Exception as e:
             current_app.logger.exception('Failed to read user progress from Firestore: %s', e)
-            user_progress = {}
+            progress = StudentProgress()
 
-        # Normalize server-side progress keys to strings
-        normalized_server = {}
-        try:
-            if isinstance(user_progress, dict):
-                normalized_server = {str(k): v for k, v in user_progress.items()}
-        except Exception:
-            normalized_server = {}
+        # Merge client-provided progress (client takes precedence) and give every
+        # canonical module explicit pre/post quiz flags
+        progress.merge(client_progress)
+        normalized_server = progress.to_dict(ensure_modules=MODULE_IDS)
 
-        # Merge client-provided progress (client takes precedence)
-        try:
-            if isinstance(client_progress, dict):
-                for k, v in client_progress.items():
-                    normalized_server[str(k)] = v
-        except Exception:
-            current_app.logger.exception('Failed to merge client progress')
-
-        # Ensure explicit per-module pre/post quiz flags for canonical modules
-        try:
-            module_ids = ['1', '2', '3', '5', '6', '7']
-            for mid in module_ids:
-                entry = normalized_server.get(mid)
-                if isinstance(entry, dict):
-                    # Preserve explicit True values; ensure keys exist and are boolean
-                    if entry.get('pre_quiz_completed') is True:
-                        entry['pre_quiz_completed'] = True
-                    else:
-                        entry.setdefault('pre_quiz_completed', False)
-                    entry.setdefault('post_quiz_completed', False)
-                    normalized_server[mid] = entry
-                else:
-                    # Non-dict entries (or missing) -> normalize to structured dict
-                    normalized_server[mid] = {
-                        'pre_quiz_completed': True if entry is True else False,
-                        'post_quiz_completed': False
-                    }
-        except Exception:
-            current_app.logger.exception('Failed to normalize module progress keys')
-
-        # Store progress and user info in session
+        # Store progress and user info in session, under a new session id (server-side store)
+        if hasattr(session, 'regenerate'):
+            session.regenerate()
         session['user_progress'] = normalized_server
         session['role'] = user_role
         if email:
@@ -485,26 +416,10 @@ def api_login():
         except Exception:
             current_app.logger.info('api_login: session user_progress and role set')
 
-        # After login, award any badges for modules already completed in Firestore
-        try:
-            if uid and isinstance(session.get('user_progress'), dict):
-                from utils.firebase_service import award_badge, map_module_to_badge
-                for mid, entry in session['user_progress'].items():
-                    if not isinstance(entry, dict):
-                        continue
-                    pre_ok = bool(entry.get('pre_quiz_completed') or entry.get('preQuizCompleted'))
-                    post_ok = bool(entry.get('post_quiz_completed') or entry.get('postQuizCompleted'))
-                    percent = entry.get('percent') or entry.get('progress')
-                    try:
-                        pct = float(percent)
-                    except Exception:
-                        pct = 0.0
-                    if (pre_ok and post_ok) or pct >= 100.0:
-                        badge_name = map_module_to_badge(str(mid))
-                        if badge_name:
-                            award_badge(uid, badge_name, reason=f"Completed module {mid} 100%")
-        except Exception:
-            pass
+        # After login, award any badges for modules already completed in Firestore (one write at most)
+        if uid:
+            from utils.firebase_service import badge_engine
+            badge_engine.award_missing(uid, progress)
 
         # Return progress and role to client
         return jsonify({
@@ -522,17 +437,7 @@ def api_login():
 @api_bp.route('/check_pre_quiz/<module_id>')
 def api_check_pre_quiz(module_id):
     try:
-        user_progress = session.get('user_progress', {}) or {}
-        # Normalize access to module key
-        module_progress = user_progress.get(str(module_id), user_progress.get(int(module_id) if module_id.isdigit() else module_id, {}))
-
-        completed = False
-        # Accept explicit boolean True or explicit pre_quiz_completed True
-        if module_progress is True:
-            completed = True
-        elif isinstance(module_progress, dict) and module_progress.get('pre_quiz_completed') is True:
-            completed = True
-
+        completed = parse_progress(session.get('user_progress')).get(module_id).pre_quiz_completed
         return jsonify({'completed': completed}), 200
     except Exception as e:
         current_app.logger.exception('api_check_pre_quiz error: %s', e)
@@ -547,45 +452,32 @@ def sync_quiz_state(module_id, quiz_type):
         session[sess_key] = True
 
         # Update structured progress in session
-        up = session.get('user_progress', {}) or {}
-        mid = str(module_id)
-        mod_entry = up.get(mid, {})
-        if not isinstance(mod_entry, dict):
-            mod_entry = {}
-        
+        progress = parse_progress(session.get('user_progress'))
+        mod_entry = progress.module(module_id)
         if quiz_type == 'pre':
-            mod_entry['pre_quiz_completed'] = True
+            mod_entry.pre_quiz_completed = True
         else:
-            mod_entry['post_quiz_completed'] = True
-        
-        up[mid] = mod_entry
-        session['user_progress'] = up
+            mod_entry.post_quiz_completed = True
+        session['user_progress'] = progress.to_dict()
 
         # CRITICAL FIX: Also save to Firestore if user is logged in
         uid = session.get('uid')
         if uid:
-            from utils.firebase_service import update_user_progress, award_badge, map_module_to_badge
+            from utils.firebase_service import complete_quiz
             
             # Prepare the progress update for Firestore
             progress_update = {
-                'pre_quiz_completed': mod_entry.get('pre_quiz_completed', False),
-                'post_quiz_completed': mod_entry.get('post_quiz_completed', False)
+                'pre_quiz_completed': mod_entry.pre_quiz_completed,
+                'post_quiz_completed': mod_entry.post_quiz_completed
             }
             
-            # Save to Firestore
-            firestore_success = update_user_progress(uid, module_id, progress_update)
+            # Save to Firestore and award the module badge (if now complete) in one transaction
+            outcome = complete_quiz(uid, module_id, progress_update)
             
-            if firestore_success:
+            if outcome['success']:
                 current_app.logger.info(f'Successfully saved quiz completion to Firestore: uid={uid}, module={module_id}, quiz_type={quiz_type}')
-                # If both quizzes are now completed, award module badge
-                try:
-                    if progress_update.get('pre_quiz_completed') and progress_update.get('post_quiz_completed'):
-                        badge_name = map_module_to_badge(str(module_id))
-                        if badge_name:
-                            if award_badge(uid, badge_name, reason=f"Completed module {module_id} 100%"):
-                                current_app.logger.info(f"Awarded badge '{badge_name}' to uid={uid} for module {module_id}")
-                except Exception as e:
-                    current_app.logger.warning(f'Badge award failed for uid={uid}, module={module_id}: {e}')
+                if outcome['badge']:
+                    current_app.logger.info(f"Awarded badge '{outcome['badge']}' to uid={uid} for module {module_id}")
             else:
                 current_app.logger.warning(f'Failed to save quiz completion to Firestore: uid={uid}, module={module_id}, quiz_type={quiz_type}')
         else:
@@ -608,28 +500,17 @@ def sync_all_progress():
         user_progress = session.get('user_progress', {})
         if not isinstance(user_progress, dict):
             return jsonify({'success': True, 'message': 'No progress to sync'}), 200
+        progress = parse_progress(user_progress)
         
-        from utils.firebase_service import update_user_progress
+        from utils.firebase_service import update_user_progress, flush_progress_updates
         
-        sync_results = []
-        for module_id, progress_data in user_progress.items():
-            if isinstance(progress_data, dict):
-                success = update_user_progress(uid, str(module_id), progress_data)
-                sync_results.append({
-                    'module_id': module_id,
-                    'success': success
-                })
-            else:
-                # Handle legacy boolean values
-                progress_update = {
-                    'pre_quiz_completed': True if progress_data is True else False,
-                    'post_quiz_completed': False
-                }
-                success = update_user_progress(uid, str(module_id), progress_update)
-                sync_results.append({
-                    'module_id': module_id,
-                    'success': success
-                })
+        # Updates are buffered and merged, then written to Firestore in a single update
+        module_ids = []
+        for module_id, entry in progress.modules.items():
+            update_user_progress(uid, module_id, entry.to_dict())
+            module_ids.append(module_id)
+        success = flush_progress_updates(uid)
+        sync_results = [{'module_id': module_id, 'success': success} for module_id in module_ids]
         
         failed_syncs = [r for r in sync_results if not r['success']]
         
@@ -883,37 +764,27 @@ def sync_module_progress(module_id):
         if not data or 'progress' not in data:
             return jsonify({'error': 'No progress data provided'}), 400
 
-        progress_data = data['progress']
-        
+        if not isinstance(data['progress'], dict):
+            return jsonify({'error': 'progress must be an object'}), 400
+        # Only the fields the client sent, under their canonical names
+        progress_data = canonical_fields(data['progress'])
+
         # Update session progress
-        up = session.get('user_progress', {}) or {}
+        progress = parse_progress(session.get('user_progress'))
         mid = str(module_id)
-        up[mid] = up.get(mid, {})
-        up[mid].update(progress_data)
-        session['user_progress'] = up
+        progress.module(mid).update(progress_data)
+        session['user_progress'] = progress.to_dict()
 
         # Update Firestore if user is logged in
         uid = session.get('uid')
         if uid:
-            from utils.firebase_service import update_user_progress, award_badge, map_module_to_badge
-            update_user_progress(uid, mid, progress_data)
-            # After updating, if progress indicates completion, award badge
-            try:
-                pre_ok = bool(up[mid].get('pre_quiz_completed'))
-                post_ok = bool(up[mid].get('post_quiz_completed'))
-                percent = up[mid].get('percent') or up[mid].get('progress')
-                pct = 0.0
-                try:
-                    pct = float(percent)
-                except Exception:
-                    pct = 0.0
-                if (pre_ok and post_ok) or pct >= 100.0:
-                    badge_name = map_module_to_badge(mid)
-                    if badge_name:
-                        if award_badge(uid, badge_name, reason=f"Completed module {mid} 100%"):
-                            current_app.logger.info(f"Awarded badge '{badge_name}' to uid={uid} for module {mid}")
-            except Exception as e:
-                current_app.logger.warning(f'Badge award failed in progress sync for uid={uid}, module={mid}: {e}')
+            from utils.firebase_service import complete_quiz
+            # Update progress and, if it indicates completion, award the badge in one transaction
+            outcome = complete_quiz(uid, mid, progress_data)
+            if outcome['badge']:
+                current_app.logger.info(f"Awarded badge '{outcome['badge']}' to uid={uid} for module {mid}")
+            elif not outcome['success']:
+                current_app.logger.warning(f'Progress sync to Firestore failed for uid={uid}, module={mid}')
             return jsonify({'status': 'success', 'message': 'Progress synced to Firestore'})
         
         return jsonify({'status': 'success', 'message': 'Progress saved to session'})
@@ -968,6 +839,102 @@ def get_student_resources():
         current_app.logger.error(f"Error fetching student resources: {e}")
         return jsonify({'error': 'Failed to fetch resources'}), 500
 
+@api_bp.route('/events')
+def event_stream():
+    """Server-sent events: 'notifications' for every user, plus 'progress' (class summary)
+    for teachers. Replaces polling /api/teacher/notifications and the progress endpoints.
+    """
+    uid = session.get('uid')
+    if not uid:
+        return jsonify({'error': 'Not authorized'}), 401
+    from utils import events
+    from utils.notifications import get_inbox
+    if not events.EVENTS_ENABLED:
+        # 204 tells EventSource not to reconnect; the pages keep polling
+        return '', 204
+    try:
+        # Make sure the inbox summary exists (older accounts get it rebuilt once)
+        get_inbox(uid)
+    except Exception as e:
+        current_app.logger.error(f"Error preparing inbox for events: {e}")
+    channels = [('inbox', uid)]
+    if session.get('role') == 'teacher':
+        channels.append(('class', uid))
+    try:
+        sub = events.subscribe(channels)
+    except Exception as e:
+        current_app.logger.error(f"Error starting event listeners: {e}")
+        return jsonify({'error': 'Live updates unavailable'}), 503
+    return Response(stream_with_context(events.stream(sub)), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        # Stop nginx-style proxies from buffering the stream
+        'X-Accel-Buffering': 'no'
+    })
+
+@api_bp.route('/activities/<activity_id>/submissions', methods=['POST'])
+def submit_activity(activity_id):
+    """Store a quiz/activity submission and update the quiz's running statistics."""
+    try:
+        student_id = session.get('uid')
+        if not student_id:
+            return jsonify({'error': 'Not authorized'}), 401
+        data = request.get_json(silent=True) or {}
+        allowed = ('answers', 'score', 'totalQuestions', 'answeredQuestions', 'correctAnswers', 'status')
+        submission = {k: data[k] for k in allowed if k in data}
+        submission['studentId'] = student_id
+
+        from utils.quiz_submissions import record_submission
+        submission_id = record_submission(activity_id, submission)
+        if submission_id is None:
+            return jsonify({'error': 'Activity not found'}), 404
+        return jsonify({'success': True, 'id': submission_id})
+    except Exception as e:
+        current_app.logger.error(f"Error submitting activity {activity_id}: {e}")
+        return jsonify({'error': 'Failed to submit activity'}), 500
+
+@api_bp.route('/quizzes/<module_id>/<quiz_type>/grade', methods=['POST'])
+def grade_quiz(module_id, quiz_type):
+    """Grade one attempt server-side: { answers, attempt_id?, attempted_at? }.
+    answers is a list (or {question index: option index}) of selected option indexes.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        from utils.quiz_grading import grade_attempts
+        result = grade_attempts([dict(data, module_id=module_id, quiz_type=quiz_type)],
+                                uid=session.get('uid'))[0]
+        if 'error' in result:
+            return jsonify({'success': False, 'error': result['error']}), 400
+        return jsonify(dict(result, success=True))
+    except Exception as e:
+        current_app.logger.error(f"Error grading quiz {module_id}/{quiz_type}: {e}")
+        return jsonify({'error': 'Failed to grade quiz'}), 500
+
+@api_bp.route('/quizzes/grade', methods=['POST'])
+def grade_quiz_batch():
+    """Grade many attempts in one request (offline replays): { attempts: [...] }.
+    Each attempt is { module_id, quiz_type, answers, attempt_id?, attempted_at? };
+    results come back in the same order, with { error } for attempts that failed.
+    """
+    try:
+        uid = session.get('uid')
+        if not uid:
+            return jsonify({'error': 'Not authorized'}), 401
+        attempts = (request.get_json(silent=True) or {}).get('attempts')
+        from utils.quiz_grading import MAX_ATTEMPTS_PER_REQUEST, grade_attempts
+        if not isinstance(attempts, list) or not attempts:
+            return jsonify({'error': 'attempts must be a non-empty list'}), 400
+        if len(attempts) > MAX_ATTEMPTS_PER_REQUEST:
+            return jsonify({'error': f'At most {MAX_ATTEMPTS_PER_REQUEST} attempts per request'}), 400
+        results = grade_attempts(attempts, uid=uid, source='replay')
+        return jsonify({
+            'success': True,
+            'results': results,
+            'graded': sum(1 for r in results if 'error' not in r)
+        })
+    except Exception as e:
+        current_app.logger.error(f"Error grading quiz batch: {e}")
+        return jsonify({'error': 'Failed to grade attempts'}), 500
+
 @api_bp.route('/api/teacher/code/generate', methods=['POST'])
 def generate_new_teacher_code():
     """Generate and save a new teacher code for the current teacher"""
@@ -976,21 +943,14 @@ def generate_new_teacher_code():
         if not uid:
             return jsonify({'error': 'Not authorized'}), 401
             
-        db = get_firestore()
-        teacher_ref = db.collection('users').document(uid)
-        teacher_doc = teacher_ref.get()
-        
-        if not teacher_doc.exists or teacher_doc.get('role') != 'teacher':
+        teacher = get_user_record(uid)
+        if not teacher or teacher.get('role') != 'teacher':
             return jsonify({'error': 'Not a teacher account'}), 403
         
-        # Generate new unique code
-        code = generate_teacher_code()
-        
-        # Save to teacher document
-        teacher_ref.update({
-            'teacher_code': code,
-            'updated_at': firestore.SERVER_TIMESTAMP
-        })
+        # Reserve a new unique code and save it to the teacher document
+        code = reserve_teacher_code(uid, generate_teacher_code, {'updated_at': firestore.SERVER_TIMESTAMP})
+        if not code:
+            return jsonify({'error': 'Failed to generate code'}), 500
         
         return jsonify({
             'success': True,
@@ -1017,25 +977,24 @@ def connect_to_teacher():
             
         db = get_firestore()
         
-        # Find teacher by code - must filter by role to ensure we get a teacher
-        teachers = db.collection('users').where('teacher_code', '==', teacher_code).where('role', '==', 'teacher').limit(1).get()
-        if not teachers:
+        # Find teacher by code via the teacher_codes directory (only teachers own codes)
+        teacher_uid, teacher_data = find_teacher_by_code(teacher_code)
+        if not teacher_uid:
             return jsonify({'error': 'Invalid teacher code'}), 404
-            
-        teacher = teachers[0]
-        teacher_data = teacher.to_dict()
         
-        # Use teacher.id (Firestore document ID) which should be the Firebase Auth UID
+        # teacher_uid is the teacher's Firestore document ID, which should be the Firebase Auth UID
         # This ensures the teacher_id matches what the teacher endpoint queries for
-        teacher_uid = teacher.id
         
         # Update student document with teacher reference
+        student = get_user_record(student_uid) or {}
         student_ref = db.collection('users').document(student_uid)
         student_ref.update({
             'teacher_id': teacher_uid,
             'teacher_code': teacher_code,
             'updated_at': firestore.SERVER_TIMESTAMP
         })
+        forget_user_doc(student_uid)
+        refresh_student_summary(student_uid, dict(student, teacher_id=teacher_uid), student.get('teacher_id'))
         
         return jsonify({
             'success': True,
@@ -1,8 +1,10 @@
 from flask import Blueprint, render_template, session, redirect, url_for, request
 from utils.quiz_handler import get_quiz_data, convert_to_numeric_id
 from functools import wraps
+import json
 from flask import flash, abort
 from utils.firebase_service import get_user_record
+from utils.progress import parse_progress
 
 main_bp = Blueprint('main', __name__)
 
@@ -52,39 +54,46 @@ def quiz(module_id, quiz_type):
         # Also update the structured session['user_progress'] so API /api/progress and
         # client-side guards can rely on a consistent nested shape: { '<module_id>': { 'pre_quiz_completed': True } }
         try:
-            up = session.get('user_progress') or {}
-            # normalize module key to string
+            progress = parse_progress(session.get('user_progress'))
             mid = str(numeric_id)
-            mod_entry = up.get(mid) if isinstance(up, dict) else None
-            if not isinstance(mod_entry, dict):
-                mod_entry = {}
+            mod_entry = progress.module(mid)
             if quiz_type == 'pre':
-                mod_entry['pre_quiz_completed'] = True
+                mod_entry.pre_quiz_completed = True
             else:
-                mod_entry['post_quiz_completed'] = True
-            up[mid] = mod_entry
-            session['user_progress'] = up
+                mod_entry.post_quiz_completed = True
+            session['user_progress'] = progress.to_dict()
             print('Updated session["user_progress"] for module', mid, session['user_progress'].get(mid))
         except Exception as e:
             print('Failed to update session user_progress:', e)
 
+        # Grade the submitted answers server-side (and store the response record)
+        graded = None
+        if request.form.get('answers'):
+            try:
+                from utils.quiz_grading import grade_attempts
+                graded = grade_attempts([{
+                    'module_id': numeric_id,
+                    'quiz_type': quiz_type,
+                    'answers': json.loads(request.form['answers'])
+                }], uid=session.get('uid'))[0]
+                if 'error' in graded:
+                    print('Quiz grading failed:', graded['error'])
+                    graded = None
+            except Exception as e:
+                print('Quiz grading error:', e)
+                graded = None
+
         # Try to update Firestore server-side progress if we have a uid in session
         try:
             uid = session.get('uid')
             if uid:
                 try:
                     from utils.firebase_service import update_user_progress
-                    # collect score if present in form
-                    score = None
-                    try:
-                        score = float(request.form.get('score') or request.form.get('score', type=float) or 0)
-                    except Exception:
-                        # attempt to parse JSON body
-                        try:
-                            j = request.get_json(silent=True) or {}
-                            score = float(j.get('score')) if j.get('score') is not None else None
-                        except Exception:
-                            score = None
+                    # Only a server-graded score is stored; without gradable answers the
+                    # attempt counts as completed with no score (client scores are ignored)
+                    score = graded['score'] if graded else None
+                    if graded is None:
+                        print(f'Quiz {numeric_id}/{quiz_type} submitted without gradable answers; storing no score')
 
                     progress_update = {}
                     if quiz_type == 'pre':
@@ -106,17 +115,14 @@ def quiz(module_id, quiz_type):
 
         # Return JSON containing a server-side canonical redirect target so client follows it
         redirect_target = url_for('main.module_page', module_id=numeric_id) if quiz_type == 'pre' else url_for('main.menu')
-        return {'status': 'success', 'redirect': redirect_target}
+        return {'status': 'success', 'redirect': redirect_target, 'grade': graded}
 
     if quiz_type == 'post' and numeric_id in {1, 2, 3, 5, 6, 7}:
         pre_quiz_key = f'module_{numeric_id}_pre_quiz'
-        user_progress = session.get('user_progress', {})
-        # Debug log user_progress seen in session
-        print('DEBUG: session user_progress type:', type(user_progress), 'content keys sample:', list(user_progress.keys())[:5])
-        # Try both string and numeric keys for module progress
-        module_progress = user_progress.get(str(numeric_id), user_progress.get(numeric_id, {}))
-        print('DEBUG: module_progress for', numeric_id, '->', module_progress)
-        pre_quiz_completed = _pre_quiz_completed_from(module_progress)
+        module_progress = parse_progress(session.get('user_progress')).get(numeric_id)
+        print('DEBUG: module_progress for', numeric_id, '->', module_progress.to_dict())
+        # Only the explicit flag unlocks the post quiz (a stray score must not cause redirect loops)
+        pre_quiz_completed = module_progress.pre_quiz_completed
         print('DEBUG: determined pre_quiz_completed =', pre_quiz_completed)
         if not (session.get(pre_quiz_key, False) or pre_quiz_completed):
             return redirect(url_for('main.quiz', module_id=numeric_id, quiz_type='pre'))
@@ -135,15 +141,8 @@ def module_page(module_id):
     if uid:
         try:
             from utils.firebase_service import get_user_progress
-            progress = get_user_progress(uid)
-            module_progress = progress.get(str(numeric_id), {})
-            if isinstance(module_progress, dict):
-                # Check explicit pre_quiz_completed flag or legacy score
-                pre_quiz_done = (
-                    module_progress.get('pre_quiz_completed') is True or
-                    (isinstance(module_progress.get('pre_quiz_score'), (int, float)) and 
-                     module_progress['pre_quiz_score'] > 0)
-                )
+            # Explicit pre_quiz_completed flag or legacy score
+            pre_quiz_done = get_user_progress(uid).get(numeric_id).pre_quiz_done
         except Exception as e:
             print(f'Failed to check Firebase progress: {e}')
 
@@ -342,22 +341,3 @@ def class_activities():
     if 'uid' not in session:
         return redirect(url_for('main.home'))
     return render_template('class_activities.html')
-
-# Helper: robustly determine if pre-quiz was completed from a module progress object
-def _pre_quiz_completed_from(progress_obj):
-    try:
-        # Only accept an explicit boolean True from server-side progress.
-        # This avoids treating missing/undefined/partial objects as completed and prevents redirect loops.
-        if isinstance(progress_obj, bool):
-            return progress_obj is True
-        if not isinstance(progress_obj, dict):
-            return False
-        # Direct boolean field required
-        if 'pre_quiz_completed' in progress_obj and progress_obj.get('pre_quiz_completed') is True:
-            return True
-        # Also accept legacy field name if it exists and is exactly True
-        if 'preQuizCompleted' in progress_obj and progress_obj.get('preQuizCompleted') is True:
-            return True
-        return False
-    except Exception:
-        return False
\ No newline at end of file
@@ -2,10 +2,17 @@ from flask import Blueprint, jsonify, request, session
 from flask import Response
 from firebase_admin import firestore, storage
 from datetime import datetime
-from utils.firebase_service import get_firestore
+from utils.firebase_service import get_firestore, forget_user_doc, get_user_record, reserve_teacher_code, find_teacher_by_code
+from utils.field_paths import DOCUMENT_ID
+from utils.class_summary import get_class_summary, refresh_student_summary
+from utils.progress import parse_progress, user_progress_map
+from utils.quiz_submissions import quiz_stats, rebuild_quiz_stats
+from utils.notifications import fan_out, fan_out_to_students, get_inbox, inbox_payload, mark_read
 from functools import wraps
 import string
 import random
+import base64
+import json
 from werkzeug.utils import secure_filename
 
 teacher_bp = Blueprint('teacher', __name__)
@@ -35,47 +42,32 @@ def validate_teacher_ownership(f):
     return decorated_function
 
 def generate_teacher_code():
-    """Generate a unique 8-character teacher code with prefix"""
+    """Generate a candidate 10-character teacher code with prefix.
+    Uniqueness is enforced when the code is reserved in the teacher_codes directory.
+    """
     chars = string.ascii_uppercase + string.digits
     prefix = 'TCH'  # Teacher code prefix
     timestamp = datetime.now().strftime('%y%m')  # YearMonth
-    
-    while True:
-        # Generate 3 random characters
-        random_part = ''.join(random.choices(chars, k=3))
-        code = f"{prefix}{timestamp}{random_part}"
-        
-        db = get_firestore()
-        # Check if code already exists
-        existing = db.collection('users').where('teacher_code', '==', code).get()
-        if not len(list(existing)):
-            # Index the code for faster lookups
-            teacher_codes_ref = db.collection('teacher_codes')
-            teacher_codes_ref.document(code).set({
-                'created_at': firestore.SERVER_TIMESTAMP,
-                'active': True
-            })
-            return code
+    # Generate 3 random characters
+    random_part = ''.join(random.choices(chars, k=3))
+    return f"{prefix}{timestamp}{random_part}"
 
 @teacher_bp.route('/code/generate', methods=['POST'])
 @teacher_required
 def generate_new_code():
     """Generate a new teacher code for the current teacher"""
     try:
-        db = get_firestore()
         teacher_id = session.get('uid')
         if not teacher_id:
             return jsonify({'error': 'Not authenticated'}), 401
             
-        new_code = generate_teacher_code()
-        teacher_ref = db.collection('users').document(teacher_id)
-        
-        # Update teacher document with new code
-        teacher_ref.update({
-            'teacher_code': new_code,
+        # Reserve the code in the directory and store it on the teacher document
+        new_code = reserve_teacher_code(teacher_id, generate_teacher_code, {
             'code_generated_at': firestore.SERVER_TIMESTAMP,
             'updated_at': firestore.SERVER_TIMESTAMP
         })
+        if not new_code:
+            return jsonify({'error': 'Failed to generate code'}), 500
         
         # Store code in session for quick access
         session['teacher_code'] = new_code
@@ -102,35 +94,34 @@ def validate_teacher_code():
 
         db = get_firestore()
         
-        # Check if code matches either teacher_code or username
-        teachers = db.collection('users').where('role', '==', 'teacher')
-        teachers = teachers.where('teacher_code', '==', code).get()
-        
-        if not list(teachers):
+        # Check if code matches either teacher_code (directory lookup) or username
+        teacher_id, teacher_data = find_teacher_by_code(code)
+        if not teacher_id:
             # Try finding by username if no match for teacher_code
-            teachers = db.collection('users').where('role', '==', 'teacher').where('username', '==', code).get()
+            teachers = list(db.collection('users').where('role', '==', 'teacher').where('username', '==', code).limit(1).get())
+            if teachers:
+                teacher_id, teacher_data = teachers[0].id, teachers[0].to_dict()
         
-        teacher_list = list(teachers)
-        if not teacher_list:
+        if not teacher_id:
             return jsonify({'error': 'Teacher not found. Please check the code/username and try again'}), 404
-            
-        teacher = teacher_list[0]
-        teacher_data = teacher.to_dict()
         
         # If this is a student validating the code, link them to the teacher
         student_id = session.get('uid')
         if student_id and session.get('role') == 'student':
+            student = get_user_record(student_id) or {}
             student_ref = db.collection('users').document(student_id)
             student_ref.update({
-                'teacher_id': teacher.id,
+                'teacher_id': teacher_id,
                 'teacher_code': teacher_data.get('teacher_code'),
                 'enrolled_at': firestore.SERVER_TIMESTAMP
             })
+            forget_user_doc(student_id)
+            refresh_student_summary(student_id, dict(student, teacher_id=teacher_id), student.get('teacher_id'))
         
         return jsonify({
             'success': True,
             'teacher': {
-                'id': teacher.id,
+                'id': teacher_id,
                 'name': f"{teacher_data.get('firstName', '')} {teacher_data.get('lastName', '')}".strip() or teacher_data.get('username'),
                 'email': teacher_data.get('email'),
                 'code': teacher_data.get('teacher_code')
@@ -141,6 +132,57 @@ def validate_teacher_code():
         print('Error validating teacher code:', e)
         return jsonify({'error': 'Failed to validate code'}), 500
 
+# Fields each roster view reads from a student's user document. Queries project to these
+# with select() so the badges history and other unused fields are never transferred.
+ROSTER_FIELDS = ['firstName', 'lastName', 'email', 'lastLogin', 'progress', 'age_group', 'teacher_id']
+PROGRESS_FIELDS = ['firstName', 'lastName', 'email', 'badge', 'status', 'progress', 'moduleProgress', 'modules']
+EXPORT_FIELDS = ['firstName', 'lastName', 'email', 'badge', 'progress', 'moduleProgress', 'modules']
+
+def _students_query(db, teacher_id, fields=None):
+    """Query for students connected to a teacher, optionally projected to the given fields
+    (an empty list fetches document ids only).
+    """
+    # Filter by role to ensure we only get students
+    query = db.collection('users').where('teacher_id', '==', teacher_id).where('role', '==', 'student')
+    if fields is not None:
+        query = query.select(fields)
+    return query
+
+MAX_PAGE_SIZE = 500
+
+def _encode_page_token(last_doc_id):
+    """Opaque cursor for the page following the given student document."""
+    return base64.urlsafe_b64encode(json.dumps({'after': last_doc_id}).encode('utf-8')).decode('ascii')
+
+def _decode_page_token(token):
+    try:
+        return json.loads(base64.urlsafe_b64decode(token.encode('ascii')).decode('utf-8'))['after']
+    except Exception:
+        raise ValueError('Invalid page token')
+
+def _paginate(query):
+    """Apply ?limit= and ?start_after= (a next_page_token) to a roster query ordered by document id.
+    Returns (query, page_size); page_size is None when the request did not ask for paging.
+    Raises ValueError on malformed parameters.
+    """
+    limit = request.args.get('limit')
+    token = request.args.get('start_after')
+    if limit is None and not token:
+        return query, None
+    page_size = min(MAX_PAGE_SIZE, int(limit)) if limit is not None else MAX_PAGE_SIZE
+    if page_size < 1:
+        raise ValueError('limit must be positive')
+    query = query.order_by(DOCUMENT_ID)
+    if token:
+        query = query.start_after({DOCUMENT_ID: _decode_page_token(token)})
+    return query.limit(page_size), page_size
+
+def _next_page_token(last_doc_id, scanned, page_size):
+    """Token for the next page, or None when this page was the last one."""
+    if page_size is None or scanned < page_size or not last_doc_id:
+        return None
+    return _encode_page_token(last_doc_id)
+
 def _normalize_teacher_id(teacher_id_value):
     """Normalize teacher_id to string, handling DocumentReference objects"""
     if teacher_id_value is None:
@@ -167,13 +209,20 @@ def get_connected_students():
         
         teacher_id = str(teacher_id)  # Ensure it's a string for comparison
         
-        # Query for students connected to this teacher - filter by role to ensure we only get students
-        # Use stream() to handle large result sets and avoid query limits
-        students_query = db.collection('users').where('teacher_id', '==', teacher_id).where('role', '==', 'student')
+        # Query for students connected to this teacher, fetching only the fields this view needs
+        # Use stream() to handle large result sets; ?limit=&start_after= return one page at a time
+        try:
+            students_query, page_size = _paginate(_students_query(db, teacher_id, ROSTER_FIELDS))
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e), 'students': []}), 400
         students = students_query.stream()
         student_list = []
+        scanned = 0
+        last_doc_id = None
         
         for student in students:
+            scanned += 1
+            last_doc_id = student.id
             try:
                 student_data = student.to_dict()
                 # Normalize teacher_id to handle DocumentReference objects or string mismatches
@@ -197,7 +246,8 @@ def get_connected_students():
         return jsonify({
             'success': True,
             'students': student_list,
-            'count': len(student_list)
+            'count': len(student_list),
+            'next_page_token': _next_page_token(last_doc_id, scanned, page_size)
         })
     except Exception as e:
         print(f'Error fetching students: {e}')
@@ -218,55 +268,58 @@ def get_students_progress():
     try:
         db = get_firestore()
         teacher_id = session.get('uid')
-        # Query for students connected to this teacher - filter by role to ensure we only get students
-        # Use stream() to handle large result sets
-        students_query = db.collection('users').where('teacher_id', '==', teacher_id).where('role', '==', 'student')
+        # Query for students connected to this teacher, fetching only the fields this view needs
+        # Use stream() to handle large result sets; ?limit=&start_after= return one page at a time
+        try:
+            students_query, page_size = _paginate(_students_query(db, teacher_id, PROGRESS_FIELDS))
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e), 'students': []}), 400
         students = students_query.stream()
 
-        def entry_to_percent(entry):
-            try:
-                if isinstance(entry, dict):
-                    if entry.get('post_quiz_completed') is True:
-                        return 100
-                    if entry.get('percent') is not None:
-                        return max(0, min(100, round(float(entry.get('percent') or 0))))
-                    if entry.get('score') is not None:
-                        return max(0, min(100, round(float(entry.get('score') or 0))))
-                    if entry.get('pre_quiz_completed') is True:
-                        return 50
-                else:
-                    return max(0, min(100, round(float(entry))))
-            except Exception:
-                return 0
-            return 0
-
         results = []
+        scanned = 0
+        last_doc_id = None
         for s in students:
+            scanned += 1
+            last_doc_id = s.id
             data = s.to_dict() or {}
             # --- Filter out students with status 'dropped' or 'finished' (Do not show on progress dashboard) ---
             status = data.get('status', '').lower()
             if status == 'dropped' or status == 'finished':
                 continue
-            prog = data.get('moduleProgress') or data.get('progress') or {}
-            modules = {}
-            if isinstance(prog, dict):
-                for mk, mv in prog.items():
-                    modules[str(mk)] = entry_to_percent(mv)
-            vals = list(modules.values())
-            overall = round(sum(vals)/len(vals)) if vals else 0
+            progress = parse_progress(user_progress_map(data))
             results.append({
                 'id': s.id,
                 'name': f"{data.get('firstName','')} {data.get('lastName','')}",
                 'email': data.get('email'),
                 'badge': data.get('badge', 'none'),
-                'overall': overall,
-                'modules': modules
+                'overall': progress.overall(),
+                'modules': progress.percents()
             })
-        return jsonify({'success': True, 'students': results})
+        return jsonify({
+            'success': True,
+            'students': results,
+            'next_page_token': _next_page_token(last_doc_id, scanned, page_size)
+        })
     except Exception as e:
         print('Error get_students_progress:', e)
         return jsonify({'success': True, 'students': []})
 
+@teacher_bp.route('/students/summary', methods=['GET'])
+@teacher_required
+def get_students_summary():
+    """Return the class summary from the materialized class_summaries/{teacher_id} document.
+    Response: { success: True, summary: { students, studentCount, averageOverall, moduleCompleted, badgeCounts } }
+    Pass ?rebuild=1 to recompute the document from the roster.
+    """
+    try:
+        teacher_id = session.get('uid')
+        rebuild = request.args.get('rebuild', '').lower() in ('1', 'true', 'yes')
+        return jsonify({'success': True, 'summary': get_class_summary(teacher_id, rebuild=rebuild)})
+    except Exception as e:
+        print('Error get_students_summary:', e)
+        return jsonify({'success': False, 'error': 'Failed to load class summary'}), 500
+
 @teacher_bp.route('/students/progress/export', methods=['GET'])
 @teacher_required
 def export_students_progress_csv():
@@ -274,10 +327,9 @@ def export_students_progress_csv():
     try:
         db = get_firestore()
         teacher_id = session.get('uid')
-        # Query for students connected to this teacher - filter by role to ensure we only get students
+        # Query for students connected to this teacher, fetching only the fields this view needs
         # Use stream() to handle large result sets
-        students_query = db.collection('users').where('teacher_id', '==', teacher_id).where('role', '==', 'student')
-        students = students_query.stream()
+        students = _students_query(db, teacher_id, EXPORT_FIELDS).stream()
 
         # Build rows
         rows = []
@@ -294,29 +346,9 @@ def export_students_progress_csv():
         for s in students:
             data = s.to_dict() or {}
             # Compute overall similar to get_students_progress
-            prog = data.get('moduleProgress') or data.get('progress') or {}
-            def entry_to_percent(entry):
-                try:
-                    if isinstance(entry, dict):
-                        if entry.get('post_quiz_completed') is True:
-                            return 100
-                        if entry.get('percent') is not None:
-                            return max(0, min(100, round(float(entry.get('percent') or 0))))
-                        if entry.get('score') is not None:
-                            return max(0, min(100, round(float(entry.get('score') or 0))))
-                        if entry.get('pre_quiz_completed') is True:
-                            return 50
-                    else:
-                        return max(0, min(100, round(float(entry))))
-                except Exception:
-                    return 0
-                return 0
-            modules = {}
-            if isinstance(prog, dict):
-                for mk, mv in prog.items():
-                    modules[str(mk)] = entry_to_percent(mv)
-            vals = list(modules.values())
-            overall = round(sum(vals)/len(vals)) if vals else 0
+            progress = parse_progress(user_progress_map(data))
+            modules = progress.percents()
+            overall = progress.overall()
             # Convert module ids to names for export readability
             modules_named = {}
             for mk, pct in modules.items():
@@ -406,6 +438,8 @@ def assign_student_badge():
             'badge_updated_at': firestore.SERVER_TIMESTAMP,
             'badges': badges_hist
         }, merge=True)
+        forget_user_doc(student_id)
+        refresh_student_summary(student_id, dict(doc, badge=badge))
         return jsonify({'success': True})
     except Exception as e:
         print('Error assign_student_badge:', e)
@@ -515,24 +549,15 @@ def create_teacher_resource():
         resource['id'] = doc_ref.id
         resource['created_at'] = datetime.now().isoformat()
 
-        # Create notifications for linked students (draft created)
+        # Notify linked students (draft created) in the background, in batched writes
         try:
             teacher_id = session.get('uid')
-            # Query for students connected to this teacher - filter by role to ensure we only get students
-            # Use stream() to handle large result sets
-            students_query = db.collection('users').where('teacher_id', '==', teacher_id).where('role', '==', 'student')
-            students = students_query.stream()
-            for s in students:
-                nref = db.collection('notifications').document()
-                nref.set({
-                    'user_id': s.id,
-                    'teacher_id': teacher_id,
-                    'type': 'resource_created',
-                    'title': resource['title'],
-                    'resource_id': doc_ref.id,
-                    'read': False,
-                    'created_at': firestore.SERVER_TIMESTAMP
-                })
+            fan_out_to_students(teacher_id, {
+                'teacher_id': teacher_id,
+                'type': 'resource_created',
+                'title': resource['title'],
+                'resource_id': doc_ref.id
+            })
         except Exception as nerr:
             print('Notification create error:', nerr)
 
@@ -586,42 +611,52 @@ def update_teacher_resource(resource_id):
 
 @teacher_bp.route('/notifications', methods=['GET'])
 def get_notifications():
+    """Return the latest notifications and the unread count from the user's inbox summary."""
     try:
-        db = get_firestore()
         uid = session.get('uid')
         if not uid:
-            return jsonify({'success': True, 'notifications': []})
-        query = db.collection('notifications').where('user_id', '==', uid).order_by('created_at', direction=firestore.Query.DESCENDING).limit(20)
-        items = []
-        for doc in query.stream():
-            d = doc.to_dict()
-            items.append({
-                'id': doc.id,
-                'type': d.get('type'),
-                'title': d.get('title'),
-                'resource_id': d.get('resource_id'),
-                'read': bool(d.get('read', False)),
-                'created_at': d.get('created_at', '').isoformat() if isinstance(d.get('created_at'), datetime) else str(d.get('created_at', '')),
-            })
-        return jsonify({'success': True, 'notifications': items})
+            return jsonify({'success': True, 'notifications': [], 'unread': 0})
+        return jsonify(dict(inbox_payload(get_inbox(uid)), success=True))
     except Exception as e:
         print('Error fetching notifications:', e)
-        return jsonify({'success': True, 'notifications': []})
+        return jsonify({'success': True, 'notifications': [], 'unread': 0})
 
 @teacher_bp.route('/notifications/<notif_id>/read', methods=['POST'])
 def mark_notification_read(notif_id):
     try:
-        db = get_firestore()
         uid = session.get('uid')
         if not uid:
             return jsonify({'success': False}), 401
-        ref = db.collection('notifications').document(notif_id)
-        ref.update({'read': True, 'updated_at': firestore.SERVER_TIMESTAMP})
+        mark_read(uid, [notif_id])
         return jsonify({'success': True})
     except Exception as e:
         print('Error marking notification read:', e)
         return jsonify({'success': False}), 500
 
+@teacher_bp.route('/notifications/read', methods=['POST'])
+def mark_notifications_read():
+    """Mark several notifications read in batched writes.
+    Body: { ids: [notificationId, ...] } or { all: true } for every unread notification.
+    """
+    try:
+        uid = session.get('uid')
+        if not uid:
+            return jsonify({'success': False}), 401
+        data = request.get_json(silent=True) or {}
+        if data.get('all') is True:
+            marked = mark_read(uid)
+        else:
+            ids = data.get('ids')
+            if not isinstance(ids, list) or not ids:
+                return jsonify({'success': False, 'error': 'ids (list) or all=true required'}), 400
+            if len(ids) > MAX_PAGE_SIZE:
+                return jsonify({'success': False, 'error': f'at most {MAX_PAGE_SIZE} ids per request'}), 400
+            marked = mark_read(uid, ids)
+        return jsonify({'success': True, 'marked': marked})
+    except Exception as e:
+        print('Error marking notifications read:', e)
+        return jsonify({'success': False}), 500
+
 @teacher_bp.route('/resources/<resource_id>', methods=['DELETE'])
 @teacher_required
 @validate_teacher_ownership
@@ -671,17 +706,12 @@ def publish_resource(resource_id):
         # Ensure fields exist even if previously missing
         doc_ref.update(update_data)
 
-        # Notify assigned students
+        # Notify assigned students in the background, in batched writes
         try:
-            for sid in student_ids:
-                nref = db.collection('notifications').document()
-                nref.set({
-                    'user_id': sid,
-                    'type': 'resource_published',
-                    'resource_id': resource_id,
-                    'read': False,
-                    'created_at': firestore.SERVER_TIMESTAMP
-                })
+            fan_out(student_ids, {
+                'type': 'resource_published',
+                'resource_id': resource_id
+            })
         except Exception as nerr:
             print('Notification publish error:', nerr)
 
@@ -736,28 +766,55 @@ def get_quiz_statistics(quiz_id):
         if not quiz.exists:
             return jsonify({'error': 'Quiz not found'}), 404
             
-        quiz_data = quiz.to_dict()
-        submissions = quiz_data.get('submissions', [])
-        
-        # Calculate statistics
-        total_attempts = len(submissions)
-        passed_count = sum(1 for sub in submissions if sub.get('score', 0) >= quiz_data.get('passingScore', 70))
-        avg_score = sum(sub.get('score', 0) for sub in submissions) / total_attempts if total_attempts > 0 else 0
-        
+        # Aggregates are maintained on every submission; quizzes created before that
+        # (or with submissions still embedded in the document) are rebuilt once
+        stats = quiz_stats(quiz.to_dict() or {})
+        if stats is None:
+            stats = quiz_stats({'stats': rebuild_quiz_stats(quiz_id)})
+
         return jsonify({
             'success': True,
-            'stats': {
-                'totalAttempts': total_attempts,
-                'passedCount': passed_count,
-                'averageScore': round(avg_score, 2),
-                'latestSubmission': sorted([sub.get('submittedAt') for sub in submissions])[-1] if submissions else None
-            }
+            'stats': stats
         })
         
     except Exception as e:
         print('Error fetching quiz statistics:', e)
         return jsonify({'error': str(e)}), 500
 
+@teacher_bp.route('/quizzes/<quiz_id>/analysis', methods=['GET'])
+@teacher_required
+def get_quiz_analysis(quiz_id):
+    """Item analysis of a module quiz over the teacher's students.
+    quiz_id is a quizzes/{id} document id, or '<module>-<pre|post>' for quizzes
+    that only exist in the local quiz store.
+    Response: { success, analysis: { attempts, averageScore, items: [{ difficulty,
+    discrimination, options, unanswered }], learningGain } }
+    """
+    try:
+        from utils.item_analysis import AnalysisUnavailable, analyze
+        from utils.quiz_handler import convert_to_numeric_id
+        module_id, _, quiz_type = quiz_id.rpartition('-')
+        module_id = convert_to_numeric_id(module_id) if module_id.isdigit() else None
+        if not module_id or quiz_type not in ('pre', 'post'):
+            quiz = get_firestore().collection('quizzes').document(quiz_id).get()
+            if not quiz.exists:
+                return jsonify({'error': 'Quiz not found'}), 404
+            data = quiz.to_dict() or {}
+            module_id = convert_to_numeric_id(str(data.get('lesson_id', '')))
+            quiz_type = data.get('type')
+            if not module_id or quiz_type not in ('pre', 'post'):
+                return jsonify({'error': 'Not a module quiz'}), 400
+        try:
+            analysis = analyze(session.get('uid'), module_id, quiz_type)
+        except AnalysisUnavailable as e:
+            return jsonify({'error': str(e)}), 503
+        if analysis is None:
+            return jsonify({'error': 'Quiz has no gradable questions'}), 404
+        return jsonify({'success': True, 'analysis': analysis})
+    except Exception as e:
+        print('Error fetching quiz analysis:', e)
+        return jsonify({'error': str(e)}), 500
+
 @teacher_bp.route('/students/drop', methods=['POST'])
 @teacher_required
 def drop_student():
@@ -775,6 +832,8 @@ def drop_student():
         if doc.to_dict().get('teacher_id') != teacher_id:
             return jsonify({'success': False, 'error': 'You do not have access to this student'}), 403
         doc_ref.set({'status': 'dropped'}, merge=True)
+        forget_user_doc(student_id)
+        refresh_student_summary(student_id, dict(doc.to_dict(), status='dropped'))
         return jsonify({'success': True})
     except Exception as e:
         print('drop_student error:', e)
@@ -798,11 +857,12 @@ def finish_student():
         if d.get('teacher_id') != teacher_id:
             return jsonify({'success': False, 'error': 'You do not have access to this student'}), 403
         # Set all modules complete
-        modules = d.get('progress', {})
-        for k in modules:
-            modules[k]['percent'] = 100
-            modules[k]['pre_quiz_completed'] = True
-            modules[k]['post_quiz_completed'] = True
+        progress = parse_progress(d.get('progress'))
+        for entry in progress.modules.values():
+            entry.percent = 100
+            entry.pre_quiz_completed = True
+            entry.post_quiz_completed = True
+        progress_map = progress.to_dict()
         # Award gold badge if not present
         badges = d.get('badges', [])
         has_gold = any((b['name'] == 'gold') if isinstance(b, dict) else False for b in badges)
@@ -814,8 +874,10 @@ def finish_student():
             'badge': 'gold',
             'badge_updated_at': firestore.SERVER_TIMESTAMP,
             'badges': badges,
-            'progress': modules
+            'progress': progress_map
         }, merge=True)
+        forget_user_doc(student_id)
+        refresh_student_summary(student_id, dict(d, status='finished', badge='gold', progress=progress_map))
         return jsonify({'success': True})
     except Exception as e:
         print('finish_student error:', e)
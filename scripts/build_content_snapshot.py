@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+"""Compile quizzes and lesson_info into the read-only content snapshot and publish it.
+
+    python scripts/build_content_snapshot.py             # Firestore quizzes + local files
+    python scripts/build_content_snapshot.py --local     # local quiz store and lesson_info only
+
+The new file replaces the old one atomically; running workers switch to it on their
+next read, without a restart.
+"""
+import argparse
+import os
+import sys
+
+import firebase_admin
+from firebase_admin import credentials
+from firebase_admin import firestore
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.content_snapshot import SNAPSHOT_PATH, build_snapshot  # noqa: E402
+
+def init_firebase():
+    """Initialize Firebase Admin SDK"""
+    try:
+        cred = credentials.Certificate("menstrual-hygiene-manage-6b0ed-firebase-adminsdk-fbsvc-a3f11dc47f.json")
+        firebase_admin.initialize_app(cred)
+    except ValueError:
+        # App already initialized
+        pass
+    return firestore.client()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build and publish the shared content snapshot')
+    parser.add_argument('--out', default=SNAPSHOT_PATH, help=f'Snapshot file (default: {SNAPSHOT_PATH})')
+    parser.add_argument('--local', action='store_true', help='Do not pull quizzes from Firestore')
+    args = parser.parse_args()
+
+    info = build_snapshot(db=None if args.local else init_firebase(), path=args.out)
+    print(f"Published {args.out}: {info['quizzes']} quizzes, {info['lessons']} lesson cards ({info['source']})")
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""Export Firestore collections to gzip NDJSON dumps and import them back.
+
+    python scripts/dump_collections.py export users resources --out dumps/
+    python scripts/dump_collections.py import dumps/users.ndjson.gz --max-writes-per-sec 400
+
+Dumps can also seed the in-memory backend: FIRESTORE_BACKEND=memory
+FIRESTORE_MEMORY_SEED=dumps/users.ndjson.gz,dumps/quizzes.ndjson.gz
+"""
+import argparse
+import os
+import sys
+
+import firebase_admin
+from firebase_admin import credentials
+from firebase_admin import firestore
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.ndjson_dump import MAX_BATCH_WRITES, export_collection, import_dump  # noqa: E402
+
+DEFAULT_COLLECTIONS = ['users', 'resources', 'notifications', 'quizzes']
+
+def init_firebase():
+    """Initialize Firebase Admin SDK"""
+    try:
+        cred = credentials.Certificate("menstrual-hygiene-manage-6b0ed-firebase-adminsdk-fbsvc-a3f11dc47f.json")
+        firebase_admin.initialize_app(cred)
+    except ValueError:
+        # App already initialized
+        pass
+    return firestore.client()
+
+def export_collections(collections, out_dir, page_size=500, subcollections=False):
+    """Write one <collection>.ndjson.gz per collection into out_dir."""
+    db = init_firebase()
+    os.makedirs(out_dir, exist_ok=True)
+    for name in collections:
+        path = os.path.join(out_dir, f'{name}.ndjson.gz')
+        count = export_collection(db, name, path, page_size=page_size, subcollections=subcollections)
+        print(f'Exported {count} documents from {name} to {path}')
+
+def import_dumps(paths, batch_size=MAX_BATCH_WRITES, max_writes_per_sec=None, merge=False, dry_run=True):
+    """Write every document of the given dumps back to Firestore."""
+    if dry_run:
+        from utils.ndjson_dump import iter_dump
+        for path in paths:
+            print(f'[DRY RUN] {path}: {sum(1 for _ in iter_dump(path))} documents would be written')
+        return
+    db = init_firebase()
+    for path in paths:
+        count = import_dump(db, path, batch_size=batch_size, max_writes_per_sec=max_writes_per_sec, merge=merge)
+        print(f'Imported {count} documents from {path}')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export/import Firestore collections as gzip NDJSON')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = commands.add_parser('export', help='Dump collections to NDJSON files')
+    export_parser.add_argument('collections', nargs='*', default=DEFAULT_COLLECTIONS,
+                               help=f"Collections to export (default: {' '.join(DEFAULT_COLLECTIONS)})")
+    export_parser.add_argument('--out', default='dumps', help='Output directory')
+    export_parser.add_argument('--page-size', type=int, default=500, help='Documents read per cursor page')
+    export_parser.add_argument('--subcollections', action='store_true',
+                               help='Include subcollections (e.g. quiz submissions)')
+
+    import_parser = commands.add_parser('import', help='Write dumps back to Firestore')
+    import_parser.add_argument('paths', nargs='+', help='Dump files (.ndjson or .ndjson.gz)')
+    import_parser.add_argument('--batch-size', type=int, default=MAX_BATCH_WRITES, help='Writes per batch (max 500)')
+    import_parser.add_argument('--max-writes-per-sec', type=float, default=None, help='Throttle the import')
+    import_parser.add_argument('--merge', action='store_true', help='Merge into existing documents instead of replacing')
+    import_parser.add_argument('--apply', action='store_true', help='Actually write (default is a dry run)')
+
+    args = parser.parse_args()
+    if args.command == 'export':
+        export_collections(args.collections, args.out, page_size=args.page_size, subcollections=args.subcollections)
+    else:
+        if not args.apply:
+            print("Running in dry-run mode. Use --apply to write the documents.")
+        import_dumps(args.paths, batch_size=args.batch_size, max_writes_per_sec=args.max_writes_per_sec,
+                     merge=args.merge, dry_run=not args.apply)
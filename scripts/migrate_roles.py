@@ -3,6 +3,11 @@ import firebase_admin
 from firebase_admin import credentials
 from firebase_admin import firestore
 import argparse
+import threading
+
+from migration_runner import run_migration
+
+DEFAULT_CHECKPOINT = '.migrate_roles.checkpoint.json'
 
 def init_firebase():
     """Initialize Firebase Admin SDK"""
@@ -14,50 +19,58 @@ def init_firebase():
         pass
     return firestore.client()
 
-def migrate_roles(teacher_emails=None, dry_run=True):
+def migrate_roles(teacher_emails=None, dry_run=True, workers=4, page_size=500,
+                  checkpoint=DEFAULT_CHECKPOINT, restart=False, verbose=False):
     """
     Migrate user documents to include role field.
     Args:
         teacher_emails: List of email addresses to mark as teachers
         dry_run: If True, only print changes without applying them
+        workers: Number of concurrent batch writers
+        page_size: Documents read per cursor page
+        checkpoint: Resume file; an interrupted run continues from it
+        restart: Ignore an existing checkpoint
+        verbose: Print every user that gets a role
     """
     db = init_firebase()
-    users_ref = db.collection('users')
-    users = users_ref.stream()
-    
     teacher_emails = set(email.lower() for email in (teacher_emails or []))
-    updates = 0
-    teachers_set = 0
+    teachers_set = [0]
+    lock = threading.Lock()
+
+    def assign_role(user):
+        data = user.to_dict() or {}
+        # Only documents missing the role field are updated
+        if 'role' in data:
+            return None
+        # Assign teacher role if email is in teacher list
+        role = 'teacher' if (data.get('email') or '').lower() in teacher_emails else 'student'
+        if role == 'teacher':
+            with lock:
+                teachers_set[0] += 1
+        if verbose:
+            print(f"{'[DRY RUN] ' if dry_run else ''}Setting role={role} for user {data.get('email')}")
+        return {'role': role}
 
-    for user in users:
-        data = user.to_dict()
-        needs_update = False
-        
-        # Check if role field is missing
-        if 'role' not in data:
-            needs_update = True
-            # Assign teacher role if email is in teacher list
-            if data.get('email', '').lower() in teacher_emails:
-                data['role'] = 'teacher'
-                teachers_set += 1
-            else:
-                data['role'] = 'student'
-            
-            print(f"{'[DRY RUN] ' if dry_run else ''}Setting role={data['role']} for user {data.get('email')}")
-            
-            if not dry_run:
-                user.reference.update({'role': data['role']})
-            updates += 1
+    result = run_migration(db, 'users', assign_role, page_size=page_size, workers=workers,
+                           checkpoint=checkpoint, dry_run=dry_run, fields=['role', 'email'],
+                           restart=restart)
 
     print(f"\nMigration complete:")
-    print(f"- Total documents processed: {updates}")
-    print(f"- Teacher roles set: {teachers_set}")
+    print(f"- Total documents scanned: {result['scanned']}")
+    print(f"- Total documents processed: {result['updated']}")
+    print(f"- Teacher roles set: {teachers_set[0]}")
+    print(f"- Throughput: {result['scanned'] / max(result['elapsed'], 1e-9):.0f} docs/s")
     print(f"- {'No changes applied (dry run)' if dry_run else 'Changes applied successfully'}")
 
 def main():
     parser = argparse.ArgumentParser(description='Migrate Firestore user documents to include roles')
     parser.add_argument('--teachers', type=str, nargs='+', help='Email addresses to mark as teachers')
     parser.add_argument('--apply', action='store_true', help='Apply changes (without this flag, runs in dry-run mode)')
+    parser.add_argument('--workers', type=int, default=4, help='Concurrent batch writers (default: 4)')
+    parser.add_argument('--page-size', type=int, default=500, help='Documents read per page (default: 500)')
+    parser.add_argument('--checkpoint', default=DEFAULT_CHECKPOINT, help=f'Resume file (default: {DEFAULT_CHECKPOINT})')
+    parser.add_argument('--restart', action='store_true', help='Ignore an existing checkpoint and start over')
+    parser.add_argument('--verbose', action='store_true', help='Print every user that gets a role')
     args = parser.parse_args()
 
     if args.teachers:
@@ -67,7 +80,9 @@ def main():
         print("Running in dry-run mode. Use --apply to make actual changes.")
     
     try:
-        migrate_roles(teacher_emails=args.teachers, dry_run=not args.apply)
+        migrate_roles(teacher_emails=args.teachers, dry_run=not args.apply, workers=args.workers,
+                      page_size=args.page_size, checkpoint=args.checkpoint, restart=args.restart,
+                      verbose=args.verbose)
     except Exception as e:
         print(f"Error during migration: {e}")
         return 1
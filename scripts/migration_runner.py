@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""Generic, resumable Firestore migration runner.
+
+Reads a collection in document-id order with cursor pagination, asks a transform for the
+field updates of each document and applies them with batched writes (up to 500 per
+batch) on a pool of worker threads. After every page whose writes (and those of all
+earlier pages) have committed, the cursor is saved to a checkpoint file, so a crashed or
+interrupted run resumes where it stopped. Progress, throughput and ETA are printed
+periodically.
+
+Transforms must be idempotent: pages after the last checkpoint are processed again on
+resume.
+
+    from migration_runner import run_migration
+
+    def transform(snapshot):
+        data = snapshot.to_dict() or {}
+        return None if 'role' in data else {'role': 'student'}
+
+    run_migration(db, 'users', transform, workers=8, checkpoint='roles.checkpoint.json')
+"""
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.field_paths import DOCUMENT_ID
+
+MAX_BATCH_WRITES = 500
+BATCH_RETRIES = 3
+
+
+def _format_seconds(seconds):
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    return f'{hours}h{minutes:02d}m{seconds:02d}s' if hours else f'{minutes}m{seconds:02d}s'
+
+
+def load_checkpoint(path, collection):
+    """Return the saved checkpoint dict for collection, or None."""
+    if not path or not os.path.exists(path):
+        return None
+    with open(path) as fh:
+        state = json.load(fh)
+    if state.get('collection') != collection:
+        raise ValueError(f"Checkpoint {path} is for collection {state.get('collection')!r}, not {collection!r}")
+    return state
+
+
+def save_checkpoint(path, state):
+    """Write the checkpoint atomically (a crash never leaves a half-written file)."""
+    tmp = f'{path}.tmp'
+    with open(tmp, 'w') as fh:
+        json.dump(state, fh)
+    os.replace(tmp, path)
+
+
+def count_documents(db, collection):
+    """Number of documents in collection via an aggregation query, or None if unsupported."""
+    try:
+        result = db.collection(collection).count().get()
+        return int(result[0][0].value)
+    except Exception:
+        return None
+
+
+class _Progress:
+    def __init__(self, total, scanned=0, updated=0, log_every=5.0):
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.total = total
+        self.resumed_from = scanned
+        self.scanned = scanned
+        self.updated = updated
+        self.log_every = log_every
+        self._last_log = 0.0
+
+    def add(self, scanned=0, updated=0):
+        with self.lock:
+            self.scanned += scanned
+            self.updated += updated
+
+    def report(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._last_log < self.log_every:
+            return
+        self._last_log = now
+        with self.lock:
+            elapsed = max(now - self.started, 1e-9)
+            rate = (self.scanned - self.resumed_from) / elapsed
+            line = f'scanned {self.scanned}'
+            if self.total:
+                line += f'/{self.total} ({100.0 * self.scanned / self.total:.1f}%)'
+            line += f', updated {self.updated}, {rate:.0f} docs/s, elapsed {_format_seconds(elapsed)}'
+            if self.total and rate > 0 and self.scanned < self.total:
+                line += f', ETA {_format_seconds((self.total - self.scanned) / rate)}'
+        print(line, flush=True)
+
+
+def _commit(db, writes):
+    """Commit (ref, updates) pairs in batches of MAX_BATCH_WRITES, retrying each batch."""
+    for start in range(0, len(writes), MAX_BATCH_WRITES):
+        chunk = writes[start:start + MAX_BATCH_WRITES]
+        for attempt in range(1, BATCH_RETRIES + 1):
+            try:
+                batch = db.batch()
+                for ref, updates in chunk:
+                    batch.update(ref, updates)
+                batch.commit()
+                break
+            except Exception as e:
+                if attempt == BATCH_RETRIES:
+                    raise
+                print(f'Batch of {len(chunk)} failed (attempt {attempt}/{BATCH_RETRIES}): {e}', flush=True)
+                time.sleep(2 ** attempt)
+
+
+def run_migration(db, collection, transform, page_size=500, workers=4, checkpoint=None,
+                  dry_run=True, fields=None, log_every=5.0, restart=False):
+    """Apply transform(snapshot) -> dict of field updates (or None) to every document.
+
+    page_size   documents read per cursor page
+    workers     concurrent writer threads
+    checkpoint  path of the resume file (None disables checkpointing)
+    dry_run     compute and count the updates without writing anything
+    fields      optional field paths to project the read to (select)
+    restart     ignore an existing checkpoint and start from the beginning
+    Returns { scanned, updated, elapsed }.
+    """
+    state = None if restart else load_checkpoint(checkpoint, collection)
+    after = state.get('after') if state else None
+    progress = _Progress(count_documents(db, collection),
+                         scanned=state.get('scanned', 0) if state else 0,
+                         updated=state.get('updated', 0) if state else 0,
+                         log_every=log_every)
+    if after:
+        print(f'Resuming {collection} after document {after} ({progress.scanned} already scanned)', flush=True)
+
+    # Pages may finish out of order; the checkpoint only advances over a contiguous prefix
+    done_lock = threading.Lock()
+    finished = {}  # page number -> (last doc id, scanned, updated)
+    saved = {'page': 0, 'scanned': progress.scanned, 'updated': progress.updated}
+
+    def page_done(number, last_id, scanned, updated):
+        progress.add(scanned, updated)
+        with done_lock:
+            finished[number] = (last_id, scanned, updated)
+            cursor = None
+            while saved['page'] in finished:
+                cursor, page_scanned, page_updated = finished.pop(saved['page'])
+                saved['page'] += 1
+                saved['scanned'] += page_scanned
+                saved['updated'] += page_updated
+            if cursor is not None and checkpoint and not dry_run:
+                save_checkpoint(checkpoint, {
+                    'collection': collection,
+                    'after': cursor,
+                    'scanned': saved['scanned'],
+                    'updated': saved['updated'],
+                    'saved_at': time.time()
+                })
+        progress.report()
+
+    def process(number, snapshots):
+        writes = []
+        for snap in snapshots:
+            updates = transform(snap)
+            if updates:
+                writes.append((snap.reference, updates))
+        if writes and not dry_run:
+            _commit(db, writes)
+        page_done(number, snapshots[-1].id, len(snapshots), len(writes))
+
+    base = db.collection(collection)
+    if fields is not None:
+        base = base.select(fields)
+    base = base.order_by(DOCUMENT_ID).limit(page_size)
+    # Bound the pages held in memory while writers catch up
+    slots = threading.BoundedSemaphore(max(1, workers) * 2)
+    pending = []
+    errors = []
+    number = 0
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='migrate') as pool:
+        while not errors:
+            query = base.start_after({DOCUMENT_ID: after}) if after else base
+            snapshots = list(query.stream())
+            if not snapshots:
+                break
+            slots.acquire()
+            future = pool.submit(process, number, snapshots)
+            future.add_done_callback(lambda _f: slots.release())
+            pending.append(future)
+            number += 1
+            after = snapshots[-1].id
+            # Stop reading as soon as a writer has failed
+            errors.extend(f.exception() for f in pending if f.done() and f.exception())
+            pending = [f for f in pending if not f.done()]
+            if len(snapshots) < page_size:
+                break
+    errors.extend(f.exception() for f in pending if f.exception())
+    progress.report(force=True)
+    if errors:
+        raise RuntimeError(f'Migration stopped: {errors[0]}') from errors[0]
+    if checkpoint and not dry_run and os.path.exists(checkpoint):
+        # Completed: a new run starts from the beginning
+        os.remove(checkpoint)
+    return {'scanned': progress.scanned, 'updated': progress.updated,
+            'elapsed': time.monotonic() - progress.started}
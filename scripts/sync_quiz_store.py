@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+"""Compile the Firestore quizzes collection into the local SQLite quiz store.
+
+    python scripts/sync_quiz_store.py            # into quiz_store.db (QUIZ_DB_PATH)
+    python scripts/sync_quiz_store.py --prune    # also drop quizzes no longer in Firestore
+
+Running workers keep serving their cached copies until QUIZ_CACHE_TTL expires or
+POST /admin/cache/quizzes/invalidate is called.
+"""
+import argparse
+import os
+import sys
+
+import firebase_admin
+from firebase_admin import credentials
+from firebase_admin import firestore
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.quiz_store import QUIZ_DB, sync_from_firestore  # noqa: E402
+
+def init_firebase():
+    """Initialize Firebase Admin SDK"""
+    try:
+        cred = credentials.Certificate("menstrual-hygiene-manage-6b0ed-firebase-adminsdk-fbsvc-a3f11dc47f.json")
+        firebase_admin.initialize_app(cred)
+    except ValueError:
+        # App already initialized
+        pass
+    return firestore.client()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Sync Firestore quizzes into the local SQLite quiz store')
+    parser.add_argument('--db', default=QUIZ_DB, help=f'SQLite file (default: {QUIZ_DB})')
+    parser.add_argument('--prune', action='store_true', help='Delete stored quizzes that are not in Firestore')
+    args = parser.parse_args()
+
+    result = sync_from_firestore(init_firebase(), path=args.db, prune=args.prune)
+    print(f"Synced {result['synced']} quizzes into {args.db} "
+          f"({result['skipped']} skipped, {result['pruned']} pruned)")
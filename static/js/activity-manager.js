@@ -123,7 +123,7 @@ class ActivityManager {
             <div class="activity-stats">
                 <span class="submissions">
                     <i class="fas fa-users"></i>
-                    ${activity.submissions?.length || 0} submissions
+                    ${activity.stats?.count ?? activity.submissions?.length ?? 0} submissions
                 </span>
                 <span class="completion">
                     <i class="fas fa-chart-pie"></i>
@@ -178,7 +178,15 @@ class QuizManager {
                 const quiz = doc.data();
                 await this.renderQuizCard(doc.id, quiz);
                 
-                // Fetch submissions from subcollection for accurate stats
+                // Use the running aggregates on the quiz document when present
+                if (quiz.stats && quiz.stats.count !== undefined) {
+                    totalAttempts += quiz.stats.count || 0;
+                    totalScore += quiz.stats.score_sum || 0;
+                    scoreCount += quiz.stats.count || 0;
+                    continue;
+                }
+
+                // Older quizzes: fetch submissions from subcollection
                 try {
                     const submissionsRef = collection(db, `activities/${doc.id}/submissions`);
                     const submissionsSnapshot = await getDocs(submissionsRef);
@@ -226,17 +234,22 @@ class QuizManager {
         
         const totalQuestions = quiz.questions ? quiz.questions.length : 0;
         
-        // Fetch submissions from subcollection for accurate stats
+        // Running aggregates on the quiz document; older quizzes fall back to the subcollection
         let totalAttempts = 0;
         let avgScore = 0;
-        try {
-            const submissionsRef = collection(db, `activities/${id}/submissions`);
-            const submissionsSnapshot = await getDocs(submissionsRef);
-            const submissions = submissionsSnapshot.docs.map(doc => doc.data());
-            totalAttempts = submissions.length;
-            avgScore = this.calculateAverageScore(submissions);
-        } catch (error) {
-            console.error(`Error fetching submissions for quiz ${id}:`, error);
+        if (quiz.stats && quiz.stats.count !== undefined) {
+            totalAttempts = quiz.stats.count || 0;
+            avgScore = totalAttempts ? Math.round((quiz.stats.score_sum || 0) / totalAttempts) : 0;
+        } else {
+            try {
+                const submissionsRef = collection(db, `activities/${id}/submissions`);
+                const submissionsSnapshot = await getDocs(submissionsRef);
+                const submissions = submissionsSnapshot.docs.map(doc => doc.data());
+                totalAttempts = submissions.length;
+                avgScore = this.calculateAverageScore(submissions);
+            } catch (error) {
+                console.error(`Error fetching submissions for quiz ${id}:`, error);
+            }
         }
 
         card.innerHTML = `
@@ -265,9 +265,9 @@ class EnhancedQuizSystem {
         submitBtn.disabled = true;
 
         try {
-            const correctAnswers = this.calculateScore();
+            let correctAnswers = this.calculateScore();
             const totalQuestions = this.quizData.questions.length;
-            const score = (correctAnswers / totalQuestions) * 100;
+            let score = (correctAnswers / totalQuestions) * 100;
 
             console.log('Calculated score:', {
                 correctAnswers,
@@ -312,6 +312,13 @@ class EnhancedQuizSystem {
                 console.warn('Server did not return JSON after quiz submit', e);
             }
 
+            // Prefer the server-side grade when the backend returned one
+            const grade = jsonResp && jsonResp.grade;
+            if (grade) {
+                correctAnswers = grade.correct;
+                score = grade.score;
+            }
+
             // FIXED: Always show results first before any redirect
             this.showingResults = true;
             this.showResults(correctAnswers, totalQuestions, score);
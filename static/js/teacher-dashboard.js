@@ -1,14 +1,27 @@
-// Function to fetch connected students
-async function fetchConnectedStudents() {
+// Function to fetch connected students page by page.
+// onPage (optional) is called with the students loaded so far after each page,
+// so the list can be rendered before the whole class has been fetched.
+const STUDENTS_PAGE_SIZE = 50;
+
+async function fetchConnectedStudents(onPage) {
+    const students = [];
     try {
-        const response = await fetch('/api/teacher/students');
-        if (!response.ok) throw new Error('Failed to fetch students');
-        
-        const data = await response.json();
-        return data.students;
+        let pageToken = null;
+        do {
+            let url = `/api/teacher/students?limit=${STUDENTS_PAGE_SIZE}`;
+            if (pageToken) url += `&start_after=${encodeURIComponent(pageToken)}`;
+            const response = await fetch(url);
+            if (!response.ok) throw new Error('Failed to fetch students');
+            
+            const data = await response.json();
+            students.push(...(data.students || []));
+            if (onPage) onPage(students);
+            pageToken = data.next_page_token;
+        } while (pageToken);
+        return students;
     } catch (error) {
         console.error('Error fetching students:', error);
-        return [];
+        return students;
     }
 }
 
@@ -79,11 +92,10 @@ async function updateDashboardStats() {
         const quizzesCountEl = document.getElementById('quizzesCount');
         if (quizzesCountEl) quizzesCountEl.textContent = activeQuizzes;
 
-        // Average completion from students progress overall average
-        const progressRes = await fetch('/api/teacher/students/progress');
-        const progressData = await progressRes.json();
-        const overalls = (progressData.students || []).map(s => s.overall || 0);
-        const avg = overalls.length ? Math.round(overalls.reduce((a,b)=>a+b,0) / overalls.length) : 0;
+        // Average completion from the class summary (a single document read)
+        const summaryRes = await fetch('/api/teacher/students/summary');
+        const summaryData = await summaryRes.json();
+        const avg = (summaryData.summary && summaryData.summary.averageOverall) || 0;
         const avgEl = document.getElementById('avgCompletion');
         if (avgEl) avgEl.textContent = `${avg}%`;
     } catch (error) {
@@ -161,8 +173,8 @@ document.addEventListener('DOMContentLoaded', async function() {
         });
     }
     
-    // Initial students fetch
-    const students = await fetchConnectedStudents();
+    // Initial students fetch (renders as soon as the first page arrives)
+    const students = await fetchConnectedStudents(renderStudentsList);
     renderStudentsList(students);
     
     // Initial stats update
@@ -177,6 +189,20 @@ document.addEventListener('DOMContentLoaded', async function() {
     // Refresh stats every minute
     setInterval(updateDashboardStats, 60000);
 
+    // Class progress changes are pushed over server-sent events
+    if (window.EventSource) {
+        const events = new EventSource('/api/events');
+        events.addEventListener('progress', (e) => {
+            try {
+                const summary = JSON.parse(e.data).summary || {};
+                const avgEl = document.getElementById('avgCompletion');
+                if (avgEl) avgEl.textContent = `${summary.averageOverall || 0}%`;
+            } catch (error) {
+                console.error('Error handling progress event:', error);
+            }
+        });
+    }
+
     // Profile dropdown
     const profileBtn = document.getElementById('profileBtn');
     const profileDropdown = document.getElementById('profileDropdown');
@@ -0,0 +1,154 @@
+"""Materialized per-teacher class summary: class_summaries/{teacher_id}.
+
+The document keeps one entry per connected student (name, email, badge, status, overall
+percent and per-module percents). It is updated incrementally whenever a student's
+progress, badges, status or teacher changes, so the dashboard needs a single document
+read instead of streaming the whole roster. Each update is a blind write of one student
+entry (no read, no transaction), which keeps concurrent quiz submissions from a class
+from contending on the document; the per-module completion counts and the badge
+distribution are derived from the entries when the summary is read.
+
+Progress the browser writes straight to users/{uid} does not go through these updates,
+so get_class_summary() rebuilds the document from the roster once it is older than
+CLASS_SUMMARY_MAX_AGE seconds.
+"""
+import os
+from datetime import datetime, timezone
+
+from firebase_admin import firestore
+from utils.field_paths import field_path
+from utils.firebase_service import get_firestore, get_user_record
+from utils.firestore_memory import NotFound
+from utils.progress import parse_progress, user_progress_map
+
+SUMMARY_COLLECTION = 'class_summaries'
+# Student document fields needed to build a summary entry
+SUMMARY_FIELDS = ['firstName', 'lastName', 'email', 'badge', 'status', 'progress', 'moduleProgress', 'modules',
+                  'teacher_id', 'role']
+# Seconds after a full rebuild before the summary is rebuilt on the next read
+CLASS_SUMMARY_MAX_AGE = float(os.getenv('CLASS_SUMMARY_MAX_AGE', '300'))
+
+
+def summary_entry(data):
+    """Build the class summary entry for a student from their user document data."""
+    progress = parse_progress(user_progress_map(data))
+    return {
+        'name': f"{data.get('firstName','')} {data.get('lastName','')}",
+        'email': data.get('email'),
+        'badge': data.get('badge', 'none'),
+        'status': str(data.get('status') or '').lower(),
+        'overall': progress.overall(),
+        'modules': progress.percents()
+    }
+
+
+def _student_path(uid):
+    return field_path('students', uid)
+
+
+def refresh_student_summary(uid, data=None, previous_teacher_id=None):
+    """Write the student's current entry into their teacher's class summary.
+    data is the student's user document (read through the user cache when omitted).
+    previous_teacher_id, when it differs from the current teacher, has the entry removed
+    from that teacher's summary. Best-effort: errors are logged, never raised.
+    """
+    if not uid:
+        return
+    try:
+        if data is None:
+            data = get_user_record(uid)
+        if not data:
+            return
+        db = get_firestore()
+        teacher_id = data.get('teacher_id')
+        teacher_id = str(teacher_id.id) if hasattr(teacher_id, 'id') else teacher_id
+        if previous_teacher_id and previous_teacher_id != teacher_id:
+            try:
+                db.collection(SUMMARY_COLLECTION).document(str(previous_teacher_id)).update({
+                    _student_path(uid): firestore.DELETE_FIELD
+                })
+            except NotFound:
+                # No summary for the previous teacher yet: nothing to remove
+                pass
+        if not teacher_id or data.get('role') != 'student':
+            return
+        ref = db.collection(SUMMARY_COLLECTION).document(str(teacher_id))
+        entry = summary_entry(data)
+        try:
+            ref.update({
+                _student_path(uid): entry,
+                'updated_at': firestore.SERVER_TIMESTAMP
+            })
+        except NotFound:
+            # First write for this teacher: build the whole summary instead
+            rebuild_class_summary(str(teacher_id))
+    except Exception as e:
+        print('refresh_student_summary error:', e)
+
+
+def rebuild_class_summary(teacher_id):
+    """Recompute class_summaries/{teacher_id} from the roster. Returns the students map."""
+    db = get_firestore()
+    query = db.collection('users').where('teacher_id', '==', teacher_id).where('role', '==', 'student')
+    students = {}
+    for s in query.select(SUMMARY_FIELDS).stream():
+        students[s.id] = summary_entry(s.to_dict() or {})
+    db.collection(SUMMARY_COLLECTION).document(teacher_id).set({
+        'students': students,
+        'updated_at': firestore.SERVER_TIMESTAMP,
+        'rebuilt_at': firestore.SERVER_TIMESTAMP
+    })
+    return students
+
+
+def _is_stale(rebuilt_at):
+    if not isinstance(rebuilt_at, datetime):
+        return True
+    if rebuilt_at.tzinfo is None:
+        rebuilt_at = rebuilt_at.replace(tzinfo=timezone.utc)
+    return (datetime.now(timezone.utc) - rebuilt_at).total_seconds() > CLASS_SUMMARY_MAX_AGE
+
+
+def get_class_summary(teacher_id, rebuild=False):
+    """Return the teacher's class summary with aggregates derived from the student entries.
+    Builds the document from the roster the first time, when the last rebuild is older
+    than CLASS_SUMMARY_MAX_AGE, or when rebuild=True.
+    """
+    db = get_firestore()
+    students = None
+    if not rebuild:
+        snap = db.collection(SUMMARY_COLLECTION).document(teacher_id).get()
+        if snap.exists:
+            data = snap.to_dict() or {}
+            if not _is_stale(data.get('rebuilt_at')):
+                students = data.get('students') or {}
+    if students is None:
+        students = rebuild_class_summary(teacher_id)
+    return summarize(students)
+
+
+def summarize(students):
+    """Aggregate a summary document's students map for the dashboard.
+    Dropped and finished students are excluded, as on the progress dashboard.
+    """
+    active = {}
+    module_completed = {}
+    badge_counts = {}
+    for sid, entry in (students or {}).items():
+        if not isinstance(entry, dict) or entry.get('status') in ('dropped', 'finished'):
+            continue
+        active[sid] = entry
+        for mid, pct in (entry.get('modules') or {}).items():
+            module_completed.setdefault(mid, 0)
+            if pct >= 100:
+                module_completed[mid] += 1
+        badge = entry.get('badge') or 'none'
+        badge_counts[badge] = badge_counts.get(badge, 0) + 1
+    overalls = [e.get('overall', 0) for e in active.values()]
+    return {
+        'students': [dict(entry, id=sid) for sid, entry in active.items()],
+        'studentCount': len(active),
+        'averageOverall': round(sum(overalls)/len(overalls)) if overalls else 0,
+        'moduleCompleted': module_completed,
+        'badgeCounts': badge_counts
+    }
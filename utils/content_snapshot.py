@@ -0,0 +1,160 @@
+"""Read-only content snapshot shared by every worker process.
+
+One SQLite file holds the quiz tables (local quiz store plus the Firestore quizzes
+collection) and lesson_info. Workers open it with immutable=1 and memory-map it, so the
+pages live once in the OS page cache no matter how many workers read them, instead of
+each worker filling its own caches; memory stays flat as workers are added.
+
+Publishing builds a new file next to the old one and renames it over it (os.replace),
+which is atomic: connections opened earlier keep reading the old file, and every
+thread reopens the new one on its next read.
+
+    python scripts/build_content_snapshot.py    # publish (CONTENT_SNAPSHOT_PATH)
+"""
+import os
+import sqlite3
+import threading
+import time
+import urllib.parse
+
+SNAPSHOT_PATH = os.getenv('CONTENT_SNAPSHOT_PATH', 'content_snapshot.db')
+MMAP_SIZE = int(os.getenv('CONTENT_SNAPSHOT_MMAP', str(64 * 1024 * 1024)))
+
+_local = threading.local()  # per-thread (connection, file identity)
+
+
+def _identity(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+def snapshot_connection(path=None):
+    """Read-only connection to the current snapshot for this thread, or None if unpublished."""
+    path = path or SNAPSHOT_PATH
+    ident = _identity(path)
+    cached = getattr(_local, 'conns', None)
+    if cached is None:
+        cached = _local.conns = {}
+    conn, conn_ident = cached.get(path, (None, None))
+    if ident is None:
+        if conn is not None:
+            conn.close()
+            del cached[path]
+        return None
+    if conn is None or conn_ident != ident:
+        # First read on this thread, or a new snapshot was published
+        if conn is not None:
+            conn.close()
+        uri = 'file:' + urllib.parse.quote(os.path.abspath(path)) + '?mode=ro&immutable=1'
+        try:
+            conn = sqlite3.connect(uri, uri=True)
+            conn.execute(f'PRAGMA mmap_size={MMAP_SIZE}')
+        except sqlite3.Error as e:
+            print(f"Content snapshot {path} unreadable: {e}")
+            cached.pop(path, None)
+            return None
+        cached[path] = (conn, ident)
+    return conn
+
+
+def build_snapshot(db=None, path=None, quiz_db=None, lesson_db=None, source=None):
+    """Compile and atomically publish a snapshot. db: Firestore client to pull the
+    quizzes collection from (None: quiz_db only). Returns the snapshot info.
+    """
+    from utils import quiz_store
+    from utils.lesson_content import LESSON_DB
+    path = path or SNAPSHOT_PATH
+    quiz_db = quiz_db or quiz_store.QUIZ_DB
+    lesson_db = lesson_db or LESSON_DB
+    tmp = f'{path}.{os.getpid()}.tmp'
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    try:
+        if os.path.abspath(quiz_db) != os.path.abspath(path):
+            # Make sure the source store has the current columns before copying it
+            quiz_store._connect(quiz_db).close()
+        conn = sqlite3.connect(tmp)
+        try:
+            quiz_store.ensure_schema(conn)
+            conn.execute('ATTACH DATABASE ? AS src', (quiz_db,))
+            conn.execute('INSERT INTO quizzes (id, module_id, quiz_type, title, firebase_id) '
+                         'SELECT id, module_id, quiz_type, title, firebase_id FROM src.quizzes')
+            conn.execute('INSERT INTO questions (id, quiz_id, question_text, correct_answer, question_order, feedback) '
+                         'SELECT id, quiz_id, question_text, correct_answer, question_order, feedback FROM src.questions')
+            conn.execute('INSERT INTO answer_options (id, question_id, option_text, option_order) '
+                         'SELECT id, question_id, option_text, option_order FROM src.answer_options')
+            conn.commit()
+            conn.execute('DETACH DATABASE src')
+            conn.executescript('''
+                CREATE TABLE lesson_info (
+                    id INTEGER PRIMARY KEY,
+                    module_name TEXT NOT NULL,
+                    organ_name TEXT NOT NULL,
+                    title TEXT NOT NULL,
+                    description TEXT NOT NULL,
+                    key_points TEXT NOT NULL,
+                    icon_class TEXT
+                );
+                CREATE INDEX idx_lesson_info_lookup ON lesson_info (LOWER(module_name), LOWER(organ_name));
+                CREATE TABLE snapshot_meta (key TEXT PRIMARY KEY, value TEXT);
+            ''')
+            if os.path.exists(lesson_db):
+                conn.execute('ATTACH DATABASE ? AS lessons', (lesson_db,))
+                conn.execute('INSERT INTO lesson_info SELECT id, module_name, organ_name, title, description, '
+                             'key_points, icon_class FROM lessons.lesson_info')
+                conn.commit()
+                conn.execute('DETACH DATABASE lessons')
+        finally:
+            conn.close()
+        if db is not None:
+            # Firestore wins over the local copy for every quiz it has
+            quiz_store.sync_from_firestore(db, path=tmp)
+        conn = sqlite3.connect(tmp)
+        try:
+            conn.executemany('INSERT OR REPLACE INTO snapshot_meta (key, value) VALUES (?, ?)', [
+                ('built_at', str(time.time())),
+                ('source', source or ('firestore+local' if db is not None else 'local'))
+            ])
+            conn.commit()
+            # Readers open it immutable: no journal, compact pages
+            conn.execute('PRAGMA journal_mode=DELETE')
+            conn.execute('VACUUM')
+        finally:
+            conn.close()
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return snapshot_info(path)
+
+
+def refresh_snapshot():
+    """Republish the snapshot with the current lesson_info (after admin edits); no-op
+    when none is published. Quizzes are carried over from the current snapshot.
+    """
+    info = snapshot_info()
+    if info is None:
+        return None
+    try:
+        return build_snapshot(quiz_db=SNAPSHOT_PATH, source=info['source'])
+    except Exception as e:
+        print(f"Content snapshot refresh failed: {e}")
+        return None
+
+
+def snapshot_info(path=None):
+    """Counts and build time of the published snapshot, or None."""
+    conn = snapshot_connection(path)
+    if conn is None:
+        return None
+    meta = dict(conn.execute('SELECT key, value FROM snapshot_meta').fetchall())
+    return {
+        'path': path or SNAPSHOT_PATH,
+        'built_at': float(meta['built_at']) if meta.get('built_at') else None,
+        'source': meta.get('source'),
+        'quizzes': conn.execute('SELECT COUNT(*) FROM quizzes').fetchone()[0],
+        'lessons': conn.execute('SELECT COUNT(*) FROM lesson_info').fetchone()[0]
+    }
@@ -0,0 +1,190 @@
+"""Server-sent event feeds replacing dashboard polling.
+
+A browser tab subscribes to channels; each channel is backed by one Firestore on_snapshot
+listener per worker process, shared by every tab subscribed to it and stopped when the
+last one leaves:
+
+    ('inbox', uid)          inboxes/{uid}             -> 'notifications' events
+    ('class', teacher_id)   class_summaries/{id}      -> 'progress' events
+
+The in-memory backend (FIRESTORE_BACKEND=memory) implements on_snapshot too, so the same
+path works offline. Payloads are full snapshots, so a slow client only ever needs the
+latest one and older queued events are dropped.
+
+An open stream holds a worker thread, so the feeds are off unless EVENTS_ENABLED=1, which
+needs threaded or async gunicorn workers (--worker-class gthread --threads N, or gevent);
+with the default sync workers pages keep polling. Each stream ends after
+EVENTS_STREAM_SECONDS and the browser reconnects (retry:), so no request outlives that.
+"""
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+from utils.firebase_service import get_firestore
+
+EVENTS_ENABLED = os.getenv('EVENTS_ENABLED', '0').strip().lower() in ('1', 'true', 'yes')
+STREAM_SECONDS = float(os.getenv('EVENTS_STREAM_SECONDS', '300'))
+HEARTBEAT_SECONDS = 25
+QUEUE_SIZE = 16
+
+_lock = threading.Lock()
+_feeds = {}  # channel -> _Feed
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def _render_inbox(data):
+    from utils.notifications import inbox_payload
+    return inbox_payload(data)
+
+
+def _render_class(data):
+    from utils.class_summary import summarize
+    return {'summary': summarize(data.get('students'))}
+
+
+_CHANNELS = {
+    'inbox': ('inboxes', 'notifications', _render_inbox),
+    'class': ('class_summaries', 'progress', _render_class),
+}
+
+
+class Subscription:
+    """Queue of (event, payload) for one connected client."""
+
+    def __init__(self, channels):
+        self.channels = list(channels)
+        self.queue = queue.Queue(maxsize=QUEUE_SIZE)
+
+    def put(self, event, payload):
+        while True:
+            try:
+                self.queue.put_nowait((event, payload))
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+
+class _Feed:
+    """One Firestore listener shared by every subscriber of a channel in this worker."""
+
+    def __init__(self, channel):
+        self.channel = channel
+        collection, self.event, self.render = _CHANNELS[channel[0]]
+        self.ref = get_firestore().collection(collection).document(channel[1])
+        self.subscribers = set()
+        self.last = None
+        self.watch = None
+
+    def start(self):
+        self.watch = self.ref.on_snapshot(self._on_snapshot)
+
+    def stop(self):
+        if self.watch is not None:
+            self.watch.unsubscribe()
+            self.watch = None
+
+    def _on_snapshot(self, docs, changes, read_time):
+        snap = docs[0] if docs else None
+        data = (snap.to_dict() or {}) if snap is not None and snap.exists else {}
+        try:
+            payload = json.dumps(self.render(data), default=_json_default)
+        except Exception as e:
+            print('Event render error:', e)
+            return
+        with _lock:
+            self.last = payload
+            subscribers = list(self.subscribers)
+        for sub in subscribers:
+            sub.put(self.event, payload)
+
+
+def subscribe(channels):
+    """Subscribe to the given (kind, id) channels, starting listeners as needed.
+    Raises when a listener cannot be started; nothing stays subscribed in that case.
+    """
+    sub = Subscription(channels)
+    to_start = []
+    replay = []
+    with _lock:
+        for channel in sub.channels:
+            feed = _feeds.get(channel)
+            if feed is None:
+                feed = _Feed(channel)
+                _feeds[channel] = feed
+                to_start.append(feed)
+            elif feed.last is not None:
+                replay.append((feed.event, feed.last))
+            feed.subscribers.add(sub)
+    for event, payload in replay:
+        sub.put(event, payload)
+    # Listeners deliver their initial snapshot to every subscriber registered above
+    for feed in to_start:
+        try:
+            feed.start()
+        except Exception as e:
+            print('Event listener start error:', e)
+            # Drop the dead feed so later subscribers start a new listener
+            with _lock:
+                if _feeds.get(feed.channel) is feed:
+                    del _feeds[feed.channel]
+            unsubscribe(sub)
+            raise
+    return sub
+
+
+def unsubscribe(sub):
+    """Detach sub from its channels, stopping listeners nobody uses anymore."""
+    to_stop = []
+    with _lock:
+        for channel in sub.channels:
+            feed = _feeds.get(channel)
+            if feed is None:
+                continue
+            feed.subscribers.discard(sub)
+            if not feed.subscribers:
+                del _feeds[channel]
+                to_stop.append(feed)
+    for feed in to_stop:
+        try:
+            feed.stop()
+        except Exception as e:
+            print('Event listener stop error:', e)
+
+
+def stream(sub, heartbeat=HEARTBEAT_SECONDS, lifetime=STREAM_SECONDS):
+    """Yield text/event-stream frames for sub until the client goes away or lifetime
+    seconds have passed (the browser then reconnects after the retry delay).
+    """
+    deadline = time.monotonic() + lifetime
+    try:
+        yield 'retry: 5000\n\n'
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            try:
+                event, payload = sub.queue.get(timeout=min(heartbeat, remaining))
+            except queue.Empty:
+                # Comment frame keeps proxies from closing an idle connection
+                yield ': keep-alive\n\n'
+                continue
+            yield f'event: {event}\ndata: {payload}\n\n'
+    finally:
+        unsubscribe(sub)
+
+
+def listener_count():
+    """Number of Firestore listeners open in this worker."""
+    with _lock:
+        return len(_feeds)
@@ -0,0 +1,24 @@
+"""Firestore field path strings, without depending on where the client library exports FieldPath.
+
+firebase_admin.firestore does not re-export FieldPath, so code that needs a dotted update()
+path or the document-id order key builds the strings here (the same ones
+google.cloud.firestore_v1 FieldPath.to_api_repr() / FieldPath.document_id() produce).
+"""
+import re
+
+# Order/filter key for the document id (FieldPath.document_id())
+DOCUMENT_ID = '__name__'
+
+_SIMPLE_SEGMENT = re.compile(r'^[_a-zA-Z][_a-zA-Z0-9]*$')
+
+
+def field_path(*parts) -> str:
+    """Dotted path for update(); segments that are not plain identifiers are backquoted."""
+    quoted = []
+    for part in parts:
+        part = str(part)
+        if _SIMPLE_SEGMENT.match(part):
+            quoted.append(part)
+        else:
+            quoted.append('`' + part.replace('\\', '\\\\').replace('`', '\\`') + '`')
+    return '.'.join(quoted)
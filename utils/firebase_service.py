@@ -1,15 +1,53 @@
 from firebase_admin import credentials, initialize_app, firestore
 import firebase_admin
-from typing import Optional, Dict
-from datetime import datetime
+from typing import Optional, Dict, List
+from datetime import datetime, timezone
+import atexit
+import copy
 import os
+import threading
+from utils.cache import TTLCache
+from utils import firestore_memory, firestore_metrics
+from utils.field_paths import field_path
+from utils.progress import StudentProgress, parse_module_progress, parse_progress, user_progress_map
+
+try:
+    from flask import g, has_request_context
+except ImportError:  # scripts may import this module without Flask installed
+    g = None
+
+    def has_request_context():
+        return False
+
+def use_memory_backend() -> bool:
+    """True when FIRESTORE_BACKEND=memory selects the in-process Firestore stand-in."""
+    return os.getenv('FIRESTORE_BACKEND', 'firestore').strip().lower() == 'memory'
 
 def get_firestore():
-    """Returns a Firestore client, ensuring Firebase is initialized first."""
+    """Returns a Firestore client, ensuring Firebase is initialized first.
+    With FIRESTORE_BACKEND=memory this is the in-process stand-in from utils.firestore_memory.
+    The client is wrapped so reads/writes are accounted per request (utils.firestore_metrics).
+    """
     _ensure_app()
-    return firestore.client()
+    if use_memory_backend():
+        return firestore_metrics.instrument(firestore_memory.get_client())
+    return firestore_metrics.instrument(firestore.client())
+
+def run_transaction(db, func):
+    """Run func(transaction) in a transaction on db, retrying on contention for real Firestore."""
+    raw = firestore_metrics.unwrap(db)
+
+    def run(transaction):
+        return func(firestore_metrics.instrument_transaction(transaction))
+
+    if isinstance(raw, firestore_memory.MemoryFirestore):
+        return raw.run_transaction(run)
+    return firestore.transactional(run)(raw.transaction())
 
 def _ensure_app():
+    if use_memory_backend():
+        # Offline backend: no Firebase app or credentials needed
+        return
     try:
         if not firebase_admin._apps:
             cred_path = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
@@ -48,34 +86,120 @@ def _ensure_app():
     except Exception as e:
         print("Firebase initialization error:", e)
 
-def get_user_progress(uid: str):
-    """Return the 'progress' sub-object for the given user id from Firestore.
-    Returns a dict mapping module ids to progress objects (as stored in Firestore).
+# Process-wide LRU+TTL cache of users/{uid} documents shared across requests.
+# Only existing documents are cached; writes made through this module keep it current.
+# Progress is also written by the browser (and by other workers), so progress reads
+# (get_user_progress) skip this cache and always fetch the document.
+_user_doc_cache = TTLCache(
+    maxsize=int(os.getenv('USER_DOC_CACHE_SIZE', '2048')),
+    ttl=float(os.getenv('USER_DOC_CACHE_TTL', '60'))
+)
+
+def user_doc_cache_stats() -> Dict:
+    """Return hit/miss/eviction counters of the process-wide user document cache."""
+    return _user_doc_cache.stats()
+
+# Request-scoped identity map for users/{uid} documents.
+# Each entry is the document data dict, or None when the document does not exist.
+def _request_user_docs():
+    """Return the per-request user document map stored on flask.g, or None outside a request."""
+    if not has_request_context():
+        return None
+    docs = getattr(g, '_firestore_user_docs', None)
+    if docs is None:
+        docs = {}
+        g._firestore_user_docs = docs
+        # uids whose entry was read from Firestore during this request (not from the cache)
+        g._firestore_user_docs_read = set()
+    return docs
+
+def _load_user_doc(uid: str, fresh: bool = False):
+    """Return a private copy of users/{uid} data (or None if missing), reading Firestore
+    at most once per request and only when the process cache has no fresh copy.
+    fresh=True ignores the process cache (the read still refreshes it).
+    Callers are free to mutate the returned dict.
+    """
+    docs = _request_user_docs()
+    if docs is not None and uid in docs and (not fresh or uid in g._firestore_user_docs_read):
+        data = docs[uid]
+        return copy.deepcopy(data) if data is not None else None
+    data = None if fresh else _user_doc_cache.get(uid)
+    if data is not None:
+        data = copy.deepcopy(data)
+    else:
+        snap = get_firestore().collection('users').document(uid).get()
+        data = (snap.to_dict() or {}) if snap.exists else None
+        if data is not None:
+            _user_doc_cache.set(uid, copy.deepcopy(data))
+        else:
+            _user_doc_cache.invalidate(uid)
+        if docs is not None:
+            g._firestore_user_docs_read.add(uid)
+    if docs is not None:
+        docs[uid] = copy.deepcopy(data) if data is not None else None
+    return data
+
+def _resolve_sentinels(value):
+    """Replace SERVER_TIMESTAMP sentinels with the local UTC time for cached copies."""
+    if value is firestore.SERVER_TIMESTAMP:
+        return datetime.now(timezone.utc)
+    if isinstance(value, dict):
+        return {k: _resolve_sentinels(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_resolve_sentinels(v) for v in value]
+    return value
+
+def _remember_user_doc(uid: str, fields: Optional[Dict], merge: bool = True):
+    """Keep the request identity map and the process cache in step with a write to users/{uid}.
+    With merge=True the top-level fields are merged into the cached copies; otherwise
+    the cached copies are replaced. Passing fields=None forgets the cached entries.
+    """
+    docs = _request_user_docs()
+    if fields is None:
+        if docs is not None:
+            docs.pop(uid, None)
+        _user_doc_cache.invalidate(uid)
+        return
+    fields = _resolve_sentinels(copy.deepcopy(fields))
+    if docs is not None:
+        if not merge:
+            docs[uid] = copy.deepcopy(fields)
+        elif uid in docs:
+            current = docs[uid] if docs[uid] is not None else {}
+            current.update(copy.deepcopy(fields))
+            docs[uid] = current
+    if not merge:
+        _user_doc_cache.set(uid, fields)
+        return
+    cached = _user_doc_cache.peek(uid)
+    if cached is None:
+        # Unknown prior state: a partial copy would look like a full document
+        return
+    current = copy.deepcopy(cached)
+    current.update(fields)
+    _user_doc_cache.set(uid, current)
+
+def forget_user_doc(uid: str):
+    """Drop any cached copy of users/{uid}; call after writing the document directly
+    (outside the helpers in this module) so later reads fetch it again.
+    """
+    if uid:
+        _remember_user_doc(uid, None)
+
+def get_user_progress(uid: str) -> StudentProgress:
+    """Return the given user's progress map from Firestore as a StudentProgress
+    (utils.progress); empty when the user or the map does not exist. Always reads the
+    document (once per request): the browser writes progress without going through here.
     """
     if not uid:
-        return {}
-    _ensure_app()
-    db = firestore.client()
-    doc_ref = db.collection('users').document(uid)
-    doc = doc_ref.get()
-    if not doc.exists:
-        return {}
-    data = doc.to_dict() or {}
-    # Support both 'progress' and 'modules' field names
-    progress = data.get('progress') or data.get('modules') or {}
-    # Normalize keys to strings
-    try:
-        normalized = { str(k): v for k, v in (progress.items() if isinstance(progress, dict) else {}) }
-    except Exception:
-        normalized = {}
-    return normalized
+        return StudentProgress()
+    return parse_progress(user_progress_map(_load_user_doc(uid, fresh=True)))
 
 def get_user_data(email: str):
     """Return the first user document matching the given email, or None."""
     if not email:
         return None
-    _ensure_app()
-    db = firestore.client()
+    db = get_firestore()
     try:
         users = db.collection('users').where('email', '==', email).limit(1).get()
         if not users:
@@ -91,19 +215,19 @@ def create_user_doc(email: str, age_group: str = None, uid: str = None):
     """
     if not email and not uid:
         return None
-    _ensure_app()
-    db = firestore.client()
+    db = get_firestore()
     try:
         # If uid provided, prefer to create/get the doc by uid so client-side uid matches doc id
         if uid:
-            doc_ref = db.collection('users').document(uid)
-            if doc_ref.get().exists:
+            if _load_user_doc(uid) is not None:
                 return uid
-            doc_ref.set({
+            new_doc = {
                 'email': email,
                 'age_group': age_group,
                 'progress': {}
-            })
+            }
+            db.collection('users').document(uid).set(new_doc)
+            _remember_user_doc(uid, new_doc, merge=False)
             return uid
 
         # Fallback: look up by email
@@ -111,53 +235,147 @@ def create_user_doc(email: str, age_group: str = None, uid: str = None):
         if users:
             return users[0].id
         doc_ref = db.collection('users').document()
-        doc_ref.set({
+        new_doc = {
             'email': email,
             'age_group': age_group,
             'progress': {}
-        })
+        }
+        doc_ref.set(new_doc)
+        _remember_user_doc(doc_ref.id, new_doc, merge=False)
         return doc_ref.id
     except Exception:
         return None
 
+# Write-behind buffer for progress updates: uid -> {module_id: {field: value}}.
+# Updates queued during a request are merged and flushed once on request teardown
+# (see flush_request_progress) as a single dotted-field-path update that needs no read.
+_pending_progress = {}
+_pending_progress_lock = threading.Lock()
+
+def _progress_field_updates(module_key: str, fields: Dict) -> Dict:
+    """Build update() field paths 'progress.<mid>.<field>' for one module's progress fields."""
+    updates = {}
+    for field, value in fields.items():
+        updates[field_path('progress', module_key, field)] = value
+    # Ensure last_attempt is set server-side
+    updates[field_path('progress', module_key, 'last_attempt')] = firestore.SERVER_TIMESTAMP
+    return updates
+
+def _remember_progress(uid: str, module_key: str, fields: Dict):
+    """Apply a progress update to any cached copies of users/{uid} without reading Firestore."""
+    fields = _resolve_sentinels(copy.deepcopy(fields))
+    fields['last_attempt'] = datetime.now(timezone.utc)
+
+    def apply(data):
+        progress = data.get('progress') if isinstance(data.get('progress'), dict) else {}
+        entry = progress.get(module_key) if isinstance(progress.get(module_key), dict) else {}
+        entry = dict(entry)
+        entry.update(fields)
+        progress[module_key] = entry
+        data['progress'] = progress
+        return data
+
+    docs = _request_user_docs()
+    if docs is not None and docs.get(uid) is not None:
+        docs[uid] = apply(docs[uid])
+    cached = _user_doc_cache.peek(uid)
+    if cached is not None:
+        _user_doc_cache.set(uid, apply(copy.deepcopy(cached)))
+
 def update_user_progress(uid: str, module_id: str, progress_update: dict) -> bool:
     """Merge a progress update for a given module into the user's Firestore document.
-    Returns True on success, False if user doc missing or on error.
+    Inside a request the update is buffered and written on request teardown, merged with
+    any other updates for the same user; outside a request it is written immediately.
+    Returns True on success (or when queued), False on invalid input, a missing user
+    document or a write error.
     """
     if not uid or not module_id or not isinstance(progress_update, dict):
         return False
-    _ensure_app()
-    db = firestore.client()
-    doc_ref = db.collection('users').document(uid)
-    try:
-        snap = doc_ref.get()
-        if not snap.exists:
+    if has_request_context():
+        # Only queue for a document that exists (cached or read once per request), so the
+        # deferred update() cannot fail with NotFound after the caller was told it worked
+        try:
+            if _load_user_doc(uid) is None:
+                return False
+        except Exception as e:
+            print('update_user_progress error:', e)
             return False
-        data = snap.to_dict() or {}
-        progress = data.get('progress') if isinstance(data.get('progress'), dict) else {}
+    module_key = str(module_id)
+    with _pending_progress_lock:
+        entry = _pending_progress.setdefault(uid, {}).setdefault(module_key, {})
+        entry.update(progress_update)
+    _remember_progress(uid, module_key, progress_update)
+    if has_request_context():
+        pending_uids = getattr(g, '_pending_progress_uids', None)
+        if pending_uids is None:
+            pending_uids = set()
+            g._pending_progress_uids = pending_uids
+        pending_uids.add(uid)
+        return True
+    return flush_progress_updates(uid)
 
-        module_key = str(module_id)
-        existing = progress.get(module_key) if isinstance(progress.get(module_key), dict) else {}
-        if not isinstance(existing, dict):
-            existing = {}
+def flush_progress_updates(uid: Optional[str] = None) -> bool:
+    """Write buffered progress updates for one user (or all users when uid is None).
+    Each user gets a single update() of 'progress.<mid>.<field>' paths, so no prior
+    read is needed; it fails if the user document does not exist.
+    Returns True when every write succeeded.
+    """
+    with _pending_progress_lock:
+        if uid is None:
+            batch = dict(_pending_progress)
+            _pending_progress.clear()
+        else:
+            pending = _pending_progress.pop(uid, None)
+            batch = {uid: pending} if pending else {}
+    if not batch:
+        return True
+    db = get_firestore()
+    ok = True
+    for user_id, modules in batch.items():
+        try:
+            updates = {}
+            for module_key, fields in modules.items():
+                updates.update(_progress_field_updates(module_key, fields))
+            db.collection('users').document(user_id).update(updates)
+        except Exception as e:
+            # best-effort logging via print to avoid introducing app logger dependency here
+            print('update_user_progress error:', e)
+            if not isinstance(e, firestore_memory.NotFound):
+                # Transient failure: the next flush for this user retries it
+                _requeue_progress(user_id, modules)
+            # Cached copies already include the update that never landed
+            forget_user_doc(user_id)
+            ok = False
+            continue
+        _refresh_class_summary(user_id)
+    return ok
 
-        # Merge existing and update (update takes precedence)
-        merged = dict(existing)
-        for k, v in progress_update.items():
-            merged[k] = v
+def _requeue_progress(uid: str, modules: Dict):
+    """Put updates that failed to write back in the buffer, under any queued since."""
+    with _pending_progress_lock:
+        pending = _pending_progress.setdefault(uid, {})
+        for module_key, fields in modules.items():
+            merged = dict(fields)
+            merged.update(pending.get(module_key, {}))
+            pending[module_key] = merged
 
-        # Ensure last_attempt is set server-side
-        merged['last_attempt'] = firestore.SERVER_TIMESTAMP
+def flush_request_progress(exc=None):
+    """teardown_request hook: flush progress updates buffered by the current request."""
+    pending_uids = getattr(g, '_pending_progress_uids', None) if has_request_context() else None
+    if not pending_uids:
+        return
+    g._pending_progress_uids = set()
+    for uid in pending_uids:
+        flush_progress_updates(uid)
 
-        progress[module_key] = merged
+# Make sure nothing queued is lost when the worker exits
+atexit.register(flush_progress_updates)
 
-        # Write merged progress back to the document (merge to avoid overwriting other fields)
-        doc_ref.set({'progress': progress}, merge=True)
-        return True
-    except Exception as e:
-        # best-effort logging via print to avoid introducing app logger dependency here
-        print('update_user_progress error:', e)
-        return False
+def _refresh_class_summary(uid: str, data: Optional[Dict] = None):
+    """Push the user's current progress/badges into their teacher's class summary."""
+    # Imported lazily: class_summary imports this module
+    from utils.class_summary import refresh_student_summary
+    refresh_student_summary(uid, _resolve_sentinels(data) if data is not None else None)
 
 def get_user_record(uid: str):
     """Return the full Firestore user document as a dict for the given uid.
@@ -166,29 +384,23 @@ def get_user_record(uid: str):
     """
     if not uid:
         return None
-    _ensure_app()
-    db = firestore.client()
     try:
-        doc_ref = db.collection('users').document(uid)
-        snap = doc_ref.get()
-        if not snap.exists:
+        data = _load_user_doc(uid)
+        if data is None:
             return None
-        data = snap.to_dict() or {}
         # Normalize age group key from either 'age_group' or 'ageGroup'
         age = data.get('age_group') if data.get('age_group') is not None else data.get('ageGroup')
         if age is not None:
             data['age_group'] = age
         # expose the document id for convenience
-        data['_id'] = snap.id
+        data['_id'] = uid
         return data
     except Exception as e:
         print('get_user_record error:', e)
         return None
 
-def _ensure_badges_array(db, user_ref) -> Dict:
-    """Fetch user doc and ensure it has a list field 'badges'. Returns doc data dict."""
-    snap = user_ref.get()
-    data = snap.to_dict() or {}
+def _ensure_badges_array(data: Dict) -> Dict:
+    """Ensure the user doc data has a list field 'badges'. Returns the doc data dict."""
     if not isinstance(data.get('badges'), list):
         data['badges'] = []
     return data
@@ -203,37 +415,43 @@ def has_badge(data: Dict, badge_name: str) -> bool:
             return True
     return False
 
+def _new_badge_entry(badge_name: str, reason: Optional[str] = None) -> Dict:
+    """Build a badges[] entry for the given badge name."""
+    return {
+        'name': str(badge_name),
+        'reason': str(reason) if reason else '',
+        # Firestore cannot store SERVER_TIMESTAMP inside array values reliably via set/merge
+        # Use server UTC time from backend instead
+        'assigned_at': datetime.utcnow().isoformat()
+    }
+
 def award_badge(uid: str, badge_name: str, reason: Optional[str] = None) -> bool:
     """Idempotently append a badge to the user's 'badges' array and set 'badge' as current.
     Stores assignment timestamp server-side. Returns True on success.
     """
     if not uid or not badge_name:
         return False
-    _ensure_app()
-    db = firestore.client()
+    db = get_firestore()
     user_ref = db.collection('users').document(uid)
     try:
-        snap = user_ref.get()
-        if not snap.exists:
+        data = _load_user_doc(uid)
+        if data is None:
             return False
-        data = _ensure_badges_array(db, user_ref)
+        data = _ensure_badges_array(data)
         if has_badge(data, badge_name):
             return True
-        new_badge = {
-            'name': str(badge_name),
-            'reason': str(reason) if reason else '',
-            # Firestore cannot store SERVER_TIMESTAMP inside array values reliably via set/merge
-            # Use server UTC time from backend instead
-            'assigned_at': datetime.utcnow().isoformat()
-        }
+        new_badge = _new_badge_entry(badge_name, reason)
         # Use arrayUnion-like behavior by reading-modifying-writing; avoid duplicates via has_badge
         badges = data.get('badges') or []
         badges.append(new_badge)
-        user_ref.set({
+        badge_fields = {
             'badges': badges,
             'badge': str(badge_name),
             'badge_updated_at': firestore.SERVER_TIMESTAMP
-        }, merge=True)
+        }
+        user_ref.set(badge_fields, merge=True)
+        _remember_user_doc(uid, badge_fields)
+        _refresh_class_summary(uid)
         return True
     except Exception as e:
         print('award_badge error:', e)
@@ -258,16 +476,205 @@ def map_module_to_badge(module_id: str) -> Optional[str]:
     }
     return mapping.get(mid)
 
-def is_module_completed(progress_entry: Dict) -> bool:
-    """Determine completion: require both pre and post quiz completed when available."""
-    if not isinstance(progress_entry, dict):
-        return False
-    pre_ok = bool(progress_entry.get('pre_quiz_completed'))
-    post_ok = bool(progress_entry.get('post_quiz_completed'))
-    # If other progress metric exists (e.g., percent), treat 100 as completed
-    percent = progress_entry.get('percent') or progress_entry.get('progress')
+def is_module_completed(progress_entry) -> bool:
+    """Determine completion: both pre and post quiz completed, or 100 percent reported."""
+    return parse_module_progress(progress_entry).completed
+
+def complete_quiz(uid: str, module_id: str, progress_update: dict, reason: Optional[str] = None) -> Dict:
+    """Apply a module progress update and award the module badge if the module is now
+    complete, as one Firestore transaction (one read, one write) on users/{uid}.
+    Returns { success: bool, progress: merged module entry, badge: awarded badge name or None }.
+    """
+    result = {'success': False, 'progress': {}, 'badge': None}
+    if not uid or not module_id or not isinstance(progress_update, dict):
+        return result
+    module_key = str(module_id)
+    # Anything still buffered for this user must land first so the transaction sees it
+    if not flush_progress_updates(uid):
+        return result
+    db = get_firestore()
+    user_ref = db.collection('users').document(uid)
+
+    def apply(transaction):
+        snap = user_ref.get(transaction=transaction)
+        if not snap.exists:
+            return None
+        data = snap.to_dict() or {}
+        progress = data.get('progress') if isinstance(data.get('progress'), dict) else {}
+        entry = progress.get(module_key) if isinstance(progress.get(module_key), dict) else {}
+        entry = dict(entry)
+        entry.update(progress_update)
+
+        updates = _progress_field_updates(module_key, progress_update)
+        new_badge = None
+        earned = badge_engine.missing_badges({module_key: entry}, data)
+        if earned:
+            new_badge = earned[0]
+            if reason:
+                new_badge['reason'] = str(reason)
+            updates['badges'] = firestore.ArrayUnion([new_badge])
+            updates['badge'] = new_badge['name']
+            updates['badge_updated_at'] = firestore.SERVER_TIMESTAMP
+        transaction.update(user_ref, updates)
+        return data, entry, new_badge
+
     try:
-        percent_val = float(percent)
-    except Exception:
-        percent_val = 0.0
-    return (pre_ok and post_ok) or percent_val >= 100.0
+        applied = run_transaction(db, apply)
+        if applied is None:
+            return result
+        data, entry, new_badge = applied
+        # The transaction read the whole document, so the cached copies can be replaced outright
+        entry['last_attempt'] = firestore.SERVER_TIMESTAMP
+        progress = data.get('progress') if isinstance(data.get('progress'), dict) else {}
+        progress[module_key] = entry
+        data['progress'] = progress
+        if new_badge:
+            data['badges'] = (data.get('badges') if isinstance(data.get('badges'), list) else []) + [new_badge]
+            data['badge'] = new_badge['name']
+            data['badge_updated_at'] = firestore.SERVER_TIMESTAMP
+        _remember_user_doc(uid, data, merge=False)
+        _refresh_class_summary(uid, data)
+        result.update({
+            'success': True,
+            'progress': _resolve_sentinels(entry),
+            'badge': new_badge['name'] if new_badge else None
+        })
+        return result
+    except Exception as e:
+        print('complete_quiz error:', e)
+        forget_user_doc(uid)
+        return result
+
+class BadgeEngine:
+    """Computes, in memory, every module badge a user has earned but does not hold yet,
+    and applies them all with a single write.
+    """
+
+    def __init__(self, badge_for_module=map_module_to_badge, module_completed=is_module_completed):
+        self.badge_for_module = badge_for_module
+        self.module_completed = module_completed
+
+    def missing_badges(self, progress: Dict, user_data: Optional[Dict] = None) -> List[Dict]:
+        """Return new badges[] entries for completed modules whose badge is not yet held.
+        progress is a progress map or a StudentProgress.
+        """
+        held = user_data if isinstance(user_data, dict) else {}
+        if isinstance(progress, StudentProgress):
+            progress = progress.modules
+        missing = []
+        seen = set()
+        for mid, entry in (progress.items() if isinstance(progress, dict) else []):
+            badge_name = self.badge_for_module(str(mid))
+            if not badge_name or badge_name.lower() in seen:
+                continue
+            if self.module_completed(entry) and not has_badge(held, badge_name):
+                seen.add(badge_name.lower())
+                missing.append(_new_badge_entry(badge_name, f"Completed module {mid} 100%"))
+        return missing
+
+    def award_missing(self, uid: str, progress: Optional[Dict] = None) -> List[str]:
+        """Award every missing module badge for uid in one update; no write when nothing is new.
+        progress defaults to the progress map stored on the (cached) user document.
+        Returns the names of the badges awarded.
+        """
+        if not uid:
+            return []
+        try:
+            data = _load_user_doc(uid)
+            if data is None:
+                return []
+            if progress is None:
+                progress = user_progress_map(data)
+            new_badges = self.missing_badges(progress, data)
+            if not new_badges:
+                return []
+            badge_fields = {
+                'badges': firestore.ArrayUnion(new_badges),
+                'badge': new_badges[-1]['name'],
+                'badge_updated_at': firestore.SERVER_TIMESTAMP
+            }
+            get_firestore().collection('users').document(uid).update(badge_fields)
+            badge_fields['badges'] = _ensure_badges_array(data)['badges'] + new_badges
+            _remember_user_doc(uid, badge_fields)
+            _refresh_class_summary(uid)
+            return [b['name'] for b in new_badges]
+        except Exception as e:
+            print('award_missing badges error:', e)
+            return []
+
+badge_engine = BadgeEngine()
+
+# --- Teacher code directory: teacher_codes/{code} -> { teacher_id, active, created_at } ---
+
+TEACHER_CODE_ATTEMPTS = 20
+
+def reserve_teacher_code(teacher_id: str, make_code, teacher_fields: Optional[Dict] = None) -> Optional[str]:
+    """Reserve a fresh code for teacher_id in teacher_codes/{code} and store it on the teacher.
+    make_code() returns a candidate code. Each attempt is one transaction that creates the
+    directory entry only if it is absent, sets 'teacher_code' (plus teacher_fields) on
+    users/{teacher_id} and releases the teacher's previous code. Returns the code, or None
+    when every candidate was taken.
+    """
+    if not teacher_id:
+        return None
+    db = get_firestore()
+    codes = db.collection('teacher_codes')
+    teacher_ref = db.collection('users').document(teacher_id)
+    previous = (_load_user_doc(teacher_id) or {}).get('teacher_code')
+
+    for _ in range(TEACHER_CODE_ATTEMPTS):
+        code = str(make_code()).strip().upper()
+        code_ref = codes.document(code)
+
+        def reserve(transaction):
+            if code_ref.get(transaction=transaction).exists:
+                return False
+            transaction.create(code_ref, {
+                'teacher_id': teacher_id,
+                'active': True,
+                'created_at': firestore.SERVER_TIMESTAMP
+            })
+            fields = dict(teacher_fields or {})
+            fields['teacher_code'] = code
+            transaction.update(teacher_ref, fields)
+            if previous and previous != code:
+                transaction.delete(codes.document(str(previous)))
+            return True
+
+        if run_transaction(db, reserve):
+            _remember_user_doc(teacher_id, dict(teacher_fields or {}, teacher_code=code))
+            return code
+    print('reserve_teacher_code: no free code after', TEACHER_CODE_ATTEMPTS, 'attempts')
+    return None
+
+def find_teacher_by_code(code: str):
+    """Resolve a teacher code to (teacher_id, teacher_data) with one document get.
+    Codes issued before the directory existed are found with the old users query once
+    and then added to the directory. Returns (None, None) when no teacher has the code.
+    """
+    code = str(code or '').strip().upper()
+    if not code or '/' in code:
+        return None, None
+    db = get_firestore()
+    code_ref = db.collection('teacher_codes').document(code)
+    entry = code_ref.get()
+    entry_data = (entry.to_dict() or {}) if entry.exists else {}
+    if entry.exists and entry_data.get('active') is False:
+        return None, None
+    teacher_id = entry_data.get('teacher_id')
+    if teacher_id:
+        teacher = get_user_record(teacher_id)
+        if teacher and teacher.get('role') == 'teacher' and teacher.get('teacher_code') == code:
+            return teacher_id, teacher
+        return None, None
+
+    # Legacy code (or an early directory entry without teacher_id): query once and backfill
+    teachers = db.collection('users').where('teacher_code', '==', code).where('role', '==', 'teacher').limit(1).get()
+    if not teachers:
+        return None, None
+    teacher = teachers[0]
+    try:
+        code_ref.set({'teacher_id': teacher.id, 'active': True, 'created_at': firestore.SERVER_TIMESTAMP}, merge=True)
+    except Exception as e:
+        print('find_teacher_by_code backfill error:', e)
+    return teacher.id, teacher.to_dict() or {}
@@ -0,0 +1,620 @@
+"""In-process stand-in for the Firestore client.
+
+Implements the subset of the google-cloud-firestore API this app uses (collection and
+document get/set/update/delete/on_snapshot, where/order_by/limit/stream, batches,
+transactions and the SERVER_TIMESTAMP / ArrayUnion / Increment transforms) on plain
+Python dicts, so the routes can be exercised, load-tested and benchmarked without a
+Google project.
+
+Select it with FIRESTORE_BACKEND=memory (see utils.firebase_service.get_firestore), and
+seed it from collection dumps with FIRESTORE_MEMORY_SEED (see utils.ndjson_dump).
+"""
+import copy
+import os
+import threading
+import uuid
+from datetime import datetime, timezone
+
+try:
+    # Reuse the real sentinels so code written against firebase_admin.firestore works unchanged
+    from google.cloud.firestore_v1.transforms import (
+        SERVER_TIMESTAMP, DELETE_FIELD, ArrayUnion, ArrayRemove, Increment
+    )
+except ImportError:
+    class _Sentinel:
+        def __init__(self, description):
+            self.description = description
+
+        def __repr__(self):
+            return f'Sentinel: {self.description}'
+
+    SERVER_TIMESTAMP = _Sentinel('Value used to set a document field to the server timestamp.')
+    DELETE_FIELD = _Sentinel('Value used to delete a field in a document.')
+
+    class ArrayUnion:
+        def __init__(self, values):
+            self.values = list(values)
+
+    class ArrayRemove:
+        def __init__(self, values):
+            self.values = list(values)
+
+    class Increment:
+        def __init__(self, value):
+            self.value = value
+
+try:
+    from google.api_core.exceptions import NotFound, Conflict
+except ImportError:
+    class NotFound(Exception):
+        pass
+
+    class Conflict(Exception):
+        pass
+
+MAX_BATCH_WRITES = 500
+
+
+def _split_field_path(path):
+    """Split 'a.b.`c.d`' (or a FieldPath object) into its parts."""
+    if hasattr(path, 'parts'):
+        return list(path.parts)
+    parts, current, quoted, i = [], '', False, 0
+    path = str(path)
+    while i < len(path):
+        ch = path[i]
+        if ch == '\\' and quoted and i + 1 < len(path):
+            current += path[i + 1]
+            i += 2
+            continue
+        if ch == '`':
+            quoted = not quoted
+        elif ch == '.' and not quoted:
+            parts.append(current)
+            current = ''
+        else:
+            current += ch
+        i += 1
+    parts.append(current)
+    return parts
+
+
+_MISSING = object()
+
+
+def _get_path(data, parts):
+    for part in parts:
+        if not isinstance(data, dict) or part not in data:
+            return _MISSING
+        data = data[part]
+    return data
+
+
+def _order_value(snapshot, parts):
+    """Value of an order_by field for a snapshot; '__name__' is the document id."""
+    if parts == ['__name__']:
+        return snapshot.id
+    return _get_path(snapshot._data, parts)
+
+
+def _project(data, projection):
+    """Keep only the given field paths of a document, like a query select()."""
+    result = {}
+    for parts in projection:
+        value = _get_path(data, parts)
+        if value is _MISSING:
+            continue
+        target = result
+        for part in parts[:-1]:
+            target = target.setdefault(part, {})
+        target[parts[-1]] = value
+    return result
+
+
+def _apply_value(current, value, now):
+    """Resolve a written value against the current one, applying transforms."""
+    if value is SERVER_TIMESTAMP:
+        return now
+    if isinstance(value, ArrayUnion):
+        result = list(current) if isinstance(current, list) else []
+        for v in value.values:
+            if v not in result:
+                result.append(copy.deepcopy(v))
+        return result
+    if isinstance(value, ArrayRemove):
+        if not isinstance(current, list):
+            return []
+        return [v for v in current if v not in value.values]
+    if isinstance(value, Increment):
+        base = current if isinstance(current, (int, float)) and not isinstance(current, bool) else 0
+        return base + value.value
+    if isinstance(value, dict):
+        return {k: _apply_value(_MISSING, v, now) for k, v in value.items() if v is not DELETE_FIELD}
+    return copy.deepcopy(value)
+
+
+def _set_path(data, parts, value, now):
+    for part in parts[:-1]:
+        if not isinstance(data.get(part), dict):
+            data[part] = {}
+        data = data[part]
+    if value is DELETE_FIELD:
+        data.pop(parts[-1], None)
+    else:
+        data[parts[-1]] = _apply_value(data.get(parts[-1], _MISSING), value, now)
+
+
+def _merge(data, fields, now):
+    """set(merge=True): nested maps are merged field by field."""
+    for key, value in fields.items():
+        if isinstance(value, dict) and isinstance(data.get(key), dict):
+            _merge(data[key], value, now)
+        elif value is DELETE_FIELD:
+            data.pop(key, None)
+        else:
+            data[key] = _apply_value(data.get(key, _MISSING), value, now)
+
+
+_TYPE_ORDER = (
+    (type(None), 0), (bool, 1), (int, 2), (float, 2), (datetime, 3),
+    (str, 4), (bytes, 5), (list, 8), (dict, 9)
+)
+
+
+def _sort_key(value):
+    """Order values the way Firestore does across types (null < bool < number < ...)."""
+    for cls, rank in _TYPE_ORDER:
+        if isinstance(value, cls):
+            if rank == 0:
+                return (0, 0)
+            if rank in (8, 9):
+                return (rank, repr(value))
+            return (rank, value)
+    return (7, repr(value))
+
+
+def _matches(value, op, expected):
+    if value is _MISSING:
+        return False
+    try:
+        if op == '==':
+            return value == expected
+        if op == '!=':
+            return value != expected and value is not None
+        if op == '<':
+            return _sort_key(value) < _sort_key(expected)
+        if op == '<=':
+            return _sort_key(value) <= _sort_key(expected)
+        if op == '>':
+            return _sort_key(value) > _sort_key(expected)
+        if op == '>=':
+            return _sort_key(value) >= _sort_key(expected)
+        if op == 'in':
+            return value in expected
+        if op == 'not-in':
+            return value not in expected and value is not None
+        if op == 'array_contains':
+            return isinstance(value, list) and expected in value
+        if op == 'array_contains_any':
+            return isinstance(value, list) and any(v in value for v in expected)
+    except TypeError:
+        return False
+    raise ValueError(f'Unsupported operator: {op}')
+
+
+class DocumentSnapshot:
+    def __init__(self, reference, data, update_time=None):
+        self.reference = reference
+        self._data = data
+        self.update_time = update_time
+
+    @property
+    def id(self):
+        return self.reference.id
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field_path):
+        if self._data is None:
+            return None
+        value = _get_path(self._data, _split_field_path(field_path))
+        if value is _MISSING:
+            raise KeyError(field_path)
+        return copy.deepcopy(value)
+
+
+class DocumentReference:
+    def __init__(self, client, collection_path, doc_id):
+        self._client = client
+        self._collection_path = collection_path
+        self.id = doc_id
+
+    @property
+    def path(self):
+        return f'{self._collection_path}/{self.id}'
+
+    @property
+    def parent(self):
+        return CollectionReference(self._client, self._collection_path)
+
+    def collection(self, name):
+        return CollectionReference(self._client, f'{self.path}/{name}')
+
+    def collections(self):
+        return self._client._subcollections(self.path)
+
+    def get(self, field_paths=None, transaction=None):
+        snapshot = self._client._read(self)
+        if field_paths is not None and snapshot._data is not None:
+            snapshot._data = _project(snapshot._data, [_split_field_path(p) for p in field_paths])
+        return snapshot
+
+    def set(self, document_data, merge=False):
+        self._client._write([('set', self, document_data, merge)])
+
+    def create(self, document_data):
+        self._client._write([('create', self, document_data, False)])
+
+    def update(self, field_updates):
+        self._client._write([('update', self, field_updates, False)])
+
+    def delete(self):
+        self._client._write([('delete', self, None, False)])
+
+    def on_snapshot(self, callback):
+        """Call callback([snapshot], changes, read_time) now and after every write to this document."""
+        return self._client._watch(self, callback)
+
+    def __deepcopy__(self, memo):
+        # References are immutable handles; stored as field values they must not copy the client
+        return self
+
+    def __eq__(self, other):
+        return isinstance(other, DocumentReference) and other.path == self.path
+
+    def __hash__(self):
+        return hash(self.path)
+
+    def __repr__(self):
+        return f'<DocumentReference {self.path}>'
+
+
+class Query:
+    ASCENDING = 'ASCENDING'
+    DESCENDING = 'DESCENDING'
+
+    def __init__(self, client, collection_path, filters=(), orders=(), limit=None, projection=None,
+                 start=None, end=None):
+        self._client = client
+        self._collection_path = collection_path
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._limit = limit
+        self._projection = projection
+        # Cursors: (values, inclusive) compared against the order_by fields
+        self._start = start
+        self._end = end
+
+    def _copy(self, **changes):
+        state = {
+            'filters': self._filters,
+            'orders': self._orders,
+            'limit': self._limit,
+            'projection': self._projection,
+            'start': self._start,
+            'end': self._end
+        }
+        state.update(changes)
+        return Query(self._client, self._collection_path, **state)
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        parts = _split_field_path(field_path)
+        return self._copy(filters=self._filters + ((parts, op_string, value),))
+
+    def order_by(self, field_path, direction=ASCENDING):
+        parts = _split_field_path(field_path)
+        if parts == ['__name__'] or field_path == '__name__':
+            parts = ['__name__']
+        return self._copy(orders=self._orders + ((parts, direction),))
+
+    def limit(self, count):
+        return self._copy(limit=int(count))
+
+    def select(self, field_paths):
+        return self._copy(projection=tuple(_split_field_path(p) for p in field_paths))
+
+    def _cursor(self, document_fields, inclusive):
+        """Turn a snapshot, a dict of order_by field values or a list of values into a cursor."""
+        orders = self._orders or ((['__name__'], self.ASCENDING),)
+        if isinstance(document_fields, DocumentSnapshot):
+            values = [_order_value(document_fields, parts) for parts, _d in orders]
+        elif isinstance(document_fields, dict):
+            values = [document_fields['.'.join(parts)] for parts, _d in orders]
+        else:
+            values = list(document_fields)
+        values = [v.id if isinstance(v, DocumentReference) else v for v in values]
+        return tuple(values), inclusive
+
+    def start_at(self, document_fields):
+        return self._copy(start=self._cursor(document_fields, True))
+
+    def start_after(self, document_fields):
+        return self._copy(start=self._cursor(document_fields, False))
+
+    def end_at(self, document_fields):
+        return self._copy(end=self._cursor(document_fields, True))
+
+    def end_before(self, document_fields):
+        return self._copy(end=self._cursor(document_fields, False))
+
+    def _position(self, snapshot, cursor_values):
+        """Compare snapshot with a cursor along the order_by fields: -1 before, 0 equal, 1 after."""
+        orders = self._orders or ((['__name__'], self.ASCENDING),)
+        for (parts, direction), expected in zip(orders, cursor_values):
+            a, b = _sort_key(_order_value(snapshot, parts)), _sort_key(expected)
+            if a != b:
+                result = -1 if a < b else 1
+                return -result if direction == self.DESCENDING else result
+        return 0
+
+    def _run(self):
+        snapshots = []
+        for ref, data, update_time in self._client._documents(self._collection_path):
+            if all(_matches(_get_path(data, parts), op, value) for parts, op, value in self._filters):
+                snapshots.append(DocumentSnapshot(ref, data, update_time))
+        for parts, _direction in self._orders:
+            snapshots = [s for s in snapshots if _order_value(s, parts) is not _MISSING]
+        # Stable multi-key sort: apply the least significant ordering first
+        snapshots.sort(key=lambda s: s.id)
+        for parts, direction in reversed(self._orders):
+            snapshots.sort(
+                key=lambda s: _sort_key(_order_value(s, parts)),
+                reverse=(direction == self.DESCENDING)
+            )
+        if self._start is not None:
+            values, inclusive = self._start
+            snapshots = [s for s in snapshots if self._position(s, values) > (-1 if inclusive else 0)]
+        if self._end is not None:
+            values, inclusive = self._end
+            snapshots = [s for s in snapshots if self._position(s, values) < (1 if inclusive else 0)]
+        if self._limit is not None:
+            snapshots = snapshots[:self._limit]
+        if self._projection is not None:
+            for snapshot in snapshots:
+                snapshot._data = _project(snapshot._data, self._projection)
+        return snapshots
+
+    def stream(self, transaction=None):
+        return iter(self._run())
+
+    def get(self, transaction=None):
+        return self._run()
+
+
+class CollectionReference(Query):
+    def __init__(self, client, path):
+        super().__init__(client, path)
+
+    @property
+    def id(self):
+        return self._collection_path.rsplit('/', 1)[-1]
+
+    def document(self, document_id=None):
+        return DocumentReference(self._client, self._collection_path, document_id or uuid.uuid4().hex[:20])
+
+    def add(self, document_data, document_id=None):
+        ref = self.document(document_id)
+        ref.create(document_data)
+        return datetime.now(timezone.utc), ref
+
+
+class WriteBatch:
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def set(self, reference, document_data, merge=False):
+        self._writes.append(('set', reference, document_data, merge))
+
+    def create(self, reference, document_data):
+        self._writes.append(('create', reference, document_data, False))
+
+    def update(self, reference, field_updates):
+        self._writes.append(('update', reference, field_updates, False))
+
+    def delete(self, reference):
+        self._writes.append(('delete', reference, None, False))
+
+    def __len__(self):
+        return len(self._writes)
+
+    def commit(self):
+        if len(self._writes) > MAX_BATCH_WRITES:
+            raise ValueError(f'A batch may contain at most {MAX_BATCH_WRITES} writes')
+        writes, self._writes = self._writes, []
+        self._client._write(writes)
+        return [None] * len(writes)
+
+
+class Transaction(WriteBatch):
+    """Writes are applied on commit; the client lock is held for the whole transaction."""
+
+
+class MemoryFirestore:
+    """Thread-safe in-memory document store exposing the Firestore client API subset."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        # collection path -> {doc id: (data, update_time)}
+        self._collections = {}
+        # (collection path, doc id) -> [on_snapshot callbacks]
+        self._watchers = {}
+
+    # --- client API -------------------------------------------------------
+    def collection(self, path):
+        return CollectionReference(self, path.strip('/'))
+
+    def document(self, path):
+        collection_path, doc_id = path.strip('/').rsplit('/', 1)
+        return DocumentReference(self, collection_path, doc_id)
+
+    def collections(self):
+        with self._lock:
+            return [CollectionReference(self, p) for p in self._collections if '/' not in p]
+
+    def batch(self):
+        return WriteBatch(self)
+
+    def get_all(self, references, field_paths=None, transaction=None):
+        for ref in references:
+            yield ref.get(field_paths)
+
+    def transaction(self):
+        return Transaction(self)
+
+    def run_transaction(self, func, *args, **kwargs):
+        """Run func(transaction, ...) atomically; its writes are committed when it returns."""
+        with self._lock:
+            transaction = Transaction(self)
+            result = func(transaction, *args, **kwargs)
+            transaction.commit()
+            return result
+
+    def reset(self):
+        with self._lock:
+            self._collections.clear()
+
+    def load_dump(self, path, merge=False):
+        """Load an NDJSON dump written by scripts/dump_collections.py; returns the document count."""
+        from utils.ndjson_dump import import_dump
+        return import_dump(self, path, merge=merge, progress_every=0)
+
+    # --- listeners --------------------------------------------------------
+    def _watch(self, ref, callback):
+        key = (ref._collection_path, ref.id)
+        with self._lock:
+            self._watchers.setdefault(key, []).append(callback)
+        callback([self._read(ref)], [], datetime.now(timezone.utc))
+        return _Watch(self, key, callback)
+
+    def _notify(self, keys, read_time):
+        with self._lock:
+            pending = [(key, list(self._watchers.get(key, ()))) for key in keys if self._watchers.get(key)]
+        for (collection_path, doc_id), callbacks in pending:
+            snapshot = self._read(DocumentReference(self, collection_path, doc_id))
+            for callback in callbacks:
+                try:
+                    callback([snapshot], [], read_time)
+                except Exception as e:
+                    print('on_snapshot callback error:', e)
+
+    # --- storage ----------------------------------------------------------
+    def _read(self, ref):
+        with self._lock:
+            entry = self._collections.get(ref._collection_path, {}).get(ref.id)
+            if entry is None:
+                return DocumentSnapshot(ref, None)
+            return DocumentSnapshot(ref, copy.deepcopy(entry[0]), entry[1])
+
+    def _documents(self, collection_path):
+        with self._lock:
+            docs = self._collections.get(collection_path, {})
+            return [
+                (DocumentReference(self, collection_path, doc_id), copy.deepcopy(data), update_time)
+                for doc_id, (data, update_time) in docs.items()
+            ]
+
+    def _subcollections(self, doc_path):
+        prefix = doc_path + '/'
+        with self._lock:
+            return [
+                CollectionReference(self, p) for p, docs in self._collections.items()
+                if p.startswith(prefix) and '/' not in p[len(prefix):] and docs
+            ]
+
+    def _write(self, writes):
+        """Apply a list of (kind, ref, data, merge) writes atomically."""
+        with self._lock:
+            now = datetime.now(timezone.utc)
+            staged = {}
+
+            def current(ref):
+                key = (ref._collection_path, ref.id)
+                if key not in staged:
+                    entry = self._collections.get(ref._collection_path, {}).get(ref.id)
+                    staged[key] = copy.deepcopy(entry[0]) if entry else None
+                return staged[key]
+
+            for kind, ref, data, merge in writes:
+                key = (ref._collection_path, ref.id)
+                existing = current(ref)
+                if kind == 'delete':
+                    staged[key] = None
+                elif kind == 'create':
+                    if existing is not None:
+                        raise Conflict(f'Document already exists: {ref.path}')
+                    staged[key] = _apply_value(_MISSING, dict(data), now)
+                elif kind == 'set':
+                    if merge and existing is not None:
+                        _merge(existing, data, now)
+                    else:
+                        staged[key] = _apply_value(_MISSING, dict(data), now)
+                elif kind == 'update':
+                    if existing is None:
+                        raise NotFound(f'No document to update: {ref.path}')
+                    for field_path, value in data.items():
+                        _set_path(existing, _split_field_path(field_path), value, now)
+                else:
+                    raise ValueError(f'Unknown write: {kind}')
+
+            for (collection_path, doc_id), data in staged.items():
+                docs = self._collections.setdefault(collection_path, {})
+                if data is None:
+                    docs.pop(doc_id, None)
+                else:
+                    docs[doc_id] = (data, now)
+        # Listeners run outside the lock, after the writes are visible
+        self._notify(list(staged), now)
+
+
+class _Watch:
+    """Handle returned by on_snapshot(); unsubscribe() stops the callbacks."""
+
+    def __init__(self, client, key, callback):
+        self._client = client
+        self._key = key
+        self._callback = callback
+
+    def unsubscribe(self):
+        with self._client._lock:
+            callbacks = self._client._watchers.get(self._key, [])
+            if self._callback in callbacks:
+                callbacks.remove(self._callback)
+            if not callbacks:
+                self._client._watchers.pop(self._key, None)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Return the process-wide in-memory Firestore instance.
+
+    FIRESTORE_MEMORY_SEED (comma-separated dump files) is loaded when it is first created.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            client = MemoryFirestore()
+            for path in filter(None, (p.strip() for p in os.getenv('FIRESTORE_MEMORY_SEED', '').split(','))):
+                print(f'Seeded {client.load_dump(path)} documents from {path}')
+            _client = client
+        return _client
@@ -0,0 +1,291 @@
+"""Per-request accounting of Firestore reads, writes and RPC time.
+
+get_firestore() wraps its client in InstrumentedClient. Every document read, query
+result, write and the time spent waiting on Firestore is added to a counter stored on
+flask.g. After the request, report_request() logs requests above the configured
+thresholds together with the call sites responsible, and, outside production, adds
+X-Firestore-Reads / X-Firestore-Writes / X-Firestore-Ms headers to the response.
+
+Settings (environment):
+    FIRESTORE_METRICS=0          disable the instrumentation entirely
+    FIRESTORE_LOG_OPS=25         log requests with more reads+writes than this
+    FIRESTORE_LOG_MS=500         log requests spending more milliseconds than this in Firestore
+    FIRESTORE_METRICS_HEADERS=1  force the response headers on (they are on in debug/development)
+"""
+import os
+import sys
+import time
+from collections import Counter
+
+try:
+    from flask import g, has_request_context, current_app
+except ImportError:  # scripts may import this module without Flask installed
+    g = None
+    current_app = None
+
+    def has_request_context():
+        return False
+
+_THIS_FILE = os.path.normcase(os.path.abspath(__file__))
+_SKIP_FILES = {_THIS_FILE, os.path.normcase(os.path.abspath(os.path.join(os.path.dirname(__file__), 'firestore_memory.py')))}
+
+
+def metrics_enabled() -> bool:
+    return os.getenv('FIRESTORE_METRICS', '1').strip().lower() not in ('0', 'false', 'no', 'off')
+
+
+class RequestStats:
+    """Firestore usage of a single request."""
+
+    __slots__ = ('reads', 'writes', 'rpc_ms', 'sites')
+
+    def __init__(self):
+        self.reads = 0
+        self.writes = 0
+        self.rpc_ms = 0.0
+        # "file:line function (op)" -> number of operations
+        self.sites = Counter()
+
+    def as_dict(self):
+        return {'reads': self.reads, 'writes': self.writes, 'ms': round(self.rpc_ms, 1)}
+
+
+def _current_stats():
+    if not has_request_context():
+        return None
+    stats = getattr(g, '_firestore_stats', None)
+    if stats is None:
+        stats = RequestStats()
+        g._firestore_stats = stats
+    return stats
+
+
+def _call_site():
+    """Return 'file:line function' of the nearest caller outside the Firestore wrappers."""
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = os.path.normcase(os.path.abspath(frame.f_code.co_filename))
+        if filename not in _SKIP_FILES:
+            return f'{os.path.relpath(filename)}:{frame.f_lineno} {frame.f_code.co_name}'
+        frame = frame.f_back
+    return '?'
+
+
+def _record(op, reads=0, writes=0, elapsed=0.0):
+    stats = _current_stats()
+    if stats is None:
+        return
+    stats.reads += reads
+    stats.writes += writes
+    stats.rpc_ms += elapsed * 1000.0
+    stats.sites[f'{_call_site()} ({op})'] += reads + writes
+
+
+def unwrap(obj):
+    """Return the underlying client object behind an instrumentation proxy."""
+    return getattr(obj, '_wrapped', obj)
+
+
+def _unwrap_args(args, kwargs):
+    return [unwrap(a) for a in args], {k: unwrap(v) for k, v in kwargs.items()}
+
+
+class _Proxy:
+    def __init__(self, wrapped):
+        self._wrapped = wrapped
+
+    def __getattr__(self, name):
+        return getattr(self._wrapped, name)
+
+    def __eq__(self, other):
+        return unwrap(self) == unwrap(other)
+
+    def __hash__(self):
+        return hash(self._wrapped)
+
+    def __repr__(self):
+        return f'<instrumented {self._wrapped!r}>'
+
+
+class InstrumentedQuery(_Proxy):
+    _CHAIN = ('where', 'order_by', 'limit', 'limit_to_last', 'offset', 'select',
+              'start_at', 'start_after', 'end_at', 'end_before')
+
+    def __getattr__(self, name):
+        attr = getattr(self._wrapped, name)
+        if name in self._CHAIN:
+            def chained(*args, **kwargs):
+                args, kwargs = _unwrap_args(args, kwargs)
+                return InstrumentedQuery(attr(*args, **kwargs))
+            return chained
+        return attr
+
+    def stream(self, *args, **kwargs):
+        args, kwargs = _unwrap_args(args, kwargs)
+        started = time.perf_counter()
+        count = 0
+        try:
+            for snapshot in self._wrapped.stream(*args, **kwargs):
+                count += 1
+                yield snapshot
+        finally:
+            # Firestore bills one read even when a query matches nothing
+            _record('query', reads=max(1, count), elapsed=time.perf_counter() - started)
+
+    def get(self, *args, **kwargs):
+        args, kwargs = _unwrap_args(args, kwargs)
+        started = time.perf_counter()
+        results = self._wrapped.get(*args, **kwargs)
+        results = list(results) if not isinstance(results, list) else results
+        _record('query', reads=max(1, len(results)), elapsed=time.perf_counter() - started)
+        return results
+
+    def document(self, *args, **kwargs):
+        return InstrumentedDocument(self._wrapped.document(*args, **kwargs))
+
+    def add(self, *args, **kwargs):
+        started = time.perf_counter()
+        result = self._wrapped.add(*args, **kwargs)
+        _record('add', writes=1, elapsed=time.perf_counter() - started)
+        return result
+
+
+class InstrumentedDocument(_Proxy):
+    def get(self, *args, **kwargs):
+        args, kwargs = _unwrap_args(args, kwargs)
+        started = time.perf_counter()
+        snapshot = self._wrapped.get(*args, **kwargs)
+        _record('get', reads=1, elapsed=time.perf_counter() - started)
+        return snapshot
+
+    def _write(self, op, *args, **kwargs):
+        started = time.perf_counter()
+        result = getattr(self._wrapped, op)(*args, **kwargs)
+        _record(op, writes=1, elapsed=time.perf_counter() - started)
+        return result
+
+    def set(self, *args, **kwargs):
+        return self._write('set', *args, **kwargs)
+
+    def create(self, *args, **kwargs):
+        return self._write('create', *args, **kwargs)
+
+    def update(self, *args, **kwargs):
+        return self._write('update', *args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        return self._write('delete', *args, **kwargs)
+
+    def collection(self, *args, **kwargs):
+        return InstrumentedQuery(self._wrapped.collection(*args, **kwargs))
+
+
+class InstrumentedBatch(_Proxy):
+    """Wraps a WriteBatch (writes counted on commit) or a Transaction (counted when staged)."""
+
+    def __init__(self, wrapped, count_on_commit=True):
+        super().__init__(wrapped)
+        self._count_on_commit = count_on_commit
+        self._staged = 0
+
+    def _stage(self, op, *args, **kwargs):
+        args, kwargs = _unwrap_args(args, kwargs)
+        result = getattr(self._wrapped, op)(*args, **kwargs)
+        if self._count_on_commit:
+            self._staged += 1
+        else:
+            _record(f'transaction.{op}', writes=1)
+        return result
+
+    def set(self, *args, **kwargs):
+        return self._stage('set', *args, **kwargs)
+
+    def create(self, *args, **kwargs):
+        return self._stage('create', *args, **kwargs)
+
+    def update(self, *args, **kwargs):
+        return self._stage('update', *args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        return self._stage('delete', *args, **kwargs)
+
+    def commit(self, *args, **kwargs):
+        started = time.perf_counter()
+        result = self._wrapped.commit(*args, **kwargs)
+        staged, self._staged = self._staged, 0
+        _record('batch.commit', writes=staged, elapsed=time.perf_counter() - started)
+        return result
+
+
+class InstrumentedClient(_Proxy):
+    def collection(self, *args, **kwargs):
+        return InstrumentedQuery(self._wrapped.collection(*args, **kwargs))
+
+    def collection_group(self, *args, **kwargs):
+        return InstrumentedQuery(self._wrapped.collection_group(*args, **kwargs))
+
+    def document(self, *args, **kwargs):
+        return InstrumentedDocument(self._wrapped.document(*args, **kwargs))
+
+    def batch(self):
+        return InstrumentedBatch(self._wrapped.batch())
+
+    def get_all(self, references, *args, **kwargs):
+        refs = [unwrap(r) for r in references]
+        started = time.perf_counter()
+        count = 0
+        for snapshot in self._wrapped.get_all(refs, *args, **kwargs):
+            count += 1
+            yield snapshot
+        _record('get_all', reads=count, elapsed=time.perf_counter() - started)
+
+
+def instrument(client):
+    """Wrap a Firestore client so its operations are accounted to the current request."""
+    if not metrics_enabled() or isinstance(client, InstrumentedClient):
+        return client
+    return InstrumentedClient(client)
+
+
+def instrument_transaction(transaction):
+    """Wrap a transaction handed to user code so its staged writes are counted."""
+    return InstrumentedBatch(transaction, count_on_commit=False)
+
+
+def request_stats():
+    """Return the RequestStats of the current request, or None if nothing was recorded."""
+    if not has_request_context():
+        return None
+    return getattr(g, '_firestore_stats', None)
+
+
+def _headers_enabled() -> bool:
+    if os.getenv('FIRESTORE_METRICS_HEADERS', '').strip().lower() in ('1', 'true', 'yes', 'on'):
+        return True
+    if os.getenv('FLASK_ENV', '').strip().lower() == 'development':
+        return True
+    return bool(current_app and current_app.debug)
+
+
+def report_request(response):
+    """after_request hook: log heavy requests and attach X-Firestore-* headers outside production."""
+    stats = request_stats()
+    if stats is None:
+        return response
+    try:
+        from flask import request
+        max_ops = int(os.getenv('FIRESTORE_LOG_OPS', '25'))
+        max_ms = float(os.getenv('FIRESTORE_LOG_MS', '500'))
+        if stats.reads + stats.writes > max_ops or stats.rpc_ms > max_ms:
+            sites = ', '.join(f'{site} x{n}' for site, n in stats.sites.most_common(10))
+            current_app.logger.warning(
+                'Firestore usage %s %s: reads=%d writes=%d ms=%.1f; call sites: %s',
+                request.method, request.path, stats.reads, stats.writes, stats.rpc_ms, sites
+            )
+        if _headers_enabled():
+            response.headers['X-Firestore-Reads'] = str(stats.reads)
+            response.headers['X-Firestore-Writes'] = str(stats.writes)
+            response.headers['X-Firestore-Ms'] = f'{stats.rpc_ms:.1f}'
+    except Exception as e:
+        print('Firestore metrics report error:', e)
+    return response
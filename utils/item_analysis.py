@@ -0,0 +1,249 @@
+"""Item analysis of module quizzes from the quiz_responses records (utils.quiz_grading).
+
+Per (teacher, module, quiz type) the graded attempts of the current quiz edition are
+folded into sufficient statistics with NumPy: the compact answer strings of a page of
+attempts become one attempts x questions matrix, and only its column sums are kept.
+From these the report derives
+
+    difficulty       share of attempts answering the question correctly
+    discrimination   point-biserial correlation of the question with the rest score
+    distractors      how often each option (and no answer) was chosen
+
+and, from the first pre-quiz and latest post-quiz score of each student, the
+normalized learning gain (post - pre) / (100 - pre) of the module.
+
+States are cached per process and brought up to date incrementally: each request only
+reads the responses submitted since the previous one. NumPy is optional; without it
+analyze() raises AnalysisUnavailable.
+
+The incremental query needs a composite index on quiz_responses:
+teacher_id ASC, module_id ASC, quiz_type ASC, submitted_at ASC, __name__ ASC.
+"""
+import os
+import threading
+from datetime import datetime, timezone
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from utils.cache import TTLCache
+from utils.field_paths import DOCUMENT_ID
+from utils.firebase_service import get_firestore
+from utils.quiz_grading import RESPONSES_COLLECTION, answer_key, key_version
+
+PAGE_SIZE = 1000
+MAX_OPTIONS = 10  # answer strings store one digit per question
+RESPONSE_FIELDS = ['uid', 'version', 'answers', 'score', 'attempted_at', 'submitted_at']
+
+_states = TTLCache(
+    maxsize=int(os.getenv('ANALYSIS_CACHE_SIZE', '256')),
+    ttl=float(os.getenv('ANALYSIS_CACHE_TTL', '3600'))
+)
+_state_locks = {}
+_state_locks_lock = threading.Lock()
+
+
+class AnalysisUnavailable(RuntimeError):
+    """NumPy is not installed."""
+
+
+def _epoch(value):
+    """Seconds since the epoch for a stored time, or None. Firestore returns aware
+    datetimes, the memory backend and offline replays may hold naive (UTC) ones.
+    """
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            return None
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.timestamp()
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    return None
+
+
+class _QuizState:
+    """Running sums over every attempt of one quiz edition seen so far."""
+
+    def __init__(self, key):
+        self.key = np.asarray(key, dtype=np.int16)
+        self.version = key_version(key)
+        n = len(key)
+        self.attempts = 0
+        self.sum_x = np.zeros(n)      # correct answers per question
+        self.sum_xt = np.zeros(n)     # sum of item score * total score
+        self.sum_t = 0.0
+        self.sum_t2 = 0.0
+        # column 0: unanswered, column k + 1: option k
+        self.options = np.zeros((n, MAX_OPTIONS + 1), dtype=np.int64)
+        self.first_scores = {}        # uid -> (attempted_at epoch, score) of the earliest attempt
+        self.last_scores = {}         # uid -> (attempted_at epoch, score) of the latest attempt
+        self.seen = set()             # response ids already folded in
+        self.cursor = None            # last response snapshot read
+
+    def add(self, answers):
+        """Fold a list of equal-length answer strings into the sums."""
+        n = len(self.key)
+        raw = np.frombuffer(''.join(answers).encode('ascii'), dtype=np.uint8).reshape(-1, n)
+        selected = raw.astype(np.int16) - ord('0')
+        selected[raw == ord('-')] = -1
+        correct = (selected == self.key).astype(np.float64)
+        totals = correct.sum(axis=1)
+        self.attempts += len(answers)
+        self.sum_x += correct.sum(axis=0)
+        self.sum_xt += correct.T @ totals
+        self.sum_t += totals.sum()
+        self.sum_t2 += totals @ totals
+        columns = np.arange(n) * (MAX_OPTIONS + 1)
+        self.options += np.bincount((columns + selected + 1).ravel(),
+                                    minlength=n * (MAX_OPTIONS + 1)).reshape(n, MAX_OPTIONS + 1)
+
+    def add_score(self, uid, attempted_at, score):
+        if not uid or score is None:
+            return
+        attempted_at = _epoch(attempted_at)
+        first = self.first_scores.get(uid)
+        if first is None or (attempted_at is not None and first[0] is not None and attempted_at < first[0]):
+            self.first_scores[uid] = (attempted_at, score)
+        last = self.last_scores.get(uid)
+        if last is None or last[0] is None or (attempted_at is not None and attempted_at >= last[0]):
+            self.last_scores[uid] = (attempted_at, score)
+
+    def items(self, option_counts):
+        """Per-question difficulty, discrimination and distractor counts."""
+        count = self.attempts
+        if not count:
+            return []
+        p = self.sum_x / count
+        # Rest score R = T - x (the total without the item itself); x * x == x
+        sum_r = self.sum_t - self.sum_x
+        sum_r2 = self.sum_t2 - 2 * self.sum_xt + self.sum_x
+        cov = (self.sum_xt - self.sum_x) / count - p * sum_r / count
+        var_r = sum_r2 / count - (sum_r / count) ** 2
+        denominator = np.sqrt(p * (1 - p) * var_r)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            discrimination = np.where(denominator > 1e-12, cov / denominator, np.nan)
+        chosen = self.options[:, 1:]
+        # Highest option anyone picked, so distractor lists cover every answer given
+        picked = np.where(chosen.any(axis=1), MAX_OPTIONS - np.argmax(chosen[:, ::-1] > 0, axis=1), 0)
+        items = []
+        for index in range(len(self.key)):
+            shown = max(option_counts[index] if index < len(option_counts) else 0, int(picked[index]))
+            items.append({
+                'question': index,
+                'correct': int(self.key[index]),
+                'difficulty': round(float(p[index]), 4),
+                'discrimination': None if np.isnan(discrimination[index]) else round(float(discrimination[index]), 4),
+                'options': [int(c) for c in self.options[index, 1:shown + 1]],
+                'unanswered': int(self.options[index, 0])
+            })
+        return items
+
+
+def _lock_for(teacher_id, module_id):
+    # One lock covers the pre and post states of a module (the gain reads both)
+    with _state_locks_lock:
+        return _state_locks.setdefault((teacher_id, module_id), threading.Lock())
+
+
+def _refresh(teacher_id, module_id, quiz_type):
+    """Cached state for a quiz, updated with the responses submitted since the last call.
+    The caller holds _lock_for(teacher_id, module_id).
+    """
+    key = answer_key(module_id, quiz_type)
+    if key is None:
+        return None
+    state_key = (teacher_id, module_id, quiz_type)
+    state = _states.get(state_key)
+    if state is None or state.version != key_version(key):
+        # First use, expired, or the quiz was edited: start over
+        state = _QuizState(key)
+    query = (get_firestore().collection(RESPONSES_COLLECTION)
+             .where('teacher_id', '==', teacher_id)
+             .where('module_id', '==', module_id)
+             .where('quiz_type', '==', quiz_type)
+             .order_by('submitted_at')
+             .order_by(DOCUMENT_ID)
+             .select(RESPONSE_FIELDS))
+    while True:
+        page_query = query.start_after(state.cursor) if state.cursor is not None else query
+        page = list(page_query.limit(PAGE_SIZE).stream())
+        answers = []
+        for snap in page:
+            if snap.id in state.seen:
+                # Replayed attempt (same attempt_id) re-submitted later
+                continue
+            state.seen.add(snap.id)
+            data = snap.to_dict() or {}
+            state.add_score(data.get('uid'), data.get('attempted_at'), data.get('score'))
+            encoded = data.get('answers') or ''
+            if data.get('version') == state.version and len(encoded) == len(key):
+                answers.append(encoded)
+        if answers:
+            state.add(answers)
+        if page:
+            state.cursor = page[-1]
+        if len(page) < PAGE_SIZE:
+            break
+    _states.set(state_key, state)
+    return state
+
+
+def _learning_gain(pre, post):
+    """Normalized gain over students with both a pre and a post score."""
+    if pre is None or post is None:
+        return None
+    students = sorted(set(pre.first_scores) & set(post.last_scores))
+    if not students:
+        return {'students': 0}
+    pre_scores = np.array([pre.first_scores[uid][1] for uid in students], dtype=np.float64)
+    post_scores = np.array([post.last_scores[uid][1] for uid in students], dtype=np.float64)
+    room = 100.0 - pre_scores
+    with np.errstate(divide='ignore', invalid='ignore'):
+        individual = np.where(room > 0, (post_scores - pre_scores) / room, np.nan)
+    average_pre = float(pre_scores.mean())
+    average_post = float(post_scores.mean())
+    return {
+        'students': len(students),
+        'averagePre': round(average_pre, 2),
+        'averagePost': round(average_post, 2),
+        # Gain of the class averages, and the mean of the students' own gains
+        'classGain': round((average_post - average_pre) / (100.0 - average_pre), 4) if average_pre < 100 else None,
+        'averageGain': round(float(np.nanmean(individual)), 4) if np.isfinite(individual).any() else None
+    }
+
+
+def analyze(teacher_id, module_id, quiz_type):
+    """Item analysis of a module quiz over the teacher's students, or None if the quiz
+    has no gradable content. Raises AnalysisUnavailable without NumPy.
+    """
+    if np is None:
+        raise AnalysisUnavailable('Item analysis requires numpy')
+    from utils.quiz_handler import get_quiz_content
+    quiz = get_quiz_content(module_id, quiz_type) or {}
+    option_counts = [len(q.get('a') or []) for q in quiz.get('questions') or []]
+    with _lock_for(teacher_id, module_id):
+        state = _refresh(teacher_id, module_id, quiz_type)
+        if state is None:
+            return None
+        other = _refresh(teacher_id, module_id, 'post' if quiz_type == 'pre' else 'pre')
+        pre, post = (state, other) if quiz_type == 'pre' else (other, state)
+        scores = np.array([score for _at, score in state.last_scores.values()], dtype=np.float64)
+        items = state.items(option_counts)
+        gain = _learning_gain(pre, post)
+    return {
+        'moduleId': module_id,
+        'quizType': quiz_type,
+        'title': quiz.get('title'),
+        'version': state.version,
+        'attempts': state.attempts,
+        'students': len(state.last_scores),
+        'averageScore': round(float(scores.mean()), 2) if scores.size else None,
+        'items': items,
+        'learningGain': gain
+    }
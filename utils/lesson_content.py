@@ -0,0 +1,89 @@
+"""Cached lookups of the lesson_info table (organ info cards shown in the lessons).
+
+Rows only change through the admin pages, which call invalidate_lesson_info(). When a
+content snapshot is published (utils.content_snapshot) it is read instead.
+"""
+import os
+import sqlite3
+
+from utils.cache import TTLCache
+from utils.content_snapshot import snapshot_connection, refresh_snapshot
+
+LESSON_DB = 'lesson_info.db'
+
+_lesson_cache = TTLCache(
+    maxsize=int(os.getenv('LESSON_CACHE_SIZE', '512')),
+    ttl=float(os.getenv('LESSON_CACHE_TTL', '3600'))
+)
+
+
+def _key(module_name, organ_name):
+    return ((module_name or '').lower(), (organ_name or '').lower())
+
+
+def _row_to_info(title, description, key_points, icon_class):
+    return {
+        'title': title,
+        'description': description,
+        'key_points': [point.strip() for point in key_points.split('\n') if point.strip()] if key_points else [],
+        'icon_class': icon_class or 'fa-info-circle'
+    }
+
+
+def get_lesson_info(module_name, organ_name):
+    """Return the info card for (module, organ), case-insensitively, or None."""
+    key = _key(module_name, organ_name)
+    snapshot = snapshot_connection()
+    if snapshot is not None:
+        # Shared read-only snapshot: no per-process copy needed
+        row = _query(snapshot, key)
+        return _row_to_info(*row) if row else None
+    info = _lesson_cache.get(key)
+    if info is None:
+        conn = sqlite3.connect(LESSON_DB)
+        try:
+            row = _query(conn, key)
+        finally:
+            conn.close()
+        if not row:
+            return None
+        info = _row_to_info(*row)
+        _lesson_cache.set(key, info)
+    return info
+
+
+def _query(conn, key):
+    return conn.execute('''
+        SELECT title, description, key_points, icon_class FROM lesson_info
+        WHERE LOWER(module_name) = ? AND LOWER(organ_name) = ?
+        ORDER BY id LIMIT 1
+    ''', key).fetchone()
+
+
+def preload_lesson_info():
+    """Load every lesson_info row into the cache. Returns the number of entries."""
+    conn = sqlite3.connect(LESSON_DB)
+    try:
+        rows = conn.execute('''
+            SELECT module_name, organ_name, title, description, key_points, icon_class
+            FROM lesson_info ORDER BY id
+        ''').fetchall()
+    finally:
+        conn.close()
+    loaded = {}
+    for module_name, organ_name, *fields in rows:
+        # Same precedence as get_lesson_info: the oldest row wins
+        loaded.setdefault(_key(module_name, organ_name), _row_to_info(*fields))
+    for key, info in loaded.items():
+        _lesson_cache.set(key, info)
+    return len(loaded)
+
+
+def invalidate_lesson_info():
+    """Forget every cached card (after the table was edited) and republish the snapshot."""
+    _lesson_cache.clear()
+    refresh_snapshot()
+
+
+def lesson_cache_stats():
+    return _lesson_cache.stats()
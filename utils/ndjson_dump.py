@@ -0,0 +1,146 @@
+"""Streaming export/import of Firestore collections as gzip-compressed NDJSON.
+
+One line per document: {"path": "users/abc", "data": {...}}. Values JSON cannot carry are
+tagged objects, so a dump round-trips exactly:
+
+    timestamps       {"__type__": "timestamp", "value": "2024-01-01T00:00:00+00:00"}
+    references       {"__type__": "ref", "path": "users/abc"}
+    geo points       {"__type__": "geo", "latitude": 1.0, "longitude": 2.0}
+    bytes            {"__type__": "bytes", "value": "<base64>"}
+
+Export reads with cursor pagination and writes line by line, and import reads line by
+line and writes in batches, so memory use is constant in the collection size. Used by
+scripts/dump_collections.py and by the in-memory Firestore stand-in to seed benchmarks.
+"""
+import base64
+import gzip
+import json
+import time
+from datetime import datetime
+
+from utils.field_paths import DOCUMENT_ID
+
+MAX_BATCH_WRITES = 500
+
+
+def encode_value(value):
+    """Convert a Firestore value to its JSON form."""
+    if isinstance(value, datetime):
+        return {'__type__': 'timestamp', 'value': value.isoformat()}
+    if isinstance(value, dict):
+        return {str(k): encode_value(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [encode_value(v) for v in value]
+    if isinstance(value, bytes):
+        return {'__type__': 'bytes', 'value': base64.b64encode(value).decode('ascii')}
+    if hasattr(value, 'latitude') and hasattr(value, 'longitude'):
+        return {'__type__': 'geo', 'latitude': value.latitude, 'longitude': value.longitude}
+    if hasattr(value, 'path') and hasattr(value, 'collection') and hasattr(value, 'id'):
+        return {'__type__': 'ref', 'path': value.path}
+    return value
+
+
+def decode_value(value, db=None):
+    """Inverse of encode_value; references are resolved against db (kept as paths without one)."""
+    if isinstance(value, list):
+        return [decode_value(v, db) for v in value]
+    if not isinstance(value, dict):
+        return value
+    kind = value.get('__type__')
+    if kind == 'timestamp':
+        return datetime.fromisoformat(value['value'])
+    if kind == 'ref':
+        return db.document(value['path']) if db is not None else value['path']
+    if kind == 'bytes':
+        return base64.b64decode(value['value'])
+    if kind == 'geo':
+        try:
+            from google.cloud.firestore_v1 import GeoPoint
+            return GeoPoint(value['latitude'], value['longitude'])
+        except ImportError:
+            return {'latitude': value['latitude'], 'longitude': value['longitude']}
+    return {k: decode_value(v, db) for k, v in value.items()}
+
+
+def iter_documents(collection, page_size=500, subcollections=False):
+    """Yield every document snapshot of a collection reference, page by page."""
+    base = collection.order_by(DOCUMENT_ID).limit(page_size)
+    after = None
+    while True:
+        query = base.start_after({DOCUMENT_ID: after}) if after else base
+        count = 0
+        for snap in query.stream():
+            count += 1
+            after = snap.id
+            yield snap
+            if subcollections:
+                for sub in snap.reference.collections():
+                    yield from iter_documents(sub, page_size, subcollections)
+        if count < page_size:
+            return
+
+
+def export_collection(db, name, path, page_size=500, subcollections=False, progress_every=10000):
+    """Stream collection `name` (optionally with subcollections) to a gzip NDJSON file.
+    Returns the number of documents written.
+    """
+    written = 0
+    started = time.monotonic()
+    with gzip.open(path, 'wt', encoding='utf-8') as out:
+        for snap in iter_documents(db.collection(name), page_size, subcollections):
+            line = {'path': snap.reference.path, 'data': encode_value(snap.to_dict() or {})}
+            out.write(json.dumps(line, ensure_ascii=False, separators=(',', ':')))
+            out.write('\n')
+            written += 1
+            if progress_every and written % progress_every == 0:
+                print(f'{name}: {written} documents, {written / (time.monotonic() - started):.0f} docs/s', flush=True)
+    return written
+
+
+def iter_dump(path):
+    """Yield (document path, encoded data) pairs from a dump file."""
+    opener = gzip.open if str(path).endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as fh:
+        for line in fh:
+            line = line.strip()
+            if line:
+                record = json.loads(line)
+                yield record['path'], record.get('data') or {}
+
+
+def import_dump(db, path, batch_size=MAX_BATCH_WRITES, max_writes_per_sec=None, merge=False,
+                progress_every=10000):
+    """Write every document of a dump file with batched set() calls.
+    max_writes_per_sec throttles the import (None: as fast as possible).
+    Returns the number of documents written.
+    """
+    batch_size = max(1, min(int(batch_size), MAX_BATCH_WRITES))
+    written = 0
+    started = time.monotonic()
+    pending = []
+
+    def flush():
+        nonlocal written
+        if not pending:
+            return
+        batch = db.batch()
+        for doc_path, data in pending:
+            batch.set(db.document(doc_path), data, merge=merge)
+        batch.commit()
+        written += len(pending)
+        pending.clear()
+        if max_writes_per_sec:
+            # Sleep until the average rate is back under the limit
+            ahead = written / float(max_writes_per_sec) - (time.monotonic() - started)
+            if ahead > 0:
+                time.sleep(ahead)
+
+    for doc_path, data in iter_dump(path):
+        pending.append((doc_path, decode_value(data, db)))
+        if len(pending) >= batch_size:
+            before = written
+            flush()
+            if progress_every and written // progress_every > before // progress_every:
+                print(f'{path}: {written} documents, {written / (time.monotonic() - started):.0f} docs/s', flush=True)
+    flush()
+    return written
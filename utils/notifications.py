@@ -0,0 +1,235 @@
+"""Notification fan-out: one notifications/{id} document per recipient, plus an inbox summary.
+
+Documents are written with WriteBatch in chunks of up to 500 writes (Firestore's batch
+limit) on a small background executor, so endpoints return as soon as their own write is
+done. A failed chunk is retried with backoff. Document ids are chosen before the first
+attempt, and before retrying, the chunk's first notification is read: a batch commits
+atomically, so if it exists the failed-looking commit went through and the chunk is not
+written again (which would increment the unread counts twice).
+
+Each recipient also has inboxes/{uid} holding the unread count and the headers of their
+latest notifications. Fan-out updates it in the same batch with blind transforms
+(Increment on 'unread', ArrayUnion on 'items'), so polling is a single document read.
+The header list is trimmed to NOTIFY_INBOX_SIZE when the inbox is read or marked read.
+
+Settings (environment):
+    NOTIFY_WORKERS=2      background threads writing notifications
+    NOTIFY_RETRIES=3      attempts per chunk before it is given up (and logged)
+    NOTIFY_INBOX_SIZE=20  notification headers kept in each inbox
+"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from firebase_admin import firestore
+from utils.firebase_service import get_firestore, run_transaction
+
+MAX_BATCH_WRITES = 500
+# Each recipient costs two writes: the notification and the inbox update
+RECIPIENTS_PER_BATCH = MAX_BATCH_WRITES // 2
+HEADER_FIELDS = ('type', 'title', 'resource_id', 'url', 'message')
+
+_executor = ThreadPoolExecutor(max_workers=max(1, int(os.getenv('NOTIFY_WORKERS', '2'))),
+                               thread_name_prefix='notify')
+
+
+def inbox_size():
+    return max(1, int(os.getenv('NOTIFY_INBOX_SIZE', '20')))
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _header(notification_id, data, created_at):
+    """Compact inbox entry for a notification."""
+    header = {k: data.get(k) for k in HEADER_FIELDS if data.get(k) is not None}
+    header.update({'id': notification_id, 'read': bool(data.get('read', False)), 'created_at': created_at})
+    return header
+
+
+def _write_chunk(db, refs, payload, retries):
+    """Commit one batch of notifications and inbox updates, retrying with exponential backoff.
+    A retry first checks whether the previous attempt committed after all (e.g. timed out).
+    """
+    # Array values cannot hold SERVER_TIMESTAMP, so headers carry the local UTC time
+    created_at = datetime.now(timezone.utc)
+    inboxes = db.collection('inboxes')
+    for attempt in range(1, retries + 1):
+        try:
+            if attempt > 1 and refs[0][1].get().exists:
+                return True
+            batch = db.batch()
+            for user_id, ref in refs:
+                doc = dict(payload)
+                doc.update({'user_id': user_id, 'read': False, 'created_at': firestore.SERVER_TIMESTAMP})
+                batch.set(ref, doc)
+                batch.set(inboxes.document(user_id), {
+                    'unread': firestore.Increment(1),
+                    'items': firestore.ArrayUnion([_header(ref.id, doc, created_at)]),
+                    'updated_at': firestore.SERVER_TIMESTAMP
+                }, merge=True)
+            batch.commit()
+            return True
+        except Exception as e:
+            print(f'Notification batch error (attempt {attempt}/{retries}, {len(refs)} docs):', e)
+            if attempt < retries:
+                time.sleep(0.5 * 2 ** (attempt - 1))
+    return False
+
+
+def notify_users(user_ids, payload):
+    """Write one notification per user id synchronously. Returns the number written."""
+    user_ids = list(dict.fromkeys(str(uid) for uid in user_ids if uid))
+    if not user_ids:
+        return 0
+    db = get_firestore()
+    notifications = db.collection('notifications')
+    retries = max(1, int(os.getenv('NOTIFY_RETRIES', '3')))
+    written = 0
+    for chunk in _chunks(user_ids, RECIPIENTS_PER_BATCH):
+        refs = [(uid, notifications.document()) for uid in chunk]
+        if _write_chunk(db, refs, payload, retries):
+            written += len(chunk)
+    return written
+
+
+def notify_teacher_students(teacher_id, payload):
+    """Notify every student connected to teacher_id. Returns the number written."""
+    db = get_firestore()
+    query = db.collection('users').where('teacher_id', '==', teacher_id).where('role', '==', 'student')
+    # Only the ids are needed
+    return notify_users([s.id for s in query.select([]).stream()], payload)
+
+
+def _run(func, *args):
+    try:
+        return func(*args)
+    except Exception as e:
+        print(f'Notification fan-out error ({func.__name__}):', e)
+        return 0
+
+
+def fan_out(user_ids, payload):
+    """Queue notify_users() on the background executor. Returns a Future."""
+    return _executor.submit(_run, notify_users, list(user_ids or []), dict(payload))
+
+
+def fan_out_to_students(teacher_id, payload):
+    """Queue notify_teacher_students() on the background executor. Returns a Future."""
+    return _executor.submit(_run, notify_teacher_students, teacher_id, dict(payload))
+
+
+# --- Inbox ------------------------------------------------------------------
+
+def _created_key(header):
+    created = header.get('created_at')
+    if isinstance(created, datetime):
+        return created.timestamp()
+    return 0
+
+
+def _latest(items):
+    """Newest-first, de-duplicated headers, capped at the inbox size."""
+    seen = set()
+    latest = []
+    for header in sorted((h for h in items or [] if isinstance(h, dict)), key=_created_key, reverse=True):
+        if header.get('id') in seen:
+            continue
+        seen.add(header.get('id'))
+        latest.append(header)
+    return latest[:inbox_size()]
+
+
+def rebuild_inbox(uid):
+    """Build inboxes/{uid} from the notifications collection. Returns the inbox dict."""
+    db = get_firestore()
+    notifications = db.collection('notifications').where('user_id', '==', uid)
+    recent = notifications.order_by('created_at', direction=firestore.Query.DESCENDING).limit(inbox_size())
+    items = [_header(doc.id, doc.to_dict() or {}, (doc.to_dict() or {}).get('created_at')) for doc in recent.stream()]
+    unread = sum(1 for _ in notifications.where('read', '==', False).select([]).stream())
+    inbox = {'unread': unread, 'items': items, 'indexed': True, 'updated_at': firestore.SERVER_TIMESTAMP}
+    db.collection('inboxes').document(uid).set(inbox)
+    return inbox
+
+
+def get_inbox(uid):
+    """Return {'unread': int, 'items': [headers newest first]} with one document read.
+    Inboxes that predate the summary (no 'indexed' flag) are rebuilt once.
+    """
+    db = get_firestore()
+    ref = db.collection('inboxes').document(uid)
+    snap = ref.get()
+    inbox = (snap.to_dict() or {}) if snap.exists else {}
+    if not inbox.get('indexed'):
+        inbox = rebuild_inbox(uid)
+    items = inbox.get('items') or []
+    latest = _latest(items)
+    if len(items) > len(latest):
+        try:
+            # Trim only the headers that fell off; a concurrent ArrayUnion is left intact
+            dropped = [h for h in items if h not in latest]
+            ref.update({'items': firestore.ArrayRemove(dropped)})
+        except Exception as e:
+            print('Inbox trim error:', e)
+    return {'unread': max(0, int(inbox.get('unread') or 0)), 'items': latest}
+
+
+def inbox_payload(inbox):
+    """JSON-ready { notifications: [...], unread } for an inbox, as served to the client."""
+    items = []
+    for d in _latest(inbox.get('items')):
+        created = d.get('created_at')
+        items.append({
+            'id': d.get('id'),
+            'type': d.get('type'),
+            'title': d.get('title'),
+            'resource_id': d.get('resource_id'),
+            'url': d.get('url'),
+            'message': d.get('message'),
+            'read': bool(d.get('read', False)),
+            'created_at': created.isoformat() if isinstance(created, datetime) else str(created or ''),
+        })
+    return {'notifications': items, 'unread': max(0, int(inbox.get('unread') or 0))}
+
+
+def mark_read(uid, notification_ids=None):
+    """Mark the given notifications (or all of the user's unread ones when None) read,
+    with batched writes, and update the inbox summary. Returns the number marked read.
+    """
+    db = get_firestore()
+    notifications = db.collection('notifications')
+    if notification_ids is None:
+        refs = [doc.reference for doc in notifications.where('user_id', '==', uid).where('read', '==', False).select([]).stream()]
+    else:
+        ids = list(dict.fromkeys(str(n) for n in notification_ids if n and '/' not in str(n)))
+        snaps = db.get_all([notifications.document(n) for n in ids], field_paths=['user_id', 'read'])
+        # Only the owner's unread notifications count towards the inbox
+        refs = [s.reference for s in snaps if s.exists and (s.to_dict() or {}).get('user_id') == uid and not (s.to_dict() or {}).get('read')]
+    marked = {ref.id for ref in refs}
+
+    for chunk in _chunks(refs, MAX_BATCH_WRITES):
+        batch = db.batch()
+        for ref in chunk:
+            batch.update(ref, {'read': True, 'updated_at': firestore.SERVER_TIMESTAMP})
+        batch.commit()
+
+    inbox_ref = db.collection('inboxes').document(uid)
+
+    def update_inbox(transaction):
+        snap = inbox_ref.get(transaction=transaction)
+        if not snap.exists:
+            return
+        inbox = snap.to_dict() or {}
+        items = []
+        for header in _latest(inbox.get('items')):
+            if notification_ids is None or header.get('id') in marked:
+                header = dict(header, read=True)
+            items.append(header)
+        unread = 0 if notification_ids is None else max(0, int(inbox.get('unread') or 0) - len(marked))
+        transaction.update(inbox_ref, {'unread': unread, 'items': items, 'updated_at': firestore.SERVER_TIMESTAMP})
+
+    if marked or notification_ids is None:
+        run_transaction(db, update_inbox)
+    return len(marked)
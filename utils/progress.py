@@ -0,0 +1,256 @@
+"""Module progress records: one parser and one serializer for every shape stored so far.
+
+A student's progress map ({module_id: entry}) lives on users/{uid} (under 'progress',
+older documents 'moduleProgress' or 'modules') and in session['user_progress']. Entries
+come as
+
+    {'pre_quiz_completed': True, 'post_quiz_completed': False, 'pre_quiz_score': 80, ...}
+    {'preQuizCompleted': True, 'percent': 40}        older clients (camelCase, percent)
+    {'progress': 40}                                  percent under another name
+    True                                              legacy: pre-quiz completed
+    40                                                legacy: percent
+
+parse_progress() turns any of them into ModuleProgress records and serialize_progress()
+writes the canonical snake_case dicts back (fields the model does not know are kept).
+pack_completion() / unpack_completion() reduce a map to its pre/post quiz flags as a short
+bitfield, for copies that travel in the session cookie.
+"""
+
+# Modules with a pre/post quiz pair
+MODULE_IDS = ('1', '2', '3', '5', '6', '7')
+# Highest module id + 1 kept in the completion bitfield
+MAX_PACKED_MODULE = 64
+# User document fields that may hold the progress map, in order of preference
+PROGRESS_FIELDS = ('progress', 'moduleProgress', 'modules')
+
+# ModuleProgress attribute -> stored keys. When an entry has several of them the
+# completion flags are OR-ed, percent takes the highest value and scores the first set.
+_ALIASES = (
+    ('pre_quiz_completed', ('pre_quiz_completed', 'preQuizCompleted')),
+    ('post_quiz_completed', ('post_quiz_completed', 'postQuizCompleted')),
+    ('pre_quiz_score', ('pre_quiz_score', 'preQuizScore')),
+    ('post_quiz_score', ('post_quiz_score', 'postQuizScore')),
+    ('percent', ('percent', 'progress')),
+    ('score', ('score',)),
+)
+_FLAGS = ('pre_quiz_completed', 'post_quiz_completed')
+_ALIAS_KEYS = frozenset(key for _attr, keys in _ALIASES for key in keys)
+
+
+def _number(value):
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _flag(value):
+    """Completion flag from a stored value: any truthy value except containers (partial
+    objects) and strings other than 'true'/'1'/'yes'.
+    """
+    if isinstance(value, str):
+        return value.strip().lower() in ('true', '1', 'yes')
+    if isinstance(value, (dict, list)):
+        return False
+    return bool(value)
+
+
+def _clamp_percent(value):
+    return max(0, min(100, round(value)))
+
+
+class ModuleProgress:
+    """Progress of one student in one module."""
+
+    __slots__ = ('pre_quiz_completed', 'post_quiz_completed', 'pre_quiz_score',
+                 'post_quiz_score', 'percent', 'score', 'extra')
+
+    def __init__(self, pre_quiz_completed=False, post_quiz_completed=False, pre_quiz_score=None,
+                 post_quiz_score=None, percent=None, score=None, extra=None):
+        self.pre_quiz_completed = pre_quiz_completed
+        self.post_quiz_completed = post_quiz_completed
+        self.pre_quiz_score = pre_quiz_score
+        self.post_quiz_score = post_quiz_score
+        self.percent = percent
+        self.score = score
+        self.extra = extra or {}  # other stored fields (last_attempt, ...), written back as-is
+
+    def update(self, fields):
+        """Apply a (partial) stored entry or client update on top of this record."""
+        if not isinstance(fields, dict):
+            return self
+        for attr, keys in _ALIASES:
+            present = [fields[key] for key in keys if key in fields]
+            if not present:
+                continue
+            if attr in _FLAGS:
+                setattr(self, attr, any(_flag(value) for value in present))
+                continue
+            numbers = [n for n in (_number(value) for value in present) if n is not None]
+            if attr == 'percent':
+                setattr(self, attr, max(numbers) if numbers else None)
+            else:
+                setattr(self, attr, numbers[0] if numbers else None)
+        for key, value in fields.items():
+            if key not in _ALIAS_KEYS:
+                self.extra[str(key)] = value
+        return self
+
+    @property
+    def pre_quiz_done(self):
+        """Pre-quiz taken: the flag, or a pre-quiz score stored by older code without it.
+        Only the module page accepts the score; the quiz gates check pre_quiz_completed.
+        """
+        return self.pre_quiz_completed or (self.pre_quiz_score is not None and self.pre_quiz_score > 0)
+
+    @property
+    def completed(self):
+        """Both quizzes done, or 100 percent reported."""
+        return (self.pre_quiz_completed and self.post_quiz_completed) or (self.percent or 0) >= 100
+
+    def percent_complete(self):
+        """0-100 shown on dashboards: post quiz 100, else percent, else score, else 50 after the pre quiz."""
+        if self.post_quiz_completed:
+            return 100
+        if self.percent is not None:
+            return _clamp_percent(self.percent)
+        if self.score is not None:
+            return _clamp_percent(self.score)
+        if self.pre_quiz_completed:
+            return 50
+        return 0
+
+    def to_dict(self):
+        data = dict(self.extra)
+        data['pre_quiz_completed'] = self.pre_quiz_completed
+        data['post_quiz_completed'] = self.post_quiz_completed
+        for attr in ('pre_quiz_score', 'post_quiz_score', 'percent', 'score'):
+            value = getattr(self, attr)
+            if value is not None:
+                data[attr] = value
+        return data
+
+
+def parse_module_progress(entry):
+    """ModuleProgress from one stored entry (dict, legacy bool or legacy percent)."""
+    if isinstance(entry, ModuleProgress):
+        return entry
+    if isinstance(entry, dict):
+        return ModuleProgress().update(entry)
+    if entry is True:
+        return ModuleProgress(pre_quiz_completed=True)
+    return ModuleProgress(percent=_number(entry))
+
+
+class StudentProgress:
+    """A student's progress map: module id (str) -> ModuleProgress."""
+
+    __slots__ = ('modules',)
+
+    def __init__(self, modules=None):
+        self.modules = modules if modules is not None else {}
+
+    def module(self, module_id):
+        """The module's record, added (empty) when missing."""
+        key = str(module_id)
+        entry = self.modules.get(key)
+        if entry is None:
+            entry = self.modules[key] = ModuleProgress()
+        return entry
+
+    def get(self, module_id):
+        """The module's record, or an empty one (not added)."""
+        return self.modules.get(str(module_id)) or ModuleProgress()
+
+    def merge(self, other):
+        """Replace entries with the ones in other (a StudentProgress or raw progress map)."""
+        if not isinstance(other, StudentProgress):
+            other = parse_progress(other)
+        self.modules.update(other.modules)
+        return self
+
+    def percents(self):
+        return {mid: entry.percent_complete() for mid, entry in self.modules.items()}
+
+    def overall(self):
+        values = [entry.percent_complete() for entry in self.modules.values()]
+        return round(sum(values) / len(values)) if values else 0
+
+    def to_dict(self, ensure_modules=()):
+        """Canonical progress map; ensure_modules get an entry even when never started."""
+        for mid in ensure_modules:
+            self.module(mid)
+        return {mid: entry.to_dict() for mid, entry in self.modules.items()}
+
+
+def parse_progress(progress):
+    """StudentProgress from a stored progress map (keys normalized to strings)."""
+    if isinstance(progress, StudentProgress):
+        return progress
+    if not isinstance(progress, dict):
+        return StudentProgress()
+    return StudentProgress({str(mid): parse_module_progress(entry) for mid, entry in progress.items()})
+
+
+def user_progress_map(data):
+    """The raw progress map stored on a user document."""
+    if not isinstance(data, dict):
+        return {}
+    for field in PROGRESS_FIELDS:
+        if data.get(field):
+            return data[field] if isinstance(data[field], dict) else {}
+    return {}
+
+
+def canonical_fields(fields):
+    """A partial update (client payload) with only the fields it has, under their canonical names."""
+    if not isinstance(fields, dict):
+        return {}
+    entry = ModuleProgress().update(fields)
+    data = dict(entry.extra)
+    for attr, keys in _ALIASES:
+        if any(key in fields for key in keys):
+            data[attr] = getattr(entry, attr)
+    return data
+
+
+def serialize_progress(progress, ensure_modules=()):
+    """Canonical dict form of a StudentProgress or raw progress map."""
+    return parse_progress(progress).to_dict(ensure_modules)
+
+
+def pack_completion(progress):
+    """Pre/post quiz flags of a progress map as a hex bitfield: bit 2 * id is the pre quiz
+    of module id, bit 2 * id + 1 its post quiz. Returns (bits, rest): rest maps modules
+    whose id is not a number below MAX_PACKED_MODULE to their flags. Scores, percents and other fields are dropped.
+    """
+    bits = 0
+    rest = {}
+    for mid, entry in parse_progress(progress).modules.items():
+        if mid.isdigit() and int(mid) < MAX_PACKED_MODULE:
+            bits |= (entry.pre_quiz_completed << (2 * int(mid))) | (entry.post_quiz_completed << (2 * int(mid) + 1))
+        else:
+            rest[mid] = [entry.pre_quiz_completed, entry.post_quiz_completed]
+    return format(bits, 'x'), rest
+
+
+def unpack_completion(bits, rest=None):
+    """StudentProgress back from pack_completion(); the canonical modules always get an entry."""
+    value = int(bits or '0', 16)
+    progress = StudentProgress()
+    for mid in MODULE_IDS:
+        progress.module(mid)
+    index = 0
+    while value >> index:
+        pre, post = bool(value >> index & 1), bool(value >> (index + 1) & 1)
+        if pre or post:
+            entry = progress.module(index // 2)
+            entry.pre_quiz_completed, entry.post_quiz_completed = pre, post
+        index += 2
+    for mid, (pre, post) in (rest or {}).items():
+        progress.modules[str(mid)] = ModuleProgress(pre_quiz_completed=bool(pre), post_quiz_completed=bool(post))
+    return progress
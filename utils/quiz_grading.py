@@ -0,0 +1,173 @@
+"""Server-side grading of module quizzes and compact per-question response records.
+
+Answers are the selected option index per question (the `a` list of the quiz payload).
+They are graded against the `correct` indexes of the quiz content get_quiz_data
+serves, and each attempt is stored as one `quiz_responses` document:
+
+    uid, teacher_id, module_id, quiz_type, version   who answered which quiz
+    answers: "021-"                                   one character per question: option index, '-' unanswered
+    correct, total, score                             graded result (score in percent)
+    attempt_id, attempted_at, submitted_at, source    idempotent offline replays
+
+`version` is a short hash of the answer key, so attempts graded against a different
+edition of a quiz are not mixed up in item analysis.
+"""
+import hashlib
+from datetime import datetime
+
+from firebase_admin import firestore
+
+from utils.firebase_service import get_firestore, get_user_record
+
+RESPONSES_COLLECTION = 'quiz_responses'
+MAX_BATCH_WRITES = 500
+MAX_ATTEMPTS_PER_REQUEST = 500
+UNANSWERED = '-'
+PASSING_SCORE = 70  # percent, as in the quiz payload
+
+
+class GradingError(ValueError):
+    """The attempt cannot be graded (unknown quiz or malformed answers)."""
+
+
+def answer_key(module_id, quiz_type):
+    """List of correct option indexes for a quiz, or None when it has no gradable content."""
+    from utils.quiz_handler import get_quiz_content
+    quiz = get_quiz_content(module_id, quiz_type)
+    questions = (quiz or {}).get('questions') or []
+    # The placeholder served for missing quizzes has no `correct` indexes
+    if not questions or any(not isinstance(q.get('correct'), int) for q in questions):
+        return None
+    return [q['correct'] for q in questions]
+
+
+def key_version(key):
+    return hashlib.sha1(','.join(map(str, key)).encode()).hexdigest()[:8]
+
+
+def normalize_answers(answers, total):
+    """Selected option per question as a list of int/None.
+    Accepts a list, or the {question index: option index} object the quiz page keeps.
+    """
+    if isinstance(answers, dict):
+        selected = [None] * total
+        for index, option in answers.items():
+            try:
+                index = int(index)
+            except (TypeError, ValueError):
+                raise GradingError(f'Invalid question index: {index!r}')
+            if 0 <= index < total:
+                selected[index] = option
+    elif isinstance(answers, (list, tuple)):
+        if len(answers) > total:
+            raise GradingError(f'{len(answers)} answers for {total} questions')
+        selected = list(answers) + [None] * (total - len(answers))
+    else:
+        raise GradingError('answers must be a list or an object')
+    normalized = []
+    for option in selected:
+        if option is None or option == '' or option == -1:
+            normalized.append(None)
+            continue
+        try:
+            option = int(option)
+        except (TypeError, ValueError):
+            raise GradingError(f'Invalid option: {option!r}')
+        if not 0 <= option <= 9:
+            raise GradingError(f'Option out of range: {option}')
+        normalized.append(option)
+    return normalized
+
+
+def encode_answers(selected):
+    return ''.join(UNANSWERED if option is None else str(option) for option in selected)
+
+
+def decode_answers(encoded):
+    return [None if ch == UNANSWERED else int(ch) for ch in encoded or '']
+
+
+def grade(key, answers):
+    """Grade answers against key. Returns { answers, correct, total, score }."""
+    selected = normalize_answers(answers, len(key))
+    correct = sum(1 for option, right in zip(selected, key) if option == right)
+    return {
+        'answers': encode_answers(selected),
+        'correct': correct,
+        'total': len(key),
+        'score': round(100.0 * correct / len(key), 2)
+    }
+
+
+def _attempted_at(value):
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        raise GradingError(f'Invalid attempted_at: {value!r}')
+
+
+def grade_attempts(attempts, uid=None, source='web'):
+    """Grade a list of attempts {module_id, quiz_type, answers, attempt_id?, attempted_at?}
+    and, for a signed-in user, store their response records in batched writes.
+    Returns one result per attempt: the grade, or { error } for attempts that failed.
+    """
+    from utils.quiz_handler import convert_to_numeric_id
+    keys = {}
+    results = []
+    records = []
+    for attempt in attempts:
+        try:
+            if not isinstance(attempt, dict):
+                raise GradingError('attempt must be an object')
+            module_id = convert_to_numeric_id(str(attempt.get('module_id', '')))
+            quiz_type = attempt.get('quiz_type')
+            if not module_id or quiz_type not in ('pre', 'post'):
+                raise GradingError('module_id and quiz_type (pre/post) are required')
+            if (module_id, quiz_type) not in keys:
+                keys[(module_id, quiz_type)] = answer_key(module_id, quiz_type)
+            key = keys[(module_id, quiz_type)]
+            if key is None:
+                raise GradingError(f'No gradable quiz for module {module_id} ({quiz_type})')
+            result = grade(key, attempt.get('answers'))
+            result.update(module_id=module_id, quiz_type=quiz_type, passed=result['score'] >= PASSING_SCORE)
+            records.append(dict(result, version=key_version(key),
+                                attempt_id=str(attempt['attempt_id'])[:64] if attempt.get('attempt_id') else None,
+                                attempted_at=_attempted_at(attempt.get('attempted_at'))))
+            results.append(result)
+        except GradingError as e:
+            results.append({'error': str(e)})
+    if uid and records:
+        record_responses(uid, records, source)
+    return results
+
+
+def record_responses(uid, records, source='web'):
+    """Write graded attempts to quiz_responses, 500 per batch. Attempts carrying an
+    attempt_id get a deterministic document id, so replaying them does not duplicate.
+    """
+    db = get_firestore()
+    user = get_user_record(uid) or {}
+    collection = db.collection(RESPONSES_COLLECTION)
+    for start in range(0, len(records), MAX_BATCH_WRITES):
+        batch = db.batch()
+        for record in records[start:start + MAX_BATCH_WRITES]:
+            attempt_id = record.get('attempt_id')
+            ref = collection.document(f"{uid}_{attempt_id}".replace('/', '_')) if attempt_id else collection.document()
+            batch.set(ref, {
+                'uid': uid,
+                'teacher_id': user.get('teacher_id'),
+                'module_id': record['module_id'],
+                'quiz_type': record['quiz_type'],
+                'version': record['version'],
+                'answers': record['answers'],
+                'correct': record['correct'],
+                'total': record['total'],
+                'score': record['score'],
+                'attempt_id': attempt_id,
+                'attempted_at': record.get('attempted_at') or firestore.SERVER_TIMESTAMP,
+                'submitted_at': firestore.SERVER_TIMESTAMP,
+                'source': source
+            })
+        batch.commit()
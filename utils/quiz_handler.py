@@ -1,5 +1,24 @@
-from firebase_admin import credentials, firestore
+from firebase_admin import credentials
 import firebase_admin
+import copy
+import os
+import threading
+from utils.cache import TTLCache
+from utils.firebase_service import get_firestore, use_memory_backend
+from utils.quiz_store import delete_quizzes, load_quiz, read_quiz, save_quiz, quiz_from_firestore, use_local_quiz_store
+from utils.content_snapshot import snapshot_connection
+
+# Formatted quiz payloads keyed by (module_id, quiz_type). Quiz content changes rarely,
+# so a class starting the same quiz is served from memory after the first load.
+_quiz_cache = TTLCache(
+    maxsize=int(os.getenv('QUIZ_CACHE_SIZE', '64')),
+    ttl=float(os.getenv('QUIZ_CACHE_TTL', '600'))
+)
+# Placeholder quizzes (nothing in Firestore yet) are cached briefly so new content shows up soon
+MISSING_QUIZ_TTL = 60
+_inflight = {}  # cache key -> _Flight of the load in progress
+_inflight_lock = threading.Lock()
+_generation = [0]  # bumped by invalidate_quiz_cache so in-flight loads do not store stale data
 
 def get_firebase_to_numeric_map():
     """Centralized Firebase ID to numeric ID mapping"""
@@ -27,11 +46,73 @@ def convert_to_numeric_id(module_id):
         firebase_map = get_firebase_to_numeric_map()
         return firebase_map.get(module_id)
 
+class _Flight:
+    """A quiz load other requests for the same key wait on instead of querying too."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+def _cache_key(module_id, quiz_type):
+    # Firebase lesson ids and numeric module ids share one entry
+    return (str(convert_to_numeric_id(str(module_id)) or module_id), str(quiz_type))
+
+def _load_once(key, load):
+    """Run load() for key unless another thread already is; then share its result."""
+    with _inflight_lock:
+        flight = _inflight.get(key)
+        leader = flight is None
+        if leader:
+            flight = _inflight[key] = _Flight()
+    if not leader:
+        flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+    try:
+        flight.result = load()
+        return flight.result
+    except Exception as e:
+        flight.error = e
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+        flight.done.set()
+
+def invalidate_quiz_cache(module_id=None, quiz_type=None):
+    """Drop cached quizzes: one (module, type), every type of a module, or everything.
+    The matching rows of the local quiz store go too, so the next read resyncs them from Firestore.
+    """
+    with _inflight_lock:
+        _generation[0] += 1
+    try:
+        if module_id is None:
+            delete_quizzes()
+        elif convert_to_numeric_id(str(module_id)):
+            delete_quizzes(convert_to_numeric_id(str(module_id)), quiz_type)
+    except Exception as e:
+        print(f"Could not drop quizzes from the local store: {e}")
+    if module_id is None:
+        _quiz_cache.clear()
+    elif quiz_type is not None:
+        _quiz_cache.invalidate(_cache_key(module_id, quiz_type))
+    else:
+        for qtype in ('pre', 'post'):
+            _quiz_cache.invalidate(_cache_key(module_id, qtype))
+
+def quiz_cache_stats():
+    """Return hit/miss counters of the quiz cache."""
+    return _quiz_cache.stats()
+
 def get_quiz_data(module_id, quiz_type):
-    """Retrieve quiz data from Firebase"""
+    """Retrieve quiz data, from the process cache when possible.
+    The returned dict is a copy and may be modified by the caller.
+    """
     try:
         # Initialize Firebase Admin if not already initialized
-        if not firebase_admin._apps:
+        if not firebase_admin._apps and not use_memory_backend():
             try:
                 cred = credentials.Certificate('menstrual-hygiene-manage-6b0ed-firebase-adminsdk-fbsvc-a3f11dc47f.json')
                 firebase_admin.initialize_app(cred)
@@ -47,120 +128,170 @@ def get_quiz_data(module_id, quiz_type):
                 print(f"User has already completed pre-quiz for module {module_id}")
                 return None
 
-        db = firestore.client()
-        
-        # Query Firebase for quiz data using filter
-        # Convert module_id to Firebase ID
-        numeric_to_firebase = get_numeric_to_firebase_map()
+        # The shared snapshot needs no per-process copy; everything else goes through the cache
+        quiz_data = _snapshot_quiz(module_id, quiz_type)
+        if quiz_data is not None:
+            return quiz_data
+        return copy.deepcopy(_cached_quiz(module_id, quiz_type))
+
+    except Exception as e:
+        print(f"Error fetching quiz data: {e}")
+        return None
+
+def _snapshot_quiz(module_id, quiz_type):
+    """Formatted quiz from the published content snapshot, or None."""
+    conn = snapshot_connection()
+    numeric_id = convert_to_numeric_id(str(module_id))
+    if conn is None or not numeric_id:
+        return None
+    try:
+        stored = read_quiz(conn, numeric_id, quiz_type)
+    except Exception as e:
+        print(f"Content snapshot read failed: {e}")
+        return None
+    return format_quiz(module_id, *stored) if stored else None
+
+def _cached_quiz(module_id, quiz_type):
+    """Shared (read-only) formatted quiz for (module, type), loading it on a miss."""
+    key = _cache_key(module_id, quiz_type)
+    quiz_data = _quiz_cache.get(key)
+    if quiz_data is None:
+        def load():
+            # A concurrent leader may have filled the cache while this thread waited
+            cached = _quiz_cache.peek(key)
+            if cached is not None:
+                return cached
+            generation = _generation[0]
+            loaded, found = _fetch_quiz_data(module_id, quiz_type)
+            if generation == _generation[0]:
+                _quiz_cache.set(key, loaded, ttl=None if found else MISSING_QUIZ_TTL)
+            return loaded
+        quiz_data = _load_once(key, load)
+    return quiz_data
+
+def get_quiz_content(module_id, quiz_type):
+    """Shared quiz payload without per-user checks (grading, analysis). Do not modify it."""
+    return _snapshot_quiz(module_id, quiz_type) or _cached_quiz(module_id, quiz_type)
+
+def preload_quiz(module_id, quiz_type):
+    """Load a quiz into the cache outside a request (no session checks). Raises on errors."""
+    return _cached_quiz(module_id, quiz_type) is not None
+
+def _fetch_quiz_data(module_id, quiz_type):
+    """Load and format the quiz for the template.
+    Returns (quiz_data, found); found is False for the placeholder quiz.
+    The local SQLite store is read first; Firestore is only queried on a miss.
+    """
+    numeric_id = convert_to_numeric_id(str(module_id))
+    if numeric_id and use_local_quiz_store():
         try:
-            firebase_id = numeric_to_firebase.get(int(module_id))
-            if not firebase_id:
-                print(f"No Firebase ID mapping found for module {module_id}")
-                firebase_id = str(module_id)
-        except ValueError:
-            print(f"Invalid module_id format: {module_id}")
+            stored = load_quiz(numeric_id, quiz_type)
+            if stored:
+                return format_quiz(module_id, *stored), True
+        except Exception as e:
+            print(f"Local quiz store unavailable, using Firestore: {e}")
+
+    db = get_firestore()
+    
+    # Query Firebase for quiz data using filter
+    # Convert module_id to Firebase ID
+    numeric_to_firebase = get_numeric_to_firebase_map()
+    try:
+        firebase_id = numeric_to_firebase.get(int(module_id))
+        if not firebase_id:
+            print(f"No Firebase ID mapping found for module {module_id}")
             firebase_id = str(module_id)
+    except ValueError:
+        print(f"Invalid module_id format: {module_id}")
+        firebase_id = str(module_id)
 
-        print(f"Querying with lesson_id: {firebase_id}, type: {quiz_type}")
-        quiz_ref = db.collection('quizzes')
-        query = quiz_ref.where('lesson_id', '==', firebase_id).where('type', '==', quiz_type)
-        quiz_docs = query.stream()  # Use stream() instead of get() for better handling
-        
-        # Convert to list for checking length
-        quiz_docs_list = list(quiz_docs)
-        if not quiz_docs_list:
-            print(f"No quiz found for module {module_id} (Firebase ID: {firebase_id}) and type {quiz_type}")
-            # Return a default quiz structure for testing
-            return {
-                'title': f'Quiz for Module {module_id}',
-                'questions': [
-                    {
-                        'question': 'What is puberty?',
-                        'options': {
-                            'A': 'A period of growth and Development',
-                            'B': 'A roblox game',
-                            'C': 'A holiday',
-                            'D': 'A food'
-                        },
-                        'correct_answer': 'A'
+    print(f"Querying with lesson_id: {firebase_id}, type: {quiz_type}")
+    quiz_ref = db.collection('quizzes')
+    query = quiz_ref.where('lesson_id', '==', firebase_id).where('type', '==', quiz_type)
+    quiz_docs = query.stream()  # Use stream() instead of get() for better handling
+    
+    # Convert to list for checking length
+    quiz_docs_list = list(quiz_docs)
+    if not quiz_docs_list:
+        print(f"No quiz found for module {module_id} (Firebase ID: {firebase_id}) and type {quiz_type}")
+        # Return a default quiz structure for testing
+        return {
+            'title': f'Quiz for Module {module_id}',
+            'questions': [
+                {
+                    'question': 'What is puberty?',
+                    'options': {
+                        'A': 'A period of growth and Development',
+                        'B': 'A roblox game',
+                        'C': 'A holiday',
+                        'D': 'A food'
                     },
-                    {
-                        'question': 'What changes happen during puberty?',
-                        'options': {
-                            'A': 'Hair turns blue',
-                            'B': 'Body grows and develops',
-                            'C': 'Nothing changes',
-                            'D': 'Skin turns purple'
-                        },
-                        'correct_answer': 'B'
+                    'correct_answer': 'A'
+                },
+                {
+                    'question': 'What changes happen during puberty?',
+                    'options': {
+                        'A': 'Hair turns blue',
+                        'B': 'Body grows and develops',
+                        'C': 'Nothing changes',
+                        'D': 'Skin turns purple'
                     },
-                    {
-                        'question': 'When should you talk about puberty?',
-                        'options': {
-                            'A': 'Never',
-                            'B': 'Only with friends',
-                            'C': 'With trusted adults and healthcare providers',
-                            'D': 'On social media'
-                        },
-                        'correct_answer': 'C'
-                    }
-                ],
-                'type': quiz_type,
-                'lesson_id': str(module_id)
+                    'correct_answer': 'B'
+                },
+                {
+                    'question': 'When should you talk about puberty?',
+                    'options': {
+                        'A': 'Never',
+                        'B': 'Only with friends',
+                        'C': 'With trusted adults and healthcare providers',
+                        'D': 'On social media'
+                    },
+                    'correct_answer': 'C'
+                }
+            ],
+            'type': quiz_type,
+            'lesson_id': str(module_id)
+        }, False
+
+    # Get the quiz document from list
+    quiz_doc = quiz_docs_list[0].to_dict()
+    print(f"Found quiz {quiz_docs_list[0].id} for module {module_id}, type {quiz_type}")
+    title, questions = quiz_from_firestore(quiz_doc)
+    if numeric_id and use_local_quiz_store():
+        # Write through so the next load (also after a restart) stays local
+        try:
+            save_quiz(numeric_id, quiz_type, title or f'Quiz for Module {module_id}', questions,
+                      quiz_docs_list[0].id)
+        except Exception as e:
+            print(f"Could not store quiz locally: {e}")
+    return format_quiz(module_id, title, questions), True
+
+def format_quiz(module_id, title, questions):
+    """Build the template payload from (title, questions) as returned by utils.quiz_store."""
+    quiz_data = {
+        'title': title or f'Quiz for Module {module_id}',
+        'questions': []
+    }
+    for question in questions:
+        correct_letter = chr(ord('A') + question['correct'])
+        quiz_data['questions'].append({
+            'q': question['text'] or '',
+            'a': question['options'],
+            'correct': question['correct'],
+            'feedback': question.get('feedback') or {
+                'correct': 'Great job! That\'s correct!',
+                'incorrect': f'The correct answer was {correct_letter}. Keep learning!'
             }
+        })
 
-        # Get the quiz document from list
-        quiz_doc = quiz_docs_list[0].to_dict()
-        print(f"Found quiz document: {quiz_doc}")
-        
-        # Format quiz data for template
-        quiz_data = {
-            'title': quiz_doc.get('title', f'Quiz for Module {module_id}'),
-            'questions': []
-        }
-
-        # Process questions based on the new structure
-        for question in quiz_doc.get('questions', []):
-            options = question.get('options', {})
-            # Convert options map to list preserving order A, B, C, D
-            options_list = [
-                options.get('A', ''),
-                options.get('B', ''),
-                options.get('C', ''),
-                options.get('D', '')
-            ]
-            
-            # Get the correct answer from the document
-            correct_letter = question.get('correct_answer')
-            if not correct_letter:
-                print(f"Warning: No correct answer found for question: {question.get('question')}")
-                correct_letter = 'A'  # Fallback only if no answer is found
-            
-            # Convert letter answer (A, B, C, D) to numeric index (0, 1, 2, 3)
-            correct_index = ord(correct_letter) - ord('A')
-            
-            quiz_data['questions'].append({
-                'q': question.get('question', ''),
-                'a': options_list,
-                'correct': correct_index,
-                'feedback': question.get('feedback', {
-                    'correct': 'Great job! That\'s correct!',
-                    'incorrect': f'The correct answer was {correct_letter}. Keep learning!'
-                })
-            })
-
-        # Add scoring information
-        quiz_data['totalQuestions'] = len(quiz_data['questions'])
-        quiz_data['passingScore'] = 70  # 70% to pass
-        quiz_data['feedbackMessages'] = {
-            'excellent': 'Outstanding! You\'ve mastered this topic! 🌟',
-            'good': 'Well done! You\'re doing great! 👏',
-            'pass': 'Good job! You\'ve passed the quiz! 👍',
-            'fail': 'Keep trying! You\'ll do better next time! 💪'
-        }
-
-        return quiz_data
+    # Add scoring information
+    quiz_data['totalQuestions'] = len(quiz_data['questions'])
+    quiz_data['passingScore'] = 70  # 70% to pass
+    quiz_data['feedbackMessages'] = {
+        'excellent': 'Outstanding! You\'ve mastered this topic! 🌟',
+        'good': 'Well done! You\'re doing great! 👏',
+        'pass': 'Good job! You\'ve passed the quiz! 👍',
+        'fail': 'Keep trying! You\'ll do better next time! 💪'
+    }
 
-    except Exception as e:
-        print(f"Error fetching quiz data: {e}")
-        return None
\ No newline at end of file
+    return quiz_data
@@ -0,0 +1,263 @@
+"""Local SQLite copy of the Firestore quiz content (quizzes, questions and answer_options
+tables, the same layout quiz_data_inserter.py uses in quiz_database.db).
+
+The store is its own runtime file (quiz_store.db, not under version control) and is only
+used once scripts/sync_quiz_store.py has compiled the Firestore `quizzes` collection into
+it, which leaves a sync marker in store_meta. From then on get_quiz_data reads quizzes
+from here with one joined query and only queries Firestore on a miss, writing what it
+finds back, so quiz pages need no network calls at all.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+QUIZ_DB = os.getenv('QUIZ_DB_PATH', 'quiz_store.db')
+
+_schema_lock = threading.Lock()
+_schema_ready = set()  # database paths already migrated in this process
+_synced = set()        # database paths seen with a sync marker
+
+
+def use_local_quiz_store(path=None):
+    """Whether quizzes are read from the local store. QUIZ_LOCAL_STORE=0 / 1 forces it off
+    or on; by default (auto) it is on once the store has been synced from Firestore.
+    """
+    setting = os.getenv('QUIZ_LOCAL_STORE', 'auto').strip().lower()
+    if setting in ('0', 'false', 'no'):
+        return False
+    if setting in ('1', 'true', 'yes'):
+        return True
+    return is_synced(path)
+
+
+def is_synced(path=None):
+    """True when sync_from_firestore has completed into the store at path."""
+    path = path or QUIZ_DB
+    if path in _synced:
+        return True
+    if not os.path.exists(path):
+        return False
+    conn = sqlite3.connect(path, timeout=10)
+    try:
+        row = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'store_meta'").fetchone()
+        synced = bool(row) and conn.execute(
+            "SELECT 1 FROM store_meta WHERE key = 'synced_at'").fetchone() is not None
+    except sqlite3.Error:
+        synced = False
+    finally:
+        conn.close()
+    if synced:
+        _synced.add(path)
+    return synced
+
+
+def _connect(path=None):
+    path = path or QUIZ_DB
+    conn = sqlite3.connect(path, timeout=10)
+    if path not in _schema_ready:
+        with _schema_lock:
+            if path not in _schema_ready:
+                ensure_schema(conn)
+                _schema_ready.add(path)
+    return conn
+
+
+def ensure_schema(conn):
+    """Create the quiz tables if needed and add the columns the sync relies on."""
+    conn.executescript('''
+        CREATE TABLE IF NOT EXISTS quizzes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            module_id INTEGER NOT NULL,
+            quiz_type TEXT NOT NULL,
+            title TEXT NOT NULL,
+            UNIQUE(module_id, quiz_type)
+        );
+        CREATE TABLE IF NOT EXISTS questions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            quiz_id INTEGER NOT NULL,
+            question_text TEXT NOT NULL,
+            correct_answer INTEGER NOT NULL,
+            question_order INTEGER NOT NULL,
+            FOREIGN KEY (quiz_id) REFERENCES quizzes (id)
+        );
+        CREATE TABLE IF NOT EXISTS answer_options (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            question_id INTEGER NOT NULL,
+            option_text TEXT NOT NULL,
+            option_order INTEGER NOT NULL,
+            FOREIGN KEY (question_id) REFERENCES questions (id)
+        );
+        CREATE INDEX IF NOT EXISTS idx_questions_quiz ON questions (quiz_id, question_order);
+        CREATE INDEX IF NOT EXISTS idx_answer_options_question ON answer_options (question_id, option_order);
+        CREATE TABLE IF NOT EXISTS store_meta (key TEXT PRIMARY KEY, value TEXT);
+    ''')
+    columns = {
+        'quizzes': {row[1] for row in conn.execute('PRAGMA table_info(quizzes)')},
+        'questions': {row[1] for row in conn.execute('PRAGMA table_info(questions)')}
+    }
+    if 'firebase_id' not in columns['quizzes']:
+        conn.execute('ALTER TABLE quizzes ADD COLUMN firebase_id TEXT')
+    if 'feedback' not in columns['questions']:
+        # JSON {correct, incorrect}; NULL means the default messages
+        conn.execute('ALTER TABLE questions ADD COLUMN feedback TEXT')
+    conn.commit()
+
+
+def load_quiz(module_id, quiz_type, path=None):
+    """Return (title, questions) for a quiz, or None when it is not stored.
+    questions is a list of {text, options, correct, feedback} in display order.
+    """
+    conn = _connect(path)
+    try:
+        return read_quiz(conn, module_id, quiz_type)
+    finally:
+        conn.close()
+
+
+def read_quiz(conn, module_id, quiz_type):
+    """load_quiz on an open connection (also used on the read-only content snapshot)."""
+    rows = conn.execute('''
+        SELECT q.title, qs.id, qs.question_text, qs.correct_answer, qs.feedback, ao.option_text
+        FROM quizzes q
+        LEFT JOIN questions qs ON qs.quiz_id = q.id
+        LEFT JOIN answer_options ao ON ao.question_id = qs.id
+        WHERE q.module_id = ? AND q.quiz_type = ?
+        ORDER BY qs.question_order, qs.id, ao.option_order, ao.id
+    ''', (module_id, quiz_type)).fetchall()
+    if not rows:
+        return None
+    questions = []
+    current_id = None
+    for title, question_id, text, correct, feedback, option in rows:
+        if question_id is None:
+            continue
+        if question_id != current_id:
+            current_id = question_id
+            questions.append({
+                'text': text,
+                'options': [],
+                'correct': correct,
+                'feedback': json.loads(feedback) if feedback else None
+            })
+        if option is not None:
+            questions[-1]['options'].append(option)
+    return rows[0][0], questions
+
+
+def _delete_quiz_rows(conn, quiz_id):
+    conn.execute('DELETE FROM answer_options WHERE question_id IN (SELECT id FROM questions WHERE quiz_id = ?)',
+                 (quiz_id,))
+    conn.execute('DELETE FROM questions WHERE quiz_id = ?', (quiz_id,))
+    conn.execute('DELETE FROM quizzes WHERE id = ?', (quiz_id,))
+
+
+def _replace_quiz(conn, module_id, quiz_type, title, questions, firebase_id=None):
+    old = conn.execute('SELECT id FROM quizzes WHERE module_id = ? AND quiz_type = ?',
+                       (module_id, quiz_type)).fetchone()
+    if old:
+        _delete_quiz_rows(conn, old[0])
+    quiz_id = conn.execute('INSERT INTO quizzes (module_id, quiz_type, title, firebase_id) VALUES (?, ?, ?, ?)',
+                           (module_id, quiz_type, title, firebase_id)).lastrowid
+    for order, question in enumerate(questions):
+        feedback = question.get('feedback')
+        question_id = conn.execute('''
+            INSERT INTO questions (quiz_id, question_text, correct_answer, question_order, feedback)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (quiz_id, question['text'], question['correct'], order,
+              json.dumps(feedback) if feedback else None)).lastrowid
+        conn.executemany('INSERT INTO answer_options (question_id, option_text, option_order) VALUES (?, ?, ?)',
+                         [(question_id, option, i) for i, option in enumerate(question['options'])])
+
+
+def save_quiz(module_id, quiz_type, title, questions, firebase_id=None, path=None):
+    """Replace the stored quiz for (module, type) in one transaction."""
+    conn = _connect(path)
+    try:
+        with conn:
+            _replace_quiz(conn, module_id, quiz_type, title, questions, firebase_id)
+    finally:
+        conn.close()
+
+
+def delete_quizzes(module_id=None, quiz_type=None, path=None):
+    """Drop stored quizzes (one, every type of a module, or all) so the next read fetches
+    them from Firestore again. Returns the number removed; no-op on a store never created.
+    """
+    path = path or QUIZ_DB
+    if not os.path.exists(path):
+        return 0
+    query, params = 'SELECT id FROM quizzes', []
+    if module_id is not None:
+        query += ' WHERE module_id = ?'
+        params.append(module_id)
+        if quiz_type is not None:
+            query += ' AND quiz_type = ?'
+            params.append(quiz_type)
+    conn = _connect(path)
+    try:
+        with conn:
+            quiz_ids = [row[0] for row in conn.execute(query, params).fetchall()]
+            for quiz_id in quiz_ids:
+                _delete_quiz_rows(conn, quiz_id)
+    finally:
+        conn.close()
+    return len(quiz_ids)
+
+
+def quiz_from_firestore(quiz_doc):
+    """Convert a Firestore quiz document to (title, questions) as stored here."""
+    questions = []
+    for question in quiz_doc.get('questions', []):
+        options = question.get('options', {})
+        # Options map A-D becomes an ordered list
+        options_list = [options.get(letter, '') for letter in ('A', 'B', 'C', 'D')]
+        correct_letter = question.get('correct_answer')
+        if not correct_letter:
+            print(f"Warning: No correct answer found for question: {question.get('question')}")
+            correct_letter = 'A'  # Fallback only if no answer is found
+        questions.append({
+            'text': question.get('question', ''),
+            'options': options_list,
+            'correct': ord(correct_letter) - ord('A'),
+            'feedback': question.get('feedback')
+        })
+    return quiz_doc.get('title'), questions
+
+
+def sync_from_firestore(db, path=None, prune=False):
+    """Compile the Firestore quizzes collection into the local store.
+    prune also deletes stored quizzes that are not in Firestore.
+    Returns { synced, skipped, pruned }.
+    """
+    from utils.quiz_handler import convert_to_numeric_id
+    synced = set()
+    skipped = 0
+    conn = _connect(path)
+    try:
+        with conn:
+            for doc in db.collection('quizzes').stream():
+                data = doc.to_dict() or {}
+                module_id = convert_to_numeric_id(str(data.get('lesson_id', '')))
+                quiz_type = data.get('type')
+                if not module_id or quiz_type not in ('pre', 'post') or (module_id, quiz_type) in synced:
+                    # Duplicates: the first document wins, like the Firestore query in get_quiz_data
+                    skipped += 1
+                    continue
+                title, questions = quiz_from_firestore(data)
+                _replace_quiz(conn, module_id, quiz_type, title or f'Quiz for Module {module_id}',
+                              questions, doc.id)
+                synced.add((module_id, quiz_type))
+            pruned = 0
+            if prune:
+                for quiz_id, module_id, quiz_type in conn.execute(
+                        'SELECT id, module_id, quiz_type FROM quizzes').fetchall():
+                    if (module_id, quiz_type) not in synced:
+                        _delete_quiz_rows(conn, quiz_id)
+                        pruned += 1
+            conn.execute("INSERT OR REPLACE INTO store_meta (key, value) VALUES ('synced_at', ?)",
+                         (str(time.time()),))
+    finally:
+        conn.close()
+    return {'synced': len(synced), 'skipped': skipped, 'pruned': pruned}
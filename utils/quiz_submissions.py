@@ -0,0 +1,135 @@
+"""Quiz submissions stored in activities/{quiz_id}/submissions with running aggregates.
+
+Every submission is written in the same batch as an update to the 'stats' block of the
+quiz document (count, passed, score_sum, latest_submitted_at), so the aggregates can
+never drift from the subcollection and quiz statistics need a single document read.
+Quizzes from before the aggregates (no stats block, or submissions still embedded in the
+document) are rebuilt from their submissions before the first increment.
+"""
+from firebase_admin import firestore
+from utils.firebase_service import get_firestore, run_transaction
+
+DEFAULT_PASSING_SCORE = 70
+
+
+def _passing_score(quiz_data):
+    try:
+        return float(quiz_data.get('passingScore', DEFAULT_PASSING_SCORE))
+    except (TypeError, ValueError):
+        return float(DEFAULT_PASSING_SCORE)
+
+
+def _score(submission):
+    try:
+        return float(submission.get('score') or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _needs_rebuild(quiz_data):
+    """True when the stats block is missing or legacy embedded submissions are not folded in."""
+    stats = quiz_data.get('stats')
+    return not isinstance(stats, dict) or 'count' not in stats or isinstance(quiz_data.get('submissions'), list)
+
+
+def record_submission(quiz_id, submission):
+    """Store a submission and bump the quiz aggregates atomically.
+    Returns the new submission id, or None when the quiz does not exist.
+    """
+    db = get_firestore()
+    quiz_ref = db.collection('activities').document(quiz_id)
+    quiz = quiz_ref.get()
+    if not quiz.exists:
+        return None
+    quiz_data = quiz.to_dict() or {}
+    if _needs_rebuild(quiz_data):
+        # Count the earlier submissions first, or the increment below would start from zero
+        rebuild_quiz_stats(quiz_id)
+    score = _score(submission)
+    passed = score >= _passing_score(quiz_data)
+
+    submission = dict(submission, score=score, submittedAt=firestore.SERVER_TIMESTAMP)
+    submission.setdefault('status', 'submitted')
+    sub_ref = quiz_ref.collection('submissions').document()
+    batch = db.batch()
+    batch.set(sub_ref, submission)
+    batch.update(quiz_ref, {
+        'stats.count': firestore.Increment(1),
+        'stats.passed': firestore.Increment(1 if passed else 0),
+        'stats.score_sum': firestore.Increment(score),
+        'stats.latest_submitted_at': firestore.SERVER_TIMESTAMP
+    })
+    batch.commit()
+    return sub_ref.id
+
+
+def rebuild_quiz_stats(quiz_id):
+    """Recompute the stats block of activities/{quiz_id} from its submissions subcollection.
+    Submissions still embedded in the legacy 'submissions' array are copied into the
+    subcollection first, as legacy-<index> documents so a repeated or concurrent run
+    rewrites the same documents instead of duplicating them. The stats are only written if
+    the quiz still needs them (a concurrent run or submission may have got there first),
+    checked in a transaction. Returns the stats dict, or None when the quiz does not exist.
+    """
+    db = get_firestore()
+    quiz_ref = db.collection('activities').document(quiz_id)
+    quiz = quiz_ref.get()
+    if not quiz.exists:
+        return None
+    quiz_data = quiz.to_dict() or {}
+    passing = _passing_score(quiz_data)
+
+    legacy = quiz_data.get('submissions')
+    if isinstance(legacy, list) and legacy:
+        # Firestore batches are capped at 500 writes; keep one slot for the quiz update
+        for start in range(0, len(legacy), 499):
+            batch = db.batch()
+            for index, sub in enumerate(legacy[start:start + 499], start):
+                if isinstance(sub, dict):
+                    batch.set(quiz_ref.collection('submissions').document(f'legacy-{index}'), sub)
+            batch.commit()
+    stats = {'count': 0, 'passed': 0, 'score_sum': 0.0, 'latest_submitted_at': None}
+    for doc in quiz_ref.collection('submissions').select(['score', 'submittedAt']).stream():
+        sub = doc.to_dict() or {}
+        score = _score(sub)
+        stats['count'] += 1
+        stats['passed'] += 1 if score >= passing else 0
+        stats['score_sum'] += score
+        submitted_at = sub.get('submittedAt')
+        try:
+            if submitted_at is not None and (stats['latest_submitted_at'] is None or submitted_at > stats['latest_submitted_at']):
+                stats['latest_submitted_at'] = submitted_at
+        except TypeError:
+            # Mixed legacy types (string vs timestamp): keep the first one seen
+            pass
+
+    def apply(transaction):
+        current = quiz_ref.get(transaction=transaction)
+        if not current.exists:
+            return None
+        current_data = current.to_dict() or {}
+        if not _needs_rebuild(current_data):
+            return current_data['stats']
+        updates = {'stats': stats}
+        if isinstance(current_data.get('submissions'), list):
+            updates['submissions'] = firestore.DELETE_FIELD
+        transaction.update(quiz_ref, updates)
+        return stats
+
+    return run_transaction(db, apply)
+
+
+def quiz_stats(quiz_data):
+    """Return the public statistics for a quiz document's stats block, or None if it is
+    missing or stale (rebuild_quiz_stats first).
+    """
+    if not isinstance(quiz_data, dict) or _needs_rebuild(quiz_data):
+        return None
+    stats = quiz_data['stats']
+    count = int(stats.get('count') or 0)
+    return {
+        'totalAttempts': count,
+        'passedCount': int(stats.get('passed') or 0),
+        'averageScore': round(float(stats.get('score_sum') or 0) / count, 2) if count else 0,
+        'latestSubmission': stats.get('latest_submitted_at')
+    }
@@ -0,0 +1,246 @@
+"""Flask session backends that keep the session cookie small.
+
+SESSION_BACKEND=sqlite (default): session data lives in a local SQLite file (WAL mode, so
+the workers on a host read it concurrently while one writes) and the cookie only holds a
+random session id. The id is replaced whenever the signed-in identity (uid or role)
+changes, so an id handed out before login is worthless afterwards (session fixation).
+A row is written when the session changes, and otherwise at most once
+per half lifetime to push its expiry forward; expired rows are swept every
+SESSION_SWEEP_INTERVAL seconds. Requests for static files never touch the store.
+
+SESSION_BACKEND=cookie: Flask's signed cookie, but session['user_progress'] and the
+module_<id>_pre_quiz / module_<id>_post_quiz flags travel as two short bitfields
+(utils.progress.pack_completion) instead of nested JSON. Only the pre/post quiz flags
+survive the round trip; scores and percents are re-read from Firestore by /api/progress.
+"""
+import os
+import re
+import secrets
+import sqlite3
+import threading
+import time
+from datetime import timedelta
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SecureCookieSessionInterface, SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+from utils.progress import pack_completion, unpack_completion
+
+SESSION_BACKEND = os.getenv('SESSION_BACKEND', 'sqlite').strip().lower()
+SESSION_DB_PATH = os.getenv('SESSION_DB_PATH', 'sessions.db')
+SESSION_LIFETIME = float(os.getenv('SESSION_LIFETIME', str(timedelta(days=31).total_seconds())))
+SESSION_SWEEP_INTERVAL = float(os.getenv('SESSION_SWEEP_INTERVAL', '600'))
+
+# Session keys that identify the signed-in user; a change issues a new session id
+AUTH_KEYS = ('uid', 'role')
+
+_QUIZ_FLAG = re.compile(r'^module_(\d+)_(pre|post)_quiz$')
+
+
+class SqliteSessionStore:
+    """sessions(id, data, expires) table in a WAL-mode SQLite file, one connection per thread."""
+
+    def __init__(self, path=SESSION_DB_PATH, sweep_interval=SESSION_SWEEP_INTERVAL):
+        self.path = path
+        self.sweep_interval = sweep_interval
+        self._local = threading.local()
+        self._sweep_lock = threading.Lock()
+        self._last_sweep = 0.0
+        conn = self._connect()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS sessions (
+                id TEXT PRIMARY KEY,
+                data BLOB NOT NULL,
+                expires REAL NOT NULL
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions (expires);
+        ''')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            # WAL: a commit only has to reach the log; readers never block the writer
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def load(self, sid):
+        """(data, expires) of a live session, or None."""
+        return self._connect().execute('SELECT data, expires FROM sessions WHERE id = ? AND expires > ?',
+                                       (sid, time.time())).fetchone()
+
+    def save(self, sid, data, expires):
+        self._connect().execute('INSERT OR REPLACE INTO sessions (id, data, expires) VALUES (?, ?, ?)',
+                                (sid, data, expires))
+        self.maybe_sweep()
+
+    def touch(self, sid, expires):
+        self._connect().execute('UPDATE sessions SET expires = ? WHERE id = ?', (expires, sid))
+        self.maybe_sweep()
+
+    def delete(self, sid):
+        self._connect().execute('DELETE FROM sessions WHERE id = ?', (sid,))
+
+    def sweep(self):
+        """Delete expired sessions. Returns the number removed."""
+        return self._connect().execute('DELETE FROM sessions WHERE expires <= ?', (time.time(),)).rowcount
+
+    def maybe_sweep(self):
+        now = time.monotonic()
+        if now - self._last_sweep < self.sweep_interval or not self._sweep_lock.acquire(blocking=False):
+            return
+        try:
+            self._last_sweep = now
+            removed = self.sweep()
+            if removed:
+                print(f"Session store: swept {removed} expired sessions")
+        except sqlite3.Error as e:
+            print(f"Session store sweep failed: {e}")
+        finally:
+            self._sweep_lock.release()
+
+    def stats(self):
+        live, = self._connect().execute('SELECT COUNT(*) FROM sessions WHERE expires > ?', (time.time(),)).fetchone()
+        total, = self._connect().execute('SELECT COUNT(*) FROM sessions').fetchone()
+        return {'path': self.path, 'live': live, 'expired': total - live}
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    """Session dict whose contents stay in the store; the cookie carries sid only."""
+
+    def __init__(self, initial=None, sid=None, expires=None):
+        def on_update(self):
+            self.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.expires = expires
+        self.modified = False
+        self.rotate = False
+        self.auth = self.auth_state()
+
+    def auth_state(self):
+        return tuple(self.get(key) for key in AUTH_KEYS)
+
+    def regenerate(self):
+        """Move the session to a new id when saved (the old id stops working)."""
+        self.rotate = True
+        self.modified = True
+
+
+class SqliteSessionInterface(SessionInterface):
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, store=None, lifetime=SESSION_LIFETIME):
+        self.store = store or SqliteSessionStore()
+        self.lifetime = lifetime
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if app.static_url_path and request.path.startswith(app.static_url_path + '/'):
+            # Static files never read the session: skip the lookup, and save_session writes nothing
+            return ServerSession(sid=sid)
+        if sid:
+            try:
+                row = self.store.load(sid)
+            except sqlite3.Error as e:
+                print(f"Session store read failed: {e}")
+                row = None
+            if row is not None:
+                try:
+                    return ServerSession(self.serializer.loads(row[0]), sid=sid, expires=row[1])
+                except Exception as e:
+                    print(f"Session {sid[:8]}... unreadable, starting a new one: {e}")
+        # Unknown or expired id: a fresh session gets a new id when first saved
+        return ServerSession()
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        secure = self.get_cookie_secure(app)
+        samesite = self.get_cookie_samesite(app)
+        httponly = self.get_cookie_httponly(app)
+        if session.accessed:
+            response.vary.add('Cookie')
+        if not session:
+            if session.modified and session.sid:
+                # Cleared (logout): drop the row and the cookie
+                try:
+                    self.store.delete(session.sid)
+                except sqlite3.Error as e:
+                    print(f"Session store delete failed: {e}")
+                response.delete_cookie(name, domain=domain, path=path, secure=secure,
+                                       samesite=samesite, httponly=httponly)
+            return
+        now = time.time()
+        expires = now + self.lifetime
+        try:
+            if session.sid and (session.rotate or session.auth_state() != session.auth):
+                # Signed in, out or as someone else: never keep a pre-authentication id
+                self.store.delete(session.sid)
+                session.sid = None
+        except sqlite3.Error as e:
+            print(f"Session store delete failed: {e}")
+            return
+        new_sid = session.sid is None
+        try:
+            if session.modified or new_sid:
+                session.sid = session.sid or secrets.token_urlsafe(32)
+                self.store.save(session.sid, self.serializer.dumps(dict(session)), expires)
+            elif session.expires is not None and session.expires - now < self.lifetime / 2:
+                # Sliding expiry, written at most once per half lifetime
+                self.store.touch(session.sid, expires)
+            else:
+                return
+        except sqlite3.Error as e:
+            print(f"Session store write failed: {e}")
+            return
+        if new_sid or session.permanent:
+            response.set_cookie(name, session.sid, expires=self.get_expiration_time(app, session),
+                                httponly=httponly, domain=domain, path=path, secure=secure,
+                                samesite=samesite)
+
+
+class CompactSessionSerializer(TaggedJSONSerializer):
+    """TaggedJSONSerializer that packs progress and quiz flags into bitfields."""
+
+    def dumps(self, value):
+        value = dict(value)
+        flags = {}
+        for key in [k for k in value if _QUIZ_FLAG.match(k)]:
+            module_id, quiz_type = _QUIZ_FLAG.match(key).groups()
+            entry = flags.setdefault(module_id, {})
+            entry[f'{quiz_type}_quiz_completed'] = value.pop(key) is True
+        if flags:
+            value['_q'] = list(pack_completion(flags))
+        if 'user_progress' in value:
+            value['_p'] = list(pack_completion(value.pop('user_progress')))
+        return super().dumps(value)
+
+    def loads(self, value):
+        value = super().loads(value)
+        if '_q' in value:
+            bits, rest = value.pop('_q')
+            for mid, entry in unpack_completion(bits, rest).modules.items():
+                if entry.pre_quiz_completed:
+                    value[f'module_{mid}_pre_quiz'] = True
+                if entry.post_quiz_completed:
+                    value[f'module_{mid}_post_quiz'] = True
+        if '_p' in value:
+            bits, rest = value.pop('_p')
+            value['user_progress'] = unpack_completion(bits, rest).to_dict()
+        return value
+
+
+class CompactCookieSessionInterface(SecureCookieSessionInterface):
+    serializer = CompactSessionSerializer()
+
+
+def make_session_interface():
+    """The session interface selected by SESSION_BACKEND."""
+    if SESSION_BACKEND == 'cookie':
+        return CompactCookieSessionInterface()
+    return SqliteSessionInterface()
@@ -0,0 +1,100 @@
+"""Preload quiz and lesson content into the process caches when a worker starts.
+
+Without a published content snapshot (utils.content_snapshot), every (module, pre/post)
+quiz from get_numeric_to_firebase_map() and the lesson_info table are loaded
+concurrently on a small thread pool, within a time budget, in a background thread so
+the worker can already answer /ready with 503 meanwhile. The load balancer only routes
+traffic to workers whose readiness check returns 200.
+
+Gunicorn imports the app in each worker after forking, so starting warm-up from
+QuizApp.__init__ is per worker. With --preload, call start_warmup() from a post_fork
+hook instead (threads do not survive fork).
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+WARMUP_BUDGET = float(os.getenv('WARMUP_BUDGET', '20'))
+WARMUP_WORKERS = int(os.getenv('WARMUP_WORKERS', '4'))
+
+_lock = threading.Lock()
+_state = {
+    'started_at': None,
+    'finished_at': None,
+    'ready': False,
+    'complete': False,
+    'loaded': [],
+    'failed': {}
+}
+
+
+def _tasks():
+    from utils.content_snapshot import snapshot_info
+    if snapshot_info() is not None:
+        # Content is read from the shared snapshot; opening it on this thread is enough
+        return [('content_snapshot', snapshot_info, ())]
+    from utils.quiz_handler import get_numeric_to_firebase_map, preload_quiz
+    from utils.lesson_content import preload_lesson_info
+    tasks = [(f'quiz:{module_id}:{quiz_type}', preload_quiz, (module_id, quiz_type))
+             for module_id in sorted(get_numeric_to_firebase_map())
+             for quiz_type in ('pre', 'post')]
+    tasks.append(('lesson_info', preload_lesson_info, ()))
+    return tasks
+
+
+def warm_up(budget=WARMUP_BUDGET, workers=WARMUP_WORKERS):
+    """Load all content, waiting at most budget seconds; returns the status dict.
+    Loads still running when the budget runs out are abandoned (they finish in the background).
+    """
+    started = time.monotonic()
+    with _lock:
+        _state.update(started_at=time.time(), finished_at=None, ready=False, complete=False,
+                      loaded=[], failed={})
+    pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='warmup')
+    futures = {pool.submit(func, *args): name for name, func, args in _tasks()}
+    done, not_done = wait(futures, timeout=budget)
+    pool.shutdown(wait=False, cancel_futures=True)
+    loaded, failed = [], {}
+    for future in done:
+        try:
+            future.result()
+            loaded.append(futures[future])
+        except Exception as e:
+            failed[futures[future]] = str(e)
+    for future in not_done:
+        failed[futures[future]] = 'timed out'
+    with _lock:
+        # Ready even after a timeout or errors: those requests just load on demand
+        _state.update(finished_at=time.time(), ready=True, complete=not failed,
+                      loaded=sorted(loaded), failed=failed)
+    print(f"Warm-up loaded {len(loaded)} items in {time.monotonic() - started:.2f}s"
+          + (f", {len(failed)} not loaded: {', '.join(sorted(failed))}" if failed else ''))
+    return warmup_status()
+
+
+def start_warmup(budget=WARMUP_BUDGET, workers=WARMUP_WORKERS):
+    """Run warm_up() in a daemon thread."""
+    with _lock:
+        _state.update(started_at=time.time(), ready=False)
+    thread = threading.Thread(target=warm_up, args=(budget, workers), name='warmup', daemon=True)
+    thread.start()
+    return thread
+
+
+def mark_ready():
+    """Report ready without warming up (warm-up disabled)."""
+    with _lock:
+        _state.update(ready=True, finished_at=time.time())
+
+
+def warmup_status():
+    with _lock:
+        return {
+            'ready': _state['ready'],
+            'complete': _state['complete'],
+            'started_at': _state['started_at'],
+            'finished_at': _state['finished_at'],
+            'loaded': len(_state['loaded']),
+            'failed': dict(_state['failed'])
+        }